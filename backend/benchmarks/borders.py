@@ -0,0 +1,101 @@
+"""Compare text borders with the compact binary encoding.
+
+Run from the backend directory:
+
+    python -m benchmarks.borders --communities 20000 --days 7
+
+Synthetic borders of 20-80 points are written once as text per community per
+day (the old layout) and once deduplicated as binary blobs, then both are
+decoded into NumPy arrays.
+"""
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+
+import numpy as np
+
+from spider.geometry import border_hash, decode_border, encode_border
+
+
+def make_borders(count: int, seed: int = 0) -> list[str]:
+    rng = np.random.default_rng(seed)
+    borders = []
+    for _ in range(count):
+        center = rng.uniform([120.8, 30.7], [122.0, 31.8])
+        n = rng.integers(20, 80)
+        angle = np.sort(rng.uniform(0, 2 * np.pi, n))
+        radius = rng.uniform(0.001, 0.004, n)
+        points = center + np.c_[np.cos(angle), np.sin(angle)] * radius[:, None]
+        borders.append(';'.join(f'{x:.6f},{y:.6f}' for x, y in points))
+    return borders
+
+
+def parse_text(text: str) -> np.ndarray:
+    return np.array(
+        [point.split(',') for point in text.split(';')], dtype=np.float64
+    )
+
+
+def db_size(rows: list[tuple], schema: str, insert: str) -> int:
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    try:
+        with sqlite3.connect(path) as conn:
+            conn.execute(schema)
+            conn.executemany(insert, rows)
+        return os.path.getsize(path)
+    finally:
+        os.remove(path)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--communities', type=int, default=20000)
+    parser.add_argument('--days', type=int, default=7)
+    args = parser.parse_args()
+
+    borders = make_borders(args.communities)
+    text_rows = [
+        (i, day, text)
+        for day in range(args.days) for i, text in enumerate(borders)
+    ]
+    text_size = db_size(
+        text_rows,
+        'create table t (id int, ds int, border text)',
+        'insert into t values (?, ?, ?)',
+    )
+    blobs = {border_hash(text): encode_border(text) for text in borders}
+    hash_rows = [
+        (i, day, border_hash(text))
+        for day in range(args.days) for i, text in enumerate(borders)
+    ]
+    blob_size = db_size(
+        hash_rows,
+        'create table t (id int, ds int, border_hash text)',
+        'insert into t values (?, ?, ?)',
+    ) + db_size(
+        list(blobs.items()),
+        'create table b (hash text primary key, data blob)',
+        'insert into b values (?, ?)',
+    )
+
+    start = time.perf_counter()
+    for text in borders:
+        parse_text(text)
+    text_decode = time.perf_counter() - start
+    start = time.perf_counter()
+    for data in blobs.values():
+        decode_border(data)
+    blob_decode = time.perf_counter() - start
+
+    print(f'{args.communities} communities x {args.days} days')
+    print(f'db size     text {text_size / 1e6:8.2f} MB   '
+          f'binary {blob_size / 1e6:8.2f} MB')
+    print(f'decode      text {text_decode * 1e3:8.1f} ms   '
+          f'binary {blob_decode * 1e3:8.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
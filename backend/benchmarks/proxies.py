@@ -0,0 +1,162 @@
+"""Drive the proxy pool through local stand-in proxies.
+
+Run from the backend directory:
+
+    python -m benchmarks.proxies --requests 400 --concurrency 8
+
+A local origin server is fronted by forward proxies on localhost: a fast
+one, a slow one, one that answers 429 a third of the time and one that
+refuses connections. Requests for a handful of communities go through
+`ProxyPool`, and the per-proxy stats show how the traffic was spread,
+which proxies got evicted and how well keys stuck to one proxy.
+
+A request failing on a proxy or answered with a ban status is retried
+through another one up to `--retries` times, as `BeikeMapSpider.get`
+does; requests still failing after that are reported, since they would
+abort a crawl stage.
+"""
+import argparse
+import random
+import threading
+import time
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from spider.proxies import BAN_STATUS, ProxyPool
+
+
+class OriginHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = b'ok'
+        self.send_response(200)
+        self.send_header('content-length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def proxy_handler(delay: float, ban_rate: float):
+    class ProxyHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(delay)
+            if random.random() < ban_rate:
+                self.send_response(429)
+                self.send_header('content-length', '0')
+                self.end_headers()
+                return
+            # forward proxies receive the absolute url as the path
+            with urllib.request.urlopen(self.path) as upstream:
+                body = upstream.read()
+                self.send_response(upstream.status)
+            self.send_header('content-length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return ProxyHandler
+
+
+def serve(handler) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--communities', type=int, default=20)
+    parser.add_argument('--retries', type=int, default=2)
+    args = parser.parse_args()
+    random.seed(0)
+
+    origin = serve(OriginHandler)
+    origin_url = f'http://127.0.0.1:{origin.server_port}'
+    proxies = {
+        'fast': serve(proxy_handler(0.005, 0.0)),
+        'slow': serve(proxy_handler(0.05, 0.0)),
+        'banned': serve(proxy_handler(0.005, 0.33)),
+    }
+    urls = [f'http://127.0.0.1:{s.server_port}' for s in proxies.values()]
+    # nothing listens here, so every request through it fails
+    dead = ThreadingHTTPServer(('127.0.0.1', 0), OriginHandler)
+    urls.append(f'http://127.0.0.1:{dead.server_port}')
+    dead.server_close()
+    names = dict(zip(urls, [*proxies, 'dead']))
+
+    pool = ProxyPool(
+        urls, max_concurrency=2, min_interval=0.01, backoff=1, max_backoff=4
+    )
+    used = defaultdict(set)
+    retries = []
+
+    def send(key: str, tried: list[str]) -> int:
+        proxy = pool.acquire(key, exclude=tried)
+        tried.append(proxy.url)
+        used[key].add(proxy.url)
+        status = None
+        start = time.monotonic()
+        try:
+            status = requests.get(
+                f'{origin_url}/xiaoqu/{key}/',
+                proxies=proxy.proxies,
+                timeout=5,
+            ).status_code
+            return status
+        finally:
+            pool.release(proxy, status, time.monotonic() - start)
+
+    def fetch(i: int) -> int | None:
+        key = str(i % args.communities)
+        tried = []
+        for attempt in range(args.retries + 1):
+            try:
+                status = send(key, tried)
+            except requests.RequestException:
+                if attempt == args.retries:
+                    return None
+            else:
+                if status not in BAN_STATUS or attempt == args.retries:
+                    return status
+            retries.append(i)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as executor:
+        statuses = list(executor.map(fetch, range(args.requests)))
+    elapsed = time.perf_counter() - start
+
+    ok = sum(status == 200 for status in statuses)
+    failed = sum(status is None for status in statuses)
+    print(
+        f'{args.requests} requests in {elapsed:.2f} s, {ok} ok, '
+        f'{args.requests / elapsed:.0f} req/s'
+    )
+    print(
+        f'{len(retries)} retries on another proxy, '
+        f'{failed} requests failed after {args.retries} retries'
+    )
+    print(f'{"proxy":8} {"requests":>8} {"failures":>8} {"bans":>5} '
+          f'{"latency":>8} {"errors":>7} evicted')
+    for proxy, stats in zip(pool.proxies, pool.stats()):
+        latency = stats['latency']
+        print(
+            f'{names[proxy.url]:8} {stats["request_count"]:>8} '
+            f'{stats["failure_count"]:>8} {stats["ban_count"]:>5} '
+            f'{latency * 1e3 if latency else 0:>6.1f}ms '
+            f'{stats["errors"]:>7} {stats["evicted"]}'
+        )
+    proxies_per_key = sum(len(u) for u in used.values()) / len(used)
+    print(f'{proxies_per_key:.2f} proxies used per community on average')
+
+
+if __name__ == '__main__':
+    main()
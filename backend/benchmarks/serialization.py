@@ -0,0 +1,88 @@
+"""Serialization time and bytes on the wire for representative payloads.
+
+Run from the backend directory:
+
+    python -m benchmarks.serialization
+"""
+import gzip
+import json
+import time
+
+import numpy as np
+
+from spider.responses import dumps
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def make_payloads() -> dict[str, object]:
+    rng = np.random.default_rng(0)
+    log_line = (
+        '2026-10-19 12:00:00 INFO Crawling details for house 107104592398\n'
+    )
+    communities = [
+        {
+            'id': int(5011000000000 + i),
+            'city_code': '310000',
+            'name': f'小区{i}',
+            'longitude': float(rng.uniform(121, 122)),
+            'latitude': float(rng.uniform(31, 32)),
+            'count': int(rng.integers(0, 200)),
+            'priceStr': f'{rng.integers(2, 15)}.{rng.integers(0, 9)}万',
+        }
+        for i in range(5000)
+    ]
+    districts = [f'区{i}' for i in range(16)]
+    dashboard = {
+        'summary': {'listing_count': 500000, 'median_unit_price': 61234.0},
+        'districts': {
+            'district_name': districts,
+            'median': rng.uniform(3e4, 1.2e5, 16).round(0).tolist(),
+            'count': rng.integers(1000, 50000, 16).tolist(),
+        },
+        'blocks': {
+            'block_name': [f'板块{i}' for i in range(300)],
+            'median': rng.uniform(3e4, 1.2e5, 300).round(0).tolist(),
+            'count': rng.integers(10, 5000, 300).tolist(),
+        },
+    }
+    return {
+        'spider_log (5 MB)': {
+            'ds': '20261019',
+            'spider_log': log_line * (5_000_000 // len(log_line)),
+        },
+        'communities (5000)': {'items': communities},
+        'dashboard': dashboard,
+    }
+
+
+def timed(func, repeat: int = 5) -> tuple[float, bytes]:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    for name, payload in make_payloads().items():
+        json_time, json_body = timed(
+            lambda: json.dumps(payload, ensure_ascii=False).encode()
+        )
+        orjson_time, orjson_body = timed(lambda: dumps(payload))
+        gzip_body = gzip.compress(orjson_body, compresslevel=6)
+        print(name)
+        print(f'  json   {json_time * 1e3:8.2f} ms  {len(json_body):>10,} B')
+        print(f'  orjson {orjson_time * 1e3:8.2f} ms  {len(orjson_body):>10,} B')
+        print(f'  gzip   {len(gzip_body):>22,} B')
+        if brotli is not None:
+            brotli_body = brotli.compress(orjson_body, quality=5)
+            print(f'  brotli {len(brotli_body):>22,} B')
+
+
+if __name__ == '__main__':
+    main()
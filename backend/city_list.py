@@ -1,87 +1,156 @@
-
-import csv
+import hashlib
 import json
-import asyncio
 import os
-import re
-import time
+import pathlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import dotenv
+import numpy as np
 import requests
 from bs4 import BeautifulSoup
 
+from spider.cities import load_adcode_index
+from spider.constant import USER_AGENT
 
-def crawl_city_list() -> list[dict]:
-    dotenv.load_dotenv()
-    city_code_map = {}
-    city_code_map_abbr = {}
-    with open('data/AMap_adcode_citycode.csv', 'r', encoding='utf-8') as file:
-        csv_reader = csv.reader(file)
-        headers = next(csv_reader)
-        for row in csv_reader:
-            city_code_map[row[0]] = row[1]
-            city_code_map_abbr[row[0][:2]] = row[1]
+
+AMAP_DISTRICT_URL = 'https://restapi.amap.com/v3/config/district'
+AMAP_CACHE_DIR = pathlib.Path('data/amap_cache')
+CITY_LIST_PATH = pathlib.Path('data/city_list.json')
+
+
+def crawl_ke_cities() -> list[tuple[str, str]]:
     res = requests.get(
-        'https://www.ke.com/city/', 
-        headers={
-            'user-agent': (
-                'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) '
-                'AppleWebKit/537.36 (KHTML, like Gecko) '
-                'Chrome/138.0.0.0 '
-                'Safari/537.36'
-            )
-        }
+        'https://www.ke.com/city/', headers={'user-agent': USER_AGENT}
     )
     res.raise_for_status()
     soup = BeautifulSoup(res.content, 'html.parser')
-    city_list = []
+    ke_cities = []
     city_root_ul = soup.find("ul", class_="city_list_ul")
     for province_group in city_root_ul.find_all("div", class_="city_province"):
         for city_li in province_group.find_all("li", class_="CLICKDATA"):
             city_a_tag = city_li.find("a")
             city_name = city_a_tag.get_text(strip=True)
             city_url = 'https:' + city_a_tag.get("href")
-            print(city_name)
-            if city_name + '市' in city_code_map:
-                city_code = city_code_map[city_name + '市']
-            else:
-                city_code = city_code_map_abbr[city_name[:2]]
-            res = requests.get(
-                url='https://restapi.amap.com/v3/config/district', 
-                headers={
-                    'user-agent': (
-                        'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) '
-                        'AppleWebKit/537.36 (KHTML, like Gecko) '
-                        'Chrome/138.0.0.0 '
-                        'Safari/537.36'
-                    )
-                }, 
-                params={
-                    'key': os.getenv('AMAP_API_KEY'), 
-                    'keywords': city_code, 
-                    'subdistrict': 0,
-                    'extensions': 'all'
-                }
+            ke_cities.append((city_name, city_url))
+    return ke_cities
+
+
+def fetch_district(adcode: str, refresh: bool = False) -> dict:
+    """Fetch the AMap district response for `adcode`, cached on disk."""
+    cache_file = AMAP_CACHE_DIR / f'{adcode}.json'
+    if cache_file.exists() and not refresh:
+        with open(cache_file, encoding='utf-8') as f:
+            return json.load(f)
+    res = requests.get(
+        url=AMAP_DISTRICT_URL,
+        headers={'user-agent': USER_AGENT},
+        params={
+            'key': os.getenv('AMAP_API_KEY'),
+            'keywords': adcode,
+            'subdistrict': 0,
+            'extensions': 'all'
+        }
+    )
+    res.raise_for_status()
+    result = res.json()
+    if not result.get('districts'):
+        raise ValueError(f'No district found for adcode {adcode}: {result}')
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    with open(cache_file, mode='w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False)
+    return result
+
+
+def polyline_bounds(polyline: str) -> dict[str, float]:
+    # polyline is `x,y;x,y|x,y...`, parse it in one pass into an (n, 2) array
+    points = np.array(
+        polyline.replace(';', ',').replace('|', ',').split(','),
+        dtype=np.float64
+    ).reshape(-1, 2)
+    mins, maxs = points.min(axis=0), points.max(axis=0)
+    # keep the key naming of the existing city_list.json, where the first
+    # polyline coordinate is stored as *_lat
+    return {
+        'min_lat': float(mins[0]),
+        'max_lat': float(maxs[0]),
+        'min_lon': float(mins[1]),
+        'max_lon': float(maxs[1]),
+    }
+
+
+def source_hash(city_name: str, city_url: str, city_code: str) -> str:
+    content = f'{city_name}|{city_url}|{city_code}'
+    return hashlib.sha1(content.encode()).hexdigest()[:16]
+
+
+def build_city(
+    city_name: str, city_url: str, city_code: str, refresh: bool = False
+) -> dict:
+    district = fetch_district(city_code, refresh=refresh)
+    return {
+        'name': city_name,
+        'url': city_url,
+        'code': city_code,
+        **polyline_bounds(district['districts'][0]['polyline']),
+    }
+
+
+def build_city_list(
+    ke_cities: list[tuple[str, str]],
+    old_city_list: list[dict],
+    max_workers: int = 4,
+    refresh: bool = False,
+) -> list[dict]:
+    """Build the city list, only recomputing cities whose source changed.
+
+    A city is reused from `old_city_list` when its name, url and adcode are
+    unchanged. The others are built concurrently with at most `max_workers`
+    AMap requests in flight; responses already in the disk cache are not
+    requested again, so a fully cached rebuild runs offline.
+    """
+    adcode_index = load_adcode_index()
+    old_cities = {
+        source_hash(c['name'], c['url'], c['code']): c for c in old_city_list
+    }
+    city_list = [None] * len(ke_cities)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+        for i, (city_name, city_url) in enumerate(ke_cities):
+            city_code = adcode_index.lookup(city_name)
+            if city_code is None:
+                print(f'No adcode found for {city_name}, skipped')
+                continue
+            key = source_hash(city_name, city_url, city_code)
+            if key in old_cities and not refresh:
+                city_list[i] = old_cities[key]
+                continue
+            future = executor.submit(
+                build_city, city_name, city_url, city_code, refresh
             )
-            res.raise_for_status()
-            result = res.json()
-            polyline = result['districts'][0]['polyline']
-            lat_list, lon_list = [], []
-            for point in re.split(r'[;|]', polyline):
-                lat, lon = point.split(',')
-                lat_list.append(float(lat))
-                lon_list.append(float(lon))
-            min_lat, max_lat = min(lat_list), max(lat_list)
-            min_lon, max_lon = min(lon_list), max(lon_list)
-            time.sleep(0.5)
-            city_list.append({
-                'name': city_name, 
-                'url': city_url,
-                'code': city_code,
-                'min_lat': min_lat,
-                'max_lat': max_lat,
-                'min_lon': min_lon,
-                'max_lon': max_lon,
-            })
-    with open('data/city_list.json', mode='w') as f:
+            futures[future] = i
+        for future in as_completed(futures):
+            city = future.result()
+            city_list[futures[future]] = city
+            print(city['name'], city['code'])
+    return [city for city in city_list if city is not None]
+
+
+def crawl_city_list(max_workers: int = 4, refresh: bool = False) -> list[dict]:
+    dotenv.load_dotenv()
+    old_city_list = []
+    if CITY_LIST_PATH.exists():
+        with open(CITY_LIST_PATH, encoding='utf-8') as f:
+            old_city_list = json.load(f)
+    city_list = build_city_list(
+        crawl_ke_cities(),
+        old_city_list,
+        max_workers=max_workers,
+        refresh=refresh
+    )
+    with open(CITY_LIST_PATH, mode='w', encoding='utf-8') as f:
         json.dump(city_list, f, indent=2, ensure_ascii=False)
+    return city_list
+
+
+if __name__ == '__main__':
+    crawl_city_list()
@@ -6,16 +6,35 @@ import pathlib
 from contextlib import asynccontextmanager
 from datetime import datetime
 
-from fastapi import FastAPI, Request, BackgroundTasks, HTTPException
+from fastapi import Body, FastAPI, Request, HTTPException
+from fastapi.responses import Response, StreamingResponse
 from sqlalchemy import create_engine
 from sqlalchemy.orm import Session
 from sqlalchemy.orm import sessionmaker
 
-from spider import BeikeMapSpider
+from spider.analytics import AnalyticsEngine
+from spider.attributes import GROUP_BY, attribute_stats
+from spider.cache import DsCache
+from spider.cities import load_city_registry
+from spider.comparables import ComparablesIndex
+from spider.database import count_progress, init_database
 from spider.models import Base
 from spider.models import City
 from spider.models import Community, CommunityProgress
 from spider.models import House, HouseProgress
+from spider.models import Border, PriceTile
+from spider.models import CrawlSession
+from spider.lifecycle import list_events
+from spider.price_index import LEVELS, price_trend
+from spider.query import QueryError, build_query, column_types, fetch_page
+from spider.query import iter_rows, latest_ds
+from spider.responses import CompressionMiddleware, ORJSONResponse
+from spider.responses import read_chunks, stream_arrow, stream_ndjson
+from spider.responses import HAS_ARROW, stream_text_field
+from spider.runner import SpiderRunner
+from spider.search import search
+from spider.spatial import SpatialIndex
+from spider.warehouse import REPORTS, Warehouse, WarehouseError
 
 
 @asynccontextmanager
@@ -23,123 +42,542 @@ async def lifespan(app: FastAPI):
     # initialize database
     db_url = os.getenv('DATABASE_URL') or 'sqlite:///data/beike_house.db'
     engine = create_engine(db_url)
-    Base.metadata.create_all(bind=engine)
+    init_database(engine)
     app.state.Session = sessionmaker(bind=engine)
     
     # load city list
-    with open('data/city_list.json') as f:
-        city_list = json.load(f)
+    app.state.cities = load_city_registry()
     with app.state.Session() as session:
-        for city in city_list:
-            if session.query(City).filter(City.name == city['name']).first():
-                continue
-            session.add(City(**city))
-        session.commit()
-    
+        app.state.cities.upsert(session)
+
+    app.state.runner = SpiderRunner()
+    app.state.analytics = AnalyticsEngine(app.state.Session)
+    app.state.spatial = SpatialIndex(app.state.Session)
+    app.state.comparables = ComparablesIndex(app.state.Session)
+    app.state.tile_cache = DsCache(max_entries=4096)
+    app.state.warehouse = Warehouse(
+        db_url, os.getenv('RETENTION_ARCHIVE_DIR', 'data/archive')
+    )
     yield
+    app.state.runner.shutdown()
 
 
-app = FastAPI(lifespan=lifespan)
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+app.add_middleware(CompressionMiddleware, minimum_size=1024)
 
 
 @app.get('/city_list')
 async def get_city_list(request: Request):
-    with request.app.state.Session() as session:
-        city_list = session.query(City).all()
-    return {
-        city.name: city.code for city in city_list
-    }
-
-
-def start_spider(request: Request, city_code: str):
-    try:
-        with BeikeMapSpider(city_code, request.app.state.Session) as spider:
-            request.app.state.spider = spider
-            request.app.state.spider.run()
-    finally:
-        delattr(request.app.state, 'spider')
+    cities = request.app.state.cities
+    headers = {'ETag': f'"{cities.version}"', 'Cache-Control': 'no-cache'}
+    if request.headers.get('if-none-match') == headers['ETag']:
+        return Response(status_code=304, headers=headers)
+    return ORJSONResponse(cities.name_to_code, headers=headers)
 
 
 @app.post('/run_spider')
-async def run_spider(
-    city_code: str, request: Request, background_tasks: BackgroundTasks
-):
-    background_tasks.add_task(
-        start_spider, request=request, city_code=city_code
-    )
+async def run_spider(city_code: str, request: Request):
+    if request.app.state.cities.get(city_code) is None:
+        raise HTTPException(404, f'Unknown city code {city_code}')
+    if not request.app.state.runner.start(city_code):
+        raise HTTPException(409, 'Spider is already running')
     return {'msg': 'spider started', 'city_code': city_code}
 
 
 @app.get('/is_spider_running')
 async def get_is_spider_running(request: Request):
-    return {'is_spider_running': hasattr(request.app.state, 'spider')}
+    return {'is_spider_running': request.app.state.runner.is_running()}
+
+
+@app.get('/spider_status')
+async def get_spider_status(request: Request):
+    return request.app.state.runner.status()
 
 
 @app.post('/stop_spider')
 async def stop_spider(request: Request):
-    if not hasattr(request.app.state, 'spider'):
+    if not request.app.state.runner.stop():
         raise HTTPException(404, 'No running spider')
-    request.app.state.spider.interrupted = True
     return {'msg': 'spider stopped'}
 
 
+@app.post('/pause_spider')
+async def pause_spider(request: Request):
+    if not request.app.state.runner.pause():
+        raise HTTPException(409, 'Spider is not running')
+    return {'msg': 'spider paused'}
+
+
+@app.post('/resume_spider')
+async def resume_spider(request: Request):
+    if not request.app.state.runner.resume():
+        raise HTTPException(409, 'Spider is not paused')
+    return {'msg': 'spider resumed'}
+
+
+@app.get('/crawl_sessions')
+def get_crawl_sessions(request: Request):
+    with request.app.state.Session() as session:
+        rows = session.query(CrawlSession).order_by(CrawlSession.id).all()
+        return {
+            'sessions': [
+                {
+                    'id': row.id,
+                    'name': row.name,
+                    'created_at': row.created_at,
+                    'request_count': row.request_count,
+                    'failure_count': row.failure_count,
+                    'consecutive_failures': row.consecutive_failures,
+                    'last_used_at': row.last_used_at,
+                    'cooldown_until': row.cooldown_until,
+                    'is_disabled': row.is_disabled,
+                }
+                for row in rows
+            ]
+        }
+
+
+@app.post('/crawl_sessions')
+def add_crawl_session(
+    request: Request,
+    cookie: str = Body(embed=True),
+    name: str | None = Body(default=None, embed=True),
+):
+    with request.app.state.Session() as session:
+        row = CrawlSession(
+            name=name,
+            cookie=cookie,
+            created_at=datetime.now(),
+            request_count=0,
+            failure_count=0,
+            consecutive_failures=0,
+            is_disabled=False,
+        )
+        session.add(row)
+        session.commit()
+        return {'id': row.id}
+
+
+@app.post('/crawl_sessions/{session_id}/enable')
+def enable_crawl_session(session_id: int, request: Request):
+    with request.app.state.Session() as session:
+        row = session.get(CrawlSession, session_id)
+        if row is None:
+            raise HTTPException(404, f'Session {session_id} not found')
+        row.is_disabled = False
+        row.consecutive_failures = 0
+        row.cooldown_until = None
+        session.commit()
+    return {'msg': f'session {session_id} enabled'}
+
+
+@app.delete('/crawl_sessions/{session_id}')
+def delete_crawl_session(session_id: int, request: Request):
+    with request.app.state.Session() as session:
+        row = session.get(CrawlSession, session_id)
+        if row is None:
+            raise HTTPException(404, f'Session {session_id} not found')
+        session.delete(row)
+        session.commit()
+    return {'msg': f'session {session_id} deleted'}
+
+
 @app.get('/spider_progress')
-async def get_spider_progress(city_name: str, request: Request):
+def get_spider_progress(city_name: str, request: Request):
+    today_ds = datetime.today().strftime(r'%Y%m%d')
     with request.app.state.Session() as db_session:
-        result = {}
-        today_ds = datetime.today().strftime(r'%Y%m%d')
-        result['ds'] = today_ds
-        community_progresses = (
-            db_session
-            .query(CommunityProgress)
-            .filter(CommunityProgress.ds == today_ds)
-            .all()
+        return {'ds': today_ds, **count_progress(db_session, today_ds)}
+
+
+@app.get('/analytics/ds_list')
+def get_analytics_ds_list(city_code: str, request: Request):
+    return {'ds_list': request.app.state.analytics.list_ds(city_code)}
+
+
+@app.get('/analytics/dashboard')
+def get_analytics_dashboard(
+    city_code: str, request: Request, ds: str | None = None
+):
+    analytics = request.app.state.analytics
+    if ds is None:
+        ds_list = analytics.list_ds(city_code)
+        if not ds_list:
+            raise HTTPException(404, f'No data for city {city_code}')
+        ds = ds_list[0]
+    return ORJSONResponse(analytics.dashboard(city_code, ds))
+
+
+def query_listings(
+    request: Request,
+    model,
+    city_code: str,
+    ds: str | None,
+    format: str,
+    limit: int | None,
+    **filters
+):
+    if format not in ('json', 'ndjson', 'arrow'):
+        raise HTTPException(400, 'format must be json, ndjson or arrow')
+    if format == 'arrow' and not HAS_ARROW:
+        raise HTTPException(400, 'Arrow output requires pyarrow')
+    Session = request.app.state.Session
+    if ds is None:
+        with Session() as session:
+            ds = latest_ds(session, model, city_code)
+        if ds is None:
+            raise HTTPException(404, f'No data for city {city_code}')
+    try:
+        stmt, sort_column = build_query(model, city_code, ds, **filters)
+    except QueryError as e:
+        raise HTTPException(400, str(e))
+
+    if format == 'json':
+        with Session() as session:
+            return ORJSONResponse(fetch_page(
+                session, stmt, sort_column, min(max(limit or 100, 1), 1000),
+                sort=filters['sort'], order=filters['order'],
+            ))
+    # streamed formats are meant for bulk exports, so no default limit
+    if limit is not None:
+        stmt = stmt.limit(max(limit, 1))
+    rows = iter_rows(Session, stmt)
+    if format == 'ndjson':
+        return stream_ndjson(rows)
+    return stream_arrow(column_types(stmt), rows)
+
+
+@app.get('/houses')
+def get_houses(
+    city_code: str,
+    request: Request,
+    ds: str | None = None,
+    district: str | None = None,
+    block: str | None = None,
+    min_price: float | None = None,
+    max_price: float | None = None,
+    min_unit_price: float | None = None,
+    max_unit_price: float | None = None,
+    min_area: float | None = None,
+    max_area: float | None = None,
+    sort: str = 'id',
+    order: str = 'asc',
+    limit: int | None = None,
+    cursor: str | None = None,
+    format: str = 'json',
+):
+    return query_listings(
+        request, House, city_code, ds, format, limit,
+        district=district,
+        block=block,
+        min_price=min_price,
+        max_price=max_price,
+        min_unit_price=min_unit_price,
+        max_unit_price=max_unit_price,
+        min_area=min_area,
+        max_area=max_area,
+        sort=sort,
+        order=order,
+        cursor=cursor,
+    )
+
+
+@app.get('/analytics/price_index')
+def get_analytics_price_index(
+    city_code: str,
+    request: Request,
+    level: str = 'city',
+    name: str = '',
+    start_ds: str | None = None,
+    end_ds: str | None = None,
+):
+    if level not in LEVELS:
+        raise HTTPException(400, f'level must be one of {", ".join(LEVELS)}')
+    with request.app.state.Session() as session:
+        trend = price_trend(
+            session, city_code, level, name, start_ds, end_ds
         )
-        result['community_list'] = {
-            'finished': sum([p.is_finished for p in community_progresses]),
-            'total': len(community_progresses)
-        }
-        house_progresses = (
-            db_session
-            .query(HouseProgress)
-            .filter(HouseProgress.ds == today_ds)
-            .all()
+    return ORJSONResponse({'level': level, 'name': name, **trend})
+
+
+@app.get('/listing_events')
+def get_listing_events(
+    city_code: str,
+    request: Request,
+    ds: str | None = None,
+    kind: str | None = None,
+    limit: int = 1000,
+):
+    with request.app.state.Session() as session:
+        ds = ds or latest_ds(session, House, city_code)
+        if ds is None:
+            raise HTTPException(404, f'No data for city {city_code}')
+        events = list_events(
+            session, city_code, ds, kind, limit=min(max(limit, 1), 10000)
         )
-        result['house_list'] = {
-            'finished': sum([1 - p.has_more for p in house_progresses]),
-            'total': len(house_progresses)
+    return ORJSONResponse({'ds': ds, 'events': events})
+
+
+@app.get('/analytics/attributes')
+def get_analytics_attributes(
+    city_code: str,
+    key: str,
+    request: Request,
+    ds: str | None = None,
+    group_by: str = 'district',
+):
+    if group_by not in GROUP_BY:
+        raise HTTPException(400, f'group_by must be one of {GROUP_BY}')
+    with request.app.state.Session() as session:
+        ds = ds or latest_ds(session, Community, city_code)
+        if ds is None:
+            raise HTTPException(404, f'No data for city {city_code}')
+        return {
+            'ds': ds,
+            'key': key,
+            'groups': attribute_stats(session, city_code, ds, key, group_by),
         }
-        communities = (
-            db_session
-            .query(Community)
-            .filter(Community.ds == today_ds)
-            .all()
+
+
+@app.get('/analytics/reports')
+def get_analytics_reports():
+    return {
+        'reports': [
+            {'name': name, 'description': description, 'params': params}
+            for name, (description, params, _) in REPORTS.items()
+        ]
+    }
+
+
+@app.get('/analytics/reports/{name}')
+def get_analytics_report(name: str, request: Request):
+    if name not in REPORTS:
+        raise HTTPException(404, f'Unknown report: {name}')
+    try:
+        result = request.app.state.warehouse.report(
+            name, dict(request.query_params)
         )
-        result['community_detail'] = {
-            'finished': sum([c.is_detail_crawled for c in communities]),
-            'total': len(communities)
-        }
-        houses = (
-            db_session
-            .query(House)
-            .filter(House.ds == today_ds)
-            .all()
+    except WarehouseError as e:
+        raise HTTPException(400, str(e))
+    return ORJSONResponse({'name': name, **result})
+
+
+@app.post('/analytics/query')
+def post_analytics_query(
+    request: Request,
+    sql: str = Body(embed=True),
+    params: dict | None = Body(default=None, embed=True),
+):
+    try:
+        result = request.app.state.warehouse.query(sql, params)
+    except WarehouseError as e:
+        raise HTTPException(400, str(e))
+    return ORJSONResponse(result)
+
+
+@app.get('/houses/{house_id}/comparables')
+def get_house_comparables(
+    house_id: int,
+    city_code: str,
+    request: Request,
+    ds: str | None = None,
+    k: int = 10,
+):
+    comparables = request.app.state.comparables
+    if ds is None:
+        # the newest ds whose crawl has finished building its tree
+        ds = comparables.latest_ds(city_code)
+        if ds is None:
+            raise HTTPException(404, f'No comparables for city {city_code}')
+    result = comparables.comparables(
+        city_code, ds, house_id, k=min(max(k, 1), 100)
+    )
+    if result is None:
+        raise HTTPException(
+            404, f'House {house_id} has no comparables in {ds}'
+        )
+    return ORJSONResponse(result)
+
+
+@app.get('/communities')
+def get_communities(
+    request: Request,
+    bbox: str | None = None,
+    city_code: str | None = None,
+    ds: str | None = None,
+    zoom: int | None = None,
+    block: str | None = None,
+    min_unit_price: float | None = None,
+    max_unit_price: float | None = None,
+    sort: str = 'id',
+    order: str = 'asc',
+    limit: int | None = None,
+    cursor: str | None = None,
+    format: str = 'json',
+):
+    if bbox is None:
+        if city_code is None:
+            raise HTTPException(400, 'Either bbox or city_code is required')
+        return query_listings(
+            request, Community, city_code, ds, format, limit,
+            block=block,
+            min_unit_price=min_unit_price,
+            max_unit_price=max_unit_price,
+            sort=sort,
+            order=order,
+            cursor=cursor,
         )
-        result['house_detail'] = {
-            'finished': sum([h.is_detail_crawled for h in houses]),
-            'total': len(houses)
-        }
-    return result
+
+    try:
+        min_lon, min_lat, max_lon, max_lat = map(float, bbox.split(','))
+    except ValueError:
+        raise HTTPException(
+            400, 'bbox must be min_lon,min_lat,max_lon,max_lat'
+        )
+    if cursor is not None and not cursor.isdigit():
+        raise HTTPException(400, f'Invalid cursor: {cursor}')
+    spatial = request.app.state.spatial
+    ds = ds or spatial.latest_ds()
+    if ds is None:
+        raise HTTPException(404, 'No community data')
+    return ORJSONResponse(spatial.search(
+        ds,
+        (min_lon, min_lat, max_lon, max_lat),
+        zoom=zoom,
+        limit=min(max(limit or 500, 1), 5000),
+        cursor=int(cursor) if cursor is not None else None,
+    ))
+
+
+@app.get('/search')
+def get_search(
+    q: str,
+    request: Request,
+    kind: str = 'house',
+    city_code: str | None = None,
+    limit: int = 20,
+):
+    if kind not in ('house', 'community'):
+        raise HTTPException(400, 'kind must be house or community')
+    with request.app.state.Session() as session:
+        items = search(
+            session, kind, q, city_code, limit=min(max(limit, 1), 200)
+        )
+    return ORJSONResponse({'items': items})
+
+
+@app.get('/community_at')
+def get_community_at(
+    lon: float, lat: float, request: Request, ds: str | None = None
+):
+    spatial = request.app.state.spatial
+    ds = ds or spatial.latest_ds()
+    if ds is None:
+        raise HTTPException(404, 'No community data')
+    community_id = spatial.locate(ds, lon, lat)
+    if community_id is None:
+        raise HTTPException(404, 'No community at this location')
+    return {'ds': ds, 'community_id': community_id}
+
+
+@app.get('/borders/{border_hash}')
+def get_border(border_hash: str, request: Request):
+    # borders are content addressed, so the hash is a permanent ETag
+    headers = {
+        'ETag': f'"{border_hash}"',
+        'Cache-Control': 'public, max-age=31536000, immutable',
+    }
+    if request.headers.get('if-none-match') == headers['ETag']:
+        return Response(status_code=304, headers=headers)
+    with request.app.state.Session() as session:
+        border = session.get(Border, border_hash)
+        if border is None:
+            raise HTTPException(404, 'Border not found')
+        return Response(
+            content=border.data,
+            media_type='application/octet-stream',
+            headers=headers
+        )
+
+
+@app.get('/tiles/price/{city_code}/{ds}/{z}/{x}/{y}')
+def get_price_tile(
+    city_code: str, ds: str, z: int, x: int, y: int, request: Request
+):
+    def load_tile():
+        with request.app.state.Session() as session:
+            return (
+                session
+                .query(PriceTile.etag, PriceTile.data)
+                .filter(PriceTile.city_code == city_code)
+                .filter(PriceTile.ds == ds)
+                .filter(PriceTile.z == z)
+                .filter(PriceTile.x == x)
+                .filter(PriceTile.y == y)
+                .first()
+            )
+
+    tile = request.app.state.tile_cache.get(
+        (city_code, ds, z, x, y), load_tile
+    )
+    if tile is None:
+        raise HTTPException(404, 'Tile not found')
+    headers = {'ETag': f'"{tile.etag}"', 'Cache-Control': 'no-cache'}
+    if request.headers.get('if-none-match') == headers['ETag']:
+        return Response(status_code=304, headers=headers)
+    return Response(
+        content=tile.data,
+        media_type='application/octet-stream',
+        headers=headers
+    )
+
+
+def spider_log_file(city_code: str | None, ds: str) -> pathlib.Path | None:
+    if city_code is None:
+        return None
+    return pathlib.Path(f'log/spider_{city_code}_{ds}.log')
 
 
 @app.get('/spider_log')
-async def get_spider_log():
+def get_spider_log(
+    request: Request, city_code: str | None = None, offset: int = 0
+):
+    """Today's log of a city's spider from byte `offset` on; `next_offset` 
+    is where the next call should continue. Defaults to the city of the 
+    current spider run."""
+    today_ds = datetime.today().strftime(r'%Y%m%d')
+    city_code = city_code or request.app.state.runner.city_code
+    log_file = spider_log_file(city_code, today_ds)
+    size = log_file.stat().st_size if log_file and log_file.exists() else 0
+    # a log restarted from scratch is read from its beginning again
+    offset = offset if 0 <= offset <= size else 0
+    chunks = read_chunks(log_file, start=offset, end=size) if size else []
+    head = {'ds': today_ds, 'city_code': city_code, 'next_offset': size}
+    return StreamingResponse(
+        stream_text_field(head, 'spider_log', chunks),
+        media_type='application/json'
+    )
+
+
+@app.get('/dashboard')
+def get_dashboard(request: Request, city_code: str | None = None):
+    """Spider status, progress and log size in one round trip, for the 
+    monitoring page to poll."""
     today_ds = datetime.today().strftime(r'%Y%m%d')
-    spider_log = ''
-    if pathlib.Path(f'log/spider_{today_ds}.log').exists():
-        with open(f'log/spider_{today_ds}.log') as f:
-            spider_log = f.read()
-    return {'ds': today_ds, 'spider_log': spider_log}
+    runner = request.app.state.runner
+    city_code = city_code or runner.city_code
+    log_file = spider_log_file(city_code, today_ds)
+    with request.app.state.Session() as session:
+        progress = count_progress(session, today_ds, city_code)
+    return {
+        'ds': today_ds,
+        'city_code': city_code,
+        'status': runner.status(),
+        'is_spider_running': runner.is_running(),
+        'progress': progress,
+        'log_size': (
+            log_file.stat().st_size if log_file and log_file.exists() else 0
+        ),
+    }
 
 
 
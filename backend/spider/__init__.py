@@ -1 +1,6 @@
-from .spider import BeikeMapSpider
\ No newline at end of file
+def __getattr__(name: str):
+    # imported lazily so that `python -m spider --help` stays fast
+    if name == 'BeikeMapSpider':
+        from .spider import BeikeMapSpider
+        return BeikeMapSpider
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -0,0 +1,488 @@
+"""Headless entry point for running the spider without the API server.
+
+Usage (from the backend directory):
+
+    python -m spider crawl --city 310000 --stages list,detail --concurrency 4
+
+Detail pages are fetched most valuable first (see `spider.priority`), so 
+`--budget-requests` / `--budget-minutes` bound a daily run without losing 
+the pages that matter most.
+
+Each logged-in session sends at most one request per `--session-interval`
+seconds, which caps the throughput at sessions / interval requests per
+second however high `--concurrency` is set.
+
+A JSON summary of the run is printed to stdout, logs go to stderr. The exit 
+code tells cron / k8s jobs how the run ended:
+
+    0  all requested stages finished, or the crawl budget left detail
+       pages unfetched (status `budget_exhausted`)
+    1  the crawl failed with an error
+    2  invalid arguments or unknown city
+    3  the crawl was interrupted (SIGINT / SIGTERM) before finishing
+"""
+import argparse
+import json
+import os
+import signal
+import sys
+import time
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+EXIT_INTERRUPTED = 3
+
+STAGE_GROUPS = {
+    'list': ('community_list', 'house_list'),
+    'detail': ('community_detail', 'house_detail'),
+    'community': ('community_list', 'community_detail'),
+    'house': ('house_list', 'house_detail'),
+    'all': (
+        'community_list', 
+        'community_detail', 
+        'house_list', 
+        'house_detail', 
+        'price_tiles',
+        'price_index',
+        'search_index',
+        'comparables',
+    ),
+}
+# retention deletes old partitions, so it only runs when named
+STAGES = (*STAGE_GROUPS['all'], 'retention')
+
+
+def parse_stages(value: str) -> list[str]:
+    stages = []
+    for name in value.split(','):
+        name = name.strip()
+        for stage in STAGE_GROUPS.get(name, (name,)):
+            if stage not in STAGES:
+                raise argparse.ArgumentTypeError(f'unknown stage: {name}')
+            if stage not in stages:
+                stages.append(stage)
+    return stages
+
+
+def positive_int(value: str) -> int:
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f'must be at least 1: {value}')
+    return number
+
+
+def crawl(args: argparse.Namespace) -> int:
+    # heavy imports are deferred until a crawl is actually requested
+    from .database import DatabaseService
+    from .models import City
+    from .priority import CrawlBudget
+    from .proxies import ProxyPool, parse_proxies
+    from .sessions import SessionPool
+    from .spider import BeikeMapSpider
+
+    db_service = DatabaseService()
+    db_service.load_city_info()
+    with db_service.Session() as session:
+        city = (
+            session.query(City)
+            .filter((City.code == args.city) | (City.name == args.city))
+            .first()
+        )
+        city_code = city.code if city is not None else args.city
+
+    summary = {
+        'city_code': city_code,
+        'stages': args.stages,
+        'concurrency': args.concurrency,
+        'budget_requests': args.budget_requests,
+        'budget_minutes': args.budget_minutes,
+    }
+    start = time.time()
+    try:
+        spider = BeikeMapSpider(
+            city_code, 
+            db_service.Session, 
+            concurrency=args.concurrency,
+            budget=CrawlBudget(args.budget_requests, args.budget_minutes),
+            proxy_pool=ProxyPool(
+                parse_proxies(args.proxies),
+                max_concurrency=args.proxy_concurrency,
+                min_interval=args.proxy_interval,
+            ),
+            session_pool=SessionPool(
+                db_service.Session, min_interval=args.session_interval
+            ),
+        )
+    except ValueError as e:
+        summary.update(status='invalid', error=str(e))
+        print(json.dumps(summary, ensure_ascii=False))
+        return EXIT_USAGE
+
+    def interrupt(signum, frame):
+        spider.stop()
+
+    signal.signal(signal.SIGINT, interrupt)
+    signal.signal(signal.SIGTERM, interrupt)
+
+    summary['ds'] = spider.ds
+    exit_code = EXIT_OK
+    try:
+        with spider:
+            spider.run(args.stages)
+        if spider.interrupted:
+            summary['status'] = 'interrupted'
+            exit_code = EXIT_INTERRUPTED
+        elif spider.budget.cut_off:
+            summary['status'] = 'budget_exhausted'
+        else:
+            summary['status'] = 'ok'
+    except Exception as e:
+        summary.update(status='failed', error=f'{type(e).__name__}: {e}')
+        exit_code = EXIT_FAILED
+    summary['elapsed'] = round(time.time() - start, 3)
+    summary['progress'] = spider.get_progress()
+    print(json.dumps(summary, ensure_ascii=False))
+    return exit_code
+
+
+def compact_borders(args: argparse.Namespace) -> int:
+    from .database import DatabaseService
+    from .geometry import compact_borders
+
+    db_service = DatabaseService()
+    start = time.time()
+    with db_service.Session() as session:
+        total = compact_borders(session, batch_size=args.batch_size)
+    print(json.dumps({
+        'status': 'ok',
+        'compacted': total,
+        'elapsed': round(time.time() - start, 3),
+    }))
+    return EXIT_OK
+
+
+def backfill_numbers(args: argparse.Namespace) -> int:
+    from .database import DatabaseService
+    from .query import backfill_numeric_columns
+
+    db_service = DatabaseService()
+    start = time.time()
+    with db_service.Session() as session:
+        total = backfill_numeric_columns(session)
+    print(json.dumps({
+        'status': 'ok',
+        'backfilled': total,
+        'elapsed': round(time.time() - start, 3),
+    }))
+    return EXIT_OK
+
+
+def backfill_attributes(args: argparse.Namespace) -> int:
+    from .attributes import backfill_attributes
+    from .database import DatabaseService
+
+    db_service = DatabaseService()
+    start = time.time()
+    with db_service.Session() as session:
+        total = backfill_attributes(session, batch_size=args.batch_size)
+    print(json.dumps({
+        'status': 'ok',
+        'backfilled': total,
+        'elapsed': round(time.time() - start, 3),
+    }))
+    return EXIT_OK
+
+
+def build_price_index(args: argparse.Namespace) -> int:
+    from sqlalchemy import select
+
+    from .database import DatabaseService
+    from .models import House
+    from .price_index import build_price_index
+
+    db_service = DatabaseService()
+    start = time.time()
+    total = 0
+    with db_service.Session() as session:
+        partitions = session.execute(
+            select(House.city_code, House.ds)
+            .distinct()
+            .order_by(House.city_code, House.ds)
+        ).all()
+        for city_code, ds in partitions:
+            total += build_price_index(session, city_code, ds)
+    print(json.dumps({
+        'status': 'ok',
+        'rows': total,
+        'elapsed': round(time.time() - start, 3),
+    }))
+    return EXIT_OK
+
+
+def build_comparables(args: argparse.Namespace) -> int:
+    from sqlalchemy import select
+
+    from .comparables import build_comparables
+    from .database import DatabaseService
+    from .models import House
+
+    db_service = DatabaseService()
+    start = time.time()
+    total = 0
+    with db_service.Session() as session:
+        partitions = session.execute(
+            select(House.city_code, House.ds)
+            .distinct()
+            .order_by(House.city_code, House.ds)
+        ).all()
+        for city_code, ds in partitions:
+            total += build_comparables(session, city_code, ds)
+    print(json.dumps({
+        'status': 'ok',
+        'houses': total,
+        'elapsed': round(time.time() - start, 3),
+    }))
+    return EXIT_OK
+
+
+def index_search(args: argparse.Namespace) -> int:
+    from sqlalchemy import select
+
+    from .database import DatabaseService
+    from .models import Community
+    from .search import index_listings
+
+    db_service = DatabaseService()
+    start = time.time()
+    total = 0
+    with db_service.Session() as session:
+        partitions = session.execute(
+            select(Community.city_code, Community.ds)
+            .distinct()
+            .order_by(Community.ds)
+        ).all()
+        # older ds first, so every listing ends up at its latest one
+        for city_code, ds in partitions:
+            total += index_listings(session, city_code, ds)
+    print(json.dumps({
+        'status': 'ok',
+        'indexed': total,
+        'elapsed': round(time.time() - start, 3),
+    }))
+    return EXIT_OK
+
+
+def retention(args: argparse.Namespace) -> int:
+    from .database import DatabaseService
+    from .retention import (
+        RetentionError, RetentionPolicy, apply_retention, maintain_database
+    )
+
+    policy = RetentionPolicy(
+        progress_days=args.progress_days,
+        online_days=args.online_days,
+        archive=not args.no_archive,
+        archive_dir=args.archive_dir,
+    )
+    db_service = DatabaseService()
+    start = time.time()
+    try:
+        with db_service.Session() as session:
+            summary = apply_retention(session, policy, args.city)
+    except RetentionError as e:
+        print(json.dumps({'status': 'invalid', 'error': str(e)}))
+        return EXIT_USAGE
+    maintenance = maintain_database(
+        db_service.engine,
+        analyze=summary['deleted_rows'] > 0,
+        convert=args.vacuum,
+    )
+    print(json.dumps({
+        'status': 'ok',
+        **summary,
+        'maintenance': maintenance,
+        'elapsed': round(time.time() - start, 3),
+    }))
+    return EXIT_OK
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog='python -m spider',
+        description='Run the Beike map spider without the API server.',
+        epilog=(
+            'exit codes: 0 finished, 1 failed, 2 invalid arguments, '
+            '3 interrupted'
+        ),
+    )
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    crawl_parser = subparsers.add_parser(
+        'crawl',
+        help='crawl one city',
+        description=(
+            'Crawl one city. Every logged-in session in crawl_sessions '
+            'sends at most one request per --session-interval seconds, so '
+            'with N sessions a crawl tops out at N / interval requests per '
+            'second whatever --concurrency is: with one session and the '
+            'default interval that is 1 request per second. A shorter '
+            'interval crawls faster but makes it likelier that the '
+            'accounts are rate limited or banned. Without sessions, '
+            'requests carry no cookie and only --proxy-interval paces them.'
+        ),
+    )
+    crawl_parser.add_argument(
+        '--city', required=True, help='city code (e.g. 310000) or name'
+    )
+    crawl_parser.add_argument(
+        '--stages', 
+        type=parse_stages, 
+        default=list(STAGE_GROUPS['all']),
+        help=(
+            f'comma separated stages or groups: {", ".join(STAGES)}, '
+            f'{", ".join(STAGE_GROUPS)} (default: all, which leaves out '
+            'retention)'
+        ),
+    )
+    crawl_parser.add_argument(
+        '--concurrency', 
+        type=positive_int, 
+        default=1, 
+        help='number of concurrent requests per stage (default: 1)'
+    )
+    crawl_parser.add_argument(
+        '--budget-requests', 
+        type=positive_int, 
+        help='stop the detail stages after this many requests'
+    )
+    crawl_parser.add_argument(
+        '--budget-minutes', 
+        type=float, 
+        help='stop the detail stages this many minutes after the start'
+    )
+    crawl_parser.add_argument(
+        '--proxies',
+        default=os.getenv('SPIDER_PROXIES'),
+        help=(
+            'comma separated proxy urls to spread requests over '
+            '(default: $SPIDER_PROXIES, none)'
+        )
+    )
+    crawl_parser.add_argument(
+        '--proxy-concurrency',
+        type=positive_int,
+        default=2,
+        help='requests in flight per proxy (default: 2)'
+    )
+    crawl_parser.add_argument(
+        '--proxy-interval',
+        type=float,
+        default=0.5,
+        help='minimum seconds between requests per proxy (default: 0.5)'
+    )
+    crawl_parser.add_argument(
+        '--session-interval',
+        type=float,
+        default=float(os.getenv('SPIDER_SESSION_INTERVAL', 1.0)),
+        help=(
+            'minimum seconds between requests per logged-in session '
+            '(default: $SPIDER_SESSION_INTERVAL, 1.0)'
+        )
+    )
+    crawl_parser.set_defaults(func=crawl)
+
+    compact_parser = subparsers.add_parser(
+        'compact-borders', 
+        help='move text borders into the deduplicated borders table'
+    )
+    compact_parser.add_argument(
+        '--batch-size', 
+        type=positive_int, 
+        default=1000, 
+        help='communities per commit (default: 1000)'
+    )
+    compact_parser.set_defaults(func=compact_borders)
+
+    backfill_parser = subparsers.add_parser(
+        'backfill-numbers',
+        help='parse prices and areas of old rows into the numeric columns'
+    )
+    backfill_parser.set_defaults(func=backfill_numbers)
+
+    attributes_parser = subparsers.add_parser(
+        'backfill-attributes',
+        help='explode the info of old communities into attribute rows'
+    )
+    attributes_parser.add_argument(
+        '--batch-size',
+        type=positive_int,
+        default=1000,
+        help='communities per commit (default: 1000)'
+    )
+    attributes_parser.set_defaults(func=backfill_attributes)
+
+    price_index_parser = subparsers.add_parser(
+        'build-price-index',
+        help='rebuild the daily price index of every crawled ds'
+    )
+    price_index_parser.set_defaults(func=build_price_index)
+
+    comparables_parser = subparsers.add_parser(
+        'build-comparables',
+        help='rebuild the comparables tree of every crawled ds'
+    )
+    comparables_parser.set_defaults(func=build_comparables)
+
+    search_parser = subparsers.add_parser(
+        'index-search', help='rebuild the full-text search index'
+    )
+    search_parser.set_defaults(func=index_search)
+
+    retention_parser = subparsers.add_parser(
+        'retention',
+        help='archive and drop old ds partitions, then vacuum the database'
+    )
+    retention_parser.add_argument(
+        '--city', help='only this city code (default: all cities)'
+    )
+    retention_parser.add_argument(
+        '--progress-days',
+        type=positive_int,
+        default=int(os.getenv('RETENTION_PROGRESS_DAYS', 2)),
+        help='days of progress rows to keep (default: 2)'
+    )
+    retention_parser.add_argument(
+        '--online-days',
+        type=positive_int,
+        default=int(os.getenv('RETENTION_ONLINE_DAYS', 30)),
+        help='days of listing snapshots to keep online (default: 30)'
+    )
+    retention_parser.add_argument(
+        '--archive-dir',
+        default=os.getenv('RETENTION_ARCHIVE_DIR', 'data/archive'),
+        help='where old partitions are archived (default: data/archive)'
+    )
+    retention_parser.add_argument(
+        '--no-archive',
+        action='store_true',
+        default=os.getenv('RETENTION_ARCHIVE', '1') == '0',
+        help='delete old partitions without archiving them'
+    )
+    retention_parser.add_argument(
+        '--vacuum',
+        action='store_true',
+        help=(
+            'switch the database to incremental auto-vacuum with a full '
+            'VACUUM if needed; locks the database, so run it while no '
+            'crawl is running'
+        )
+    )
+    retention_parser.set_defaults(func=retention)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
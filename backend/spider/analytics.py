@@ -0,0 +1,221 @@
+"""Vectorized analytics over one (city, ds) slice of the crawl store.
+
+Each slice is loaded once into a pandas frame with parsed numeric columns
+and cached, and the dashboard payload computed from it is cached as well.
+Both are versioned with `crawl_version`, so they are rebuilt exactly when
+a crawl or retention changed the slice, whatever its ds.
+"""
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session, sessionmaker
+
+from .cache import DsCache
+from .database import crawl_version
+from .models import House
+
+
+HOUSE_COLUMNS = [
+    House.id,
+    House.community_id,
+    House.district_name,
+    House.block_name,
+    House.priceStr,
+    House.unitPriceStr,
+    House.total_price_num,
+    House.unit_price,
+    House.area_main_info,
+]
+
+
+def parse_number(series: pd.Series) -> pd.Series:
+    """Extract the first number of a text column, e.g. `65,432元/平`.
+
+    Price and area strings repeat a lot, so only the distinct values are 
+    parsed and the result is broadcast back with the factorized codes.
+    """
+    codes, uniques = pd.factorize(series)
+    parsed = pd.to_numeric(
+        pd.Series(uniques, dtype='string')
+        .str.replace(',', '', regex=False)
+        .str.extract(r'(\d+(?:\.\d+)?)', expand=False),
+        errors='coerce'
+    ).to_numpy(dtype='float64', na_value=np.nan)
+    values = np.full(len(codes), np.nan)
+    values[codes >= 0] = parsed[codes[codes >= 0]]
+    return pd.Series(values, index=series.index)
+
+
+def group_stats(df: pd.DataFrame, key: str) -> dict[str, list]:
+    if df.empty:
+        # the quantile frame of no groups has no columns to rename
+        return {key: [], 'p25': [], 'median': [], 'p75': [], 'count': []}
+    grouped = df.groupby(key, observed=True)['unit_price']
+    stats = grouped.quantile([0.25, 0.5, 0.75]).unstack()
+    stats.columns = ['p25', 'median', 'p75']
+    stats['count'] = grouped.size()
+    stats = stats.sort_values('count', ascending=False).round(0)
+    return {key: stats.index.tolist(), **stats.to_dict('list')}
+
+
+def read_house_frame(
+    session: Session, city_code: str, ds: str
+) -> pd.DataFrame:
+    """Load the houses of one (city, ds) with parsed numeric columns."""
+    stmt = (
+        select(*HOUSE_COLUMNS)
+        .where(House.city_code == city_code)
+        .where(House.ds == ds)
+    )
+    result = session.execute(stmt)
+    raw = pd.DataFrame.from_records(
+        result.fetchall(), columns=list(result.keys())
+    )
+    # detail page values are preferred, list page values fill the gaps
+    return pd.DataFrame({
+        'community_id': raw['community_id'].to_numpy(),
+        'district_name': (
+            raw['district_name'].fillna('unknown').astype('category')
+        ),
+        'block_name': (
+            raw['block_name'].fillna('unknown').astype('category')
+        ),
+        'total_price': (
+            parse_number(raw['total_price_num'])
+            .fillna(parse_number(raw['priceStr']))
+            .astype('float32')
+        ),
+        'unit_price': (
+            parse_number(raw['unit_price'])
+            .fillna(parse_number(raw['unitPriceStr']))
+            .astype('float32')
+        ),
+        'area': parse_number(raw['area_main_info']).astype('float32'),
+    }).set_index(raw['id'].rename('id'))
+
+
+class AnalyticsEngine:
+    def __init__(self, Session: sessionmaker, max_entries: int = 16) -> None:
+        self.Session = Session
+        # entries are versioned by the crawl, so the ttl is never used
+        self.cache = DsCache(max_entries)
+
+    def list_ds(self, city_code: str) -> list[str]:
+        with self.Session() as session:
+            return [
+                ds for ds, in (
+                    session
+                    .query(House.ds)
+                    .filter(House.city_code == city_code)
+                    .distinct()
+                    .order_by(House.ds.desc())
+                )
+            ]
+
+    def previous_ds(self, city_code: str, ds: str) -> str | None:
+        with self.Session() as session:
+            return (
+                session
+                .query(func.max(House.ds))
+                .filter(House.city_code == city_code)
+                .filter(House.ds < ds)
+                .scalar()
+            )
+
+    def version(self, city_code: str, ds: str) -> tuple:
+        with self.Session() as session:
+            return crawl_version(session, city_code, ds)
+
+    def load_houses(self, city_code: str, ds: str) -> pd.DataFrame:
+        return self.cache.get(
+            ('houses', city_code, ds),
+            lambda: self.read_houses(city_code, ds),
+            version=self.version(city_code, ds)
+        )
+
+    def read_houses(self, city_code: str, ds: str) -> pd.DataFrame:
+        with self.Session() as session:
+            return read_house_frame(session, city_code, ds)
+
+    def dashboard(self, city_code: str, ds: str) -> dict:
+        # the day over day part changes with the previous ds too
+        prev_ds = self.previous_ds(city_code, ds)
+        version = (
+            self.version(city_code, ds),
+            prev_ds,
+            self.version(city_code, prev_ds) if prev_ds is not None else None,
+        )
+        return self.cache.get(
+            ('dashboard', city_code, ds),
+            lambda: self.build_dashboard(city_code, ds),
+            version=version
+        )
+
+    def build_dashboard(self, city_code: str, ds: str) -> dict:
+        df = self.load_houses(city_code, ds)
+        unit_price = df['unit_price'].dropna().to_numpy()
+        counts, edges = (
+            np.histogram(unit_price, bins=30) if len(unit_price)
+            else (np.array([]), np.array([]))
+        )
+        result = {
+            'city_code': city_code,
+            'ds': ds,
+            'summary': {
+                'listing_count': len(df),
+                'community_count': int(df['community_id'].nunique()),
+                'median_unit_price': (
+                    float(np.median(unit_price)) if len(unit_price) else None
+                ),
+                'median_total_price': (
+                    float(df['total_price'].median()) if len(df) else None
+                ),
+            },
+            'unit_price_histogram': {
+                'edges': edges.round(0).tolist(),
+                'counts': counts.tolist(),
+            },
+            'districts': group_stats(df, 'district_name'),
+            'blocks': group_stats(df, 'block_name'),
+            'day_over_day': None,
+        }
+        prev_ds = self.previous_ds(city_code, ds)
+        if prev_ds is not None:
+            result['day_over_day'] = self.day_over_day(
+                df, self.load_houses(city_code, prev_ds), prev_ds
+            )
+        return result
+
+    @staticmethod
+    def day_over_day(
+        df: pd.DataFrame, prev: pd.DataFrame, prev_ds: str
+    ) -> dict:
+        is_new = ~df.index.isin(prev.index)
+        is_removed = ~prev.index.isin(df.index)
+        joined = df[['total_price', 'district_name']].join(
+            prev[['total_price']], rsuffix='_prev', how='inner'
+        )
+        change = joined['total_price'] / joined['total_price_prev'] - 1
+        changed = change.notna() & (change != 0)
+        by_district = (
+            change[changed]
+            .groupby(joined.loc[changed, 'district_name'], observed=True)
+            .agg(['count', 'mean'])
+        )
+        return {
+            'prev_ds': prev_ds,
+            'new_count': int(is_new.sum()),
+            'removed_count': int(is_removed.sum()),
+            'price_changed_count': int(changed.sum()),
+            'price_up_count': int((change > 0).sum()),
+            'price_down_count': int((change < 0).sum()),
+            'mean_price_change': (
+                float(change[changed].mean()) if changed.any() else None
+            ),
+            'districts': {
+                'district_name': by_district.index.tolist(),
+                'count': by_district['count'].tolist(),
+                'mean_change': by_district['mean'].round(4).tolist(),
+            },
+        }
@@ -0,0 +1,164 @@
+"""Typed attribute rows exploded from the `Community.info` JSON.
+
+Every label/content pair of a community detail page becomes one row of
+`community_attributes`. Known labels are mapped to stable keys and get a
+parsed numeric value, so aggregates like the mean build year by district
+are plain SQL over `(city_code, ds, key)` without decoding any JSON.
+Labels not in `ATTRIBUTES` are kept under their original text.
+"""
+import json
+from collections.abc import Callable
+
+from sqlalchemy import exists, func, insert, select, tuple_
+from sqlalchemy.orm import Session
+
+from .models import Community, CommunityAttribute, House
+from .numbers import parse_float, parse_mean
+from .writer import BatchWriter
+
+
+# label on the detail page -> (key, parser of the numeric value)
+ATTRIBUTES: dict[str, tuple[str, Callable[[str], float | None] | None]] = {
+    '建筑年代': ('build_year', parse_float),
+    '建筑类型': ('building_type', None),
+    '物业费用': ('property_fee', parse_mean),
+    '物业公司': ('property_company', None),
+    '开发商': ('developer', None),
+    '楼栋总数': ('building_count', parse_float),
+    '房屋总数': ('household_count', parse_float),
+}
+
+GROUP_BY = ('district', 'block')
+
+
+def explode_info(
+    community_id: int, ds: str, city_code: str, info: dict[str, str]
+) -> list[dict]:
+    rows = {}
+    for label, content in info.items():
+        key, parser = ATTRIBUTES.get(label, (label, None))
+        rows[key] = {
+            'community_id': community_id,
+            'ds': ds,
+            'city_code': city_code,
+            'key': key,
+            'value': content,
+            'value_num': parser(content) if parser is not None else None,
+        }
+    return list(rows.values())
+
+
+def save_attributes(
+    writer: BatchWriter,
+    community_id: int,
+    ds: str,
+    city_code: str,
+    info: str | None,
+) -> None:
+    """Queue the replacement of the attribute rows of a community from its
+    `info` JSON."""
+    writer.delete(CommunityAttribute, {
+        'city_code': city_code, 'ds': ds, 'community_id': community_id
+    })
+    if info:
+        for row in explode_info(community_id, ds, city_code, json.loads(info)):
+            writer.insert(CommunityAttribute, row)
+
+
+def backfill_attributes(session: Session, batch_size: int = 1000) -> int:
+    """Explode the `info` of communities crawled before the attribute table
+    existed, one batch per commit.
+
+    Batches walk the primary key, since communities whose `info` has no
+    labels never get a row and would be selected again and again.
+    """
+    has_attributes = exists().where(
+        CommunityAttribute.city_code == Community.city_code,
+        CommunityAttribute.ds == Community.ds,
+        CommunityAttribute.community_id == Community.id,
+    )
+    key = tuple_(Community.id, Community.ds, Community.city_code)
+    total, last = 0, None
+    while True:
+        stmt = (
+            select(
+                Community.id, Community.ds, Community.city_code, Community.info
+            )
+            .where(Community.info.is_not(None))
+            .where(~has_attributes)
+            .order_by(Community.id, Community.ds, Community.city_code)
+            .limit(batch_size)
+        )
+        if last is not None:
+            stmt = stmt.where(key > last)
+        communities = session.execute(stmt).all()
+        if not communities:
+            return total
+        last = tuple(communities[-1][:3])
+        rows = [
+            row
+            for community in communities
+            for row in explode_info(
+                community.id,
+                community.ds,
+                community.city_code,
+                json.loads(community.info)
+            )
+        ]
+        if rows:
+            session.execute(insert(CommunityAttribute), rows)
+        session.commit()
+        total += len(communities)
+
+
+def attribute_stats(
+    session: Session,
+    city_code: str,
+    ds: str,
+    key: str,
+    group_by: str = 'district',
+) -> list[dict]:
+    """Aggregate the numeric value of one attribute by district or block.
+
+    Communities only know their block, so districts are taken from the
+    houses crawled in the same blocks.
+    """
+    block = Community.block_name
+    if group_by == 'district':
+        blocks = (
+            select(
+                House.block_name, func.min(House.district_name).label('name')
+            )
+            .where(House.city_code == city_code)
+            .where(House.ds == ds)
+            .group_by(House.block_name)
+            .subquery()
+        )
+        group = blocks.c.name
+    else:
+        group = block
+    stmt = (
+        select(
+            group.label('name'),
+            func.count(CommunityAttribute.value_num).label('count'),
+            func.avg(CommunityAttribute.value_num).label('mean'),
+            func.min(CommunityAttribute.value_num).label('min'),
+            func.max(CommunityAttribute.value_num).label('max'),
+        )
+        .select_from(CommunityAttribute)
+        .join(
+            Community,
+            (Community.city_code == CommunityAttribute.city_code)
+            & (Community.ds == CommunityAttribute.ds)
+            & (Community.id == CommunityAttribute.community_id)
+        )
+        .where(CommunityAttribute.city_code == city_code)
+        .where(CommunityAttribute.ds == ds)
+        .where(CommunityAttribute.key == key)
+        .where(CommunityAttribute.value_num.is_not(None))
+        .group_by(group)
+        .order_by(group)
+    )
+    if group_by == 'district':
+        stmt = stmt.join(blocks, blocks.c.block_name == block)
+    return [dict(row) for row in session.execute(stmt).mappings()]
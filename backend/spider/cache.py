@@ -0,0 +1,46 @@
+"""Small LRU cache for values derived from one ds of crawl data.
+
+Even past ds change: a crawl running past midnight keeps writing to the
+ds it started on, and retention deletes old partitions. Entries therefore
+expire after `ttl` seconds, unless the caller can tell when the data
+changed and passes a `version` of it instead, such as `crawl_version`;
+those live until the version differs. None is never cached, so a value
+missing until a later stage builds it is looked up again.
+"""
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+
+
+class DsCache:
+    def __init__(self, max_entries: int = 16, ttl: float = 60) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, key: tuple, compute: Callable, version=None):
+        now = time.monotonic()
+        with self.lock:
+            if key in self.entries:
+                expires, cached_version, value = self.entries[key]
+                if (
+                    cached_version == version if version is not None
+                    else expires > now
+                ):
+                    self.entries.move_to_end(key)
+                    return value
+        value = compute()
+        if value is None:
+            return None
+        expires = now + self.ttl
+        with self.lock:
+            self.entries[key] = (expires, version, value)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return value
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
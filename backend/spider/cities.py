@@ -0,0 +1,110 @@
+"""In-memory city metadata, loaded once per process.
+
+`CityRegistry` wraps `data/city_list.json` with lookups by name, code and
+name prefix and a content version used as the `/city_list` ETag.
+`AdcodeIndex` does the same for the AMap adcode table, which is used to map
+ke.com city names to adcodes when the city list is rebuilt.
+"""
+import bisect
+import csv
+import hashlib
+import json
+from functools import cache
+
+from sqlalchemy import insert, update
+from sqlalchemy.orm import Session
+
+from .models import City
+
+
+class CityRegistry:
+    def __init__(self, cities: list[dict]) -> None:
+        self.cities = cities
+        content = json.dumps(cities, sort_keys=True, ensure_ascii=False)
+        self.version = hashlib.sha1(content.encode()).hexdigest()[:16]
+        self.by_name = {city['name']: city for city in cities}
+        self.by_code = {city['code']: city for city in cities}
+        self.names = sorted(self.by_name)
+        self.name_to_code = {city['name']: city['code'] for city in cities}
+
+    @classmethod
+    def from_file(cls, path: str = 'data/city_list.json') -> 'CityRegistry':
+        with open(path, encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    def get(self, key: str) -> dict | None:
+        """Find a city by its code or its name."""
+        return self.by_code.get(key) or self.by_name.get(key)
+
+    def search(self, prefix: str) -> list[dict]:
+        """Find all cities whose name starts with `prefix`."""
+        start = bisect.bisect_left(self.names, prefix)
+        result = []
+        for name in self.names[start:]:
+            if not name.startswith(prefix):
+                break
+            result.append(self.by_name[name])
+        return result
+
+    def upsert(self, session: Session) -> None:
+        """Write all cities to the database in one bulk insert + update."""
+        existing = {name for name, in session.query(City.name)}
+        new_rows = [c for c in self.cities if c['name'] not in existing]
+        old_rows = [c for c in self.cities if c['name'] in existing]
+        if new_rows:
+            session.execute(insert(City), new_rows)
+        if old_rows:
+            session.execute(update(City), old_rows)
+        session.commit()
+
+
+class AdcodeIndex:
+    def __init__(self, rows: list[tuple[str, str]]) -> None:
+        self.by_name = {}
+        self.by_adcode = {}
+        for name, adcode in rows:
+            self.by_name.setdefault(name, adcode)
+            self.by_adcode.setdefault(adcode, name)
+        self.names = sorted(self.by_name)
+
+    @classmethod
+    def from_file(
+        cls, path: str = 'data/AMap_adcode_citycode.csv'
+    ) -> 'AdcodeIndex':
+        with open(path, encoding='utf-8') as f:
+            csv_reader = csv.reader(f)
+            next(csv_reader)
+            return cls([(row[0], row[1]) for row in csv_reader])
+
+    def lookup(self, city_name: str) -> str | None:
+        """Map a short city name such as `黔南` to its AMap adcode.
+
+        Exact names win, then the name with a `市` suffix, then the first
+        full name starting with `city_name`, preferring prefecture level
+        adcodes over districts and counties.
+        """
+        for name in (city_name, city_name + '市'):
+            if name in self.by_name:
+                return self.by_name[name]
+        start = bisect.bisect_left(self.names, city_name)
+        candidates = []
+        for name in self.names[start:]:
+            if not name.startswith(city_name):
+                break
+            candidates.append(self.by_name[name])
+        if not candidates:
+            return None
+        for adcode in candidates:
+            if adcode.endswith('00'):
+                return adcode
+        return candidates[0]
+
+
+@cache
+def load_city_registry() -> CityRegistry:
+    return CityRegistry.from_file()
+
+
+@cache
+def load_adcode_index() -> AdcodeIndex:
+    return AdcodeIndex.from_file()
@@ -0,0 +1,239 @@
+"""Nearest-neighbour comparables of a house within one (city, ds).
+
+Every house with community coordinates becomes a row of a standardized
+feature matrix: position in km, log unit price, log area, rooms, floor
+level and build year, each scaled to unit variance and then weighted by
+`FEATURE_WEIGHTS`. Missing values are filled with the column median so a
+house is never dropped for one unparsed field. Comparables are the
+nearest rows in that space, found with a scipy KD-tree.
+
+The matrix and its tree are built by the `comparables` stage at the end of
+a crawl and stored pickled in `comparables_trees`, which only the spider
+writes. The API never builds a tree: it loads the stored one, keeps it
+until the row's etag changes, and then swaps in the new one.
+"""
+import hashlib
+import pickle
+import zlib
+
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+from sqlalchemy import and_, delete, func, insert, select
+from sqlalchemy.orm import Session, sessionmaker
+
+from .analytics import parse_number
+from .cache import DsCache
+from .models import Community, CommunityAttribute, ComparablesTree, House
+
+
+KM_PER_DEGREE = 111.32
+# relative importance of every feature after standardization; position
+# gets two columns (x, y) that share its weight
+FEATURE_WEIGHTS = {
+    'x': 2.0,
+    'y': 2.0,
+    'unit_price': 1.5,
+    'area': 1.5,
+    'rooms': 1.0,
+    'floor': 0.5,
+    'build_year': 1.0,
+}
+FLOOR_LEVELS = {'底': 0.0, '低': 0.25, '中': 0.5, '高': 0.75, '顶': 1.0}
+
+
+class ComparablesMatrix:
+    def __init__(self, frame: pd.DataFrame) -> None:
+        frame = frame.sort_values('id', kind='stable')
+        self.ids = frame['id'].to_numpy(dtype=np.int64)
+        self.frame = frame.reset_index(drop=True)
+        features = frame[list(FEATURE_WEIGHTS)]
+        features = (
+            features.fillna(features.median()).fillna(0)
+            .to_numpy(dtype=np.float64)
+        )
+        if len(features):
+            std = features.std(axis=0)
+            std[std == 0] = 1
+            features = (features - features.mean(axis=0)) / std
+        self.features = features * np.array(list(FEATURE_WEIGHTS.values()))
+        self.tree = cKDTree(self.features)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def position(self, house_id: int) -> int | None:
+        i = int(np.searchsorted(self.ids, house_id))
+        return i if i < len(self.ids) and self.ids[i] == house_id else None
+
+    def nearest(self, i: int, k: int) -> tuple[np.ndarray, np.ndarray]:
+        """Return positions and distances of the k rows closest to row i."""
+        k = min(k + 1, len(self))
+        distances, positions = self.tree.query(self.features[i], k=k)
+        positions, distances = np.atleast_1d(positions, distances)
+        own = positions != i
+        return positions[own][:k - 1], distances[own][:k - 1]
+
+
+def positive_log(series: pd.Series) -> pd.Series:
+    series = series.astype('float64')
+    return np.log(series.where(series > 0))
+
+
+def read_features(session: Session, city_code: str, ds: str) -> pd.DataFrame:
+    stmt = (
+        select(
+            House.id,
+            House.community_id,
+            House.title,
+            House.district_name,
+            House.block_name,
+            House.total_price_value,
+            House.unit_price_value,
+            House.area_value,
+            House.room_main_info,
+            House.room_sub_info,
+            House.area_sub_info,
+            Community.longitude,
+            Community.latitude,
+            CommunityAttribute.value_num.label('community_build_year'),
+        )
+        .join(
+            Community,
+            and_(
+                Community.id == House.community_id,
+                Community.ds == House.ds,
+                Community.city_code == House.city_code,
+            )
+        )
+        .outerjoin(
+            CommunityAttribute,
+            and_(
+                CommunityAttribute.community_id == House.community_id,
+                CommunityAttribute.ds == House.ds,
+                CommunityAttribute.city_code == House.city_code,
+                CommunityAttribute.key == 'build_year',
+            )
+        )
+        .where(House.city_code == city_code)
+        .where(House.ds == ds)
+        .where(Community.longitude.is_not(None))
+        .where(Community.latitude.is_not(None))
+    )
+    result = session.execute(stmt)
+    raw = pd.DataFrame.from_records(
+        result.fetchall(), columns=list(result.keys())
+    )
+
+    lat0 = np.radians(raw['latitude'].median()) if len(raw) else 0.0
+    floor = (
+        raw['room_sub_info'].astype('string')
+        .str.extract(r'([底低中高顶])', expand=False)
+        .map(FLOOR_LEVELS)
+    )
+    # `2005年建/板楼` on the house page, else the community's build year
+    build_year = pd.to_numeric(
+        raw['area_sub_info'].astype('string')
+        .str.extract(r'(\d{4})年', expand=False),
+        errors='coerce'
+    ).fillna(raw['community_build_year'])
+    return pd.DataFrame({
+        'id': raw['id'],
+        'community_id': raw['community_id'],
+        'title': raw['title'],
+        'district_name': raw['district_name'],
+        'block_name': raw['block_name'],
+        'longitude': raw['longitude'],
+        'latitude': raw['latitude'],
+        'total_price': raw['total_price_value'],
+        'x': raw['longitude'] * KM_PER_DEGREE * np.cos(lat0),
+        'y': raw['latitude'] * KM_PER_DEGREE,
+        'unit_price': positive_log(raw['unit_price_value']),
+        'area': positive_log(raw['area_value']),
+        'rooms': parse_number(raw['room_main_info']),
+        'floor': floor.astype('float64'),
+        'build_year': build_year.astype('float64'),
+    })
+
+
+def pack_matrix(matrix: ComparablesMatrix) -> bytes:
+    return zlib.compress(pickle.dumps(matrix, pickle.HIGHEST_PROTOCOL))
+
+
+def unpack_matrix(data: bytes) -> ComparablesMatrix:
+    return pickle.loads(zlib.decompress(data))
+
+
+def build_comparables(session: Session, city_code: str, ds: str) -> int:
+    """Rebuild the stored tree of (city, ds) and return how many houses it
+    holds."""
+    matrix = ComparablesMatrix(read_features(session, city_code, ds))
+    data = pack_matrix(matrix)
+    session.execute(
+        delete(ComparablesTree)
+        .where(ComparablesTree.city_code == city_code)
+        .where(ComparablesTree.ds == ds)
+    )
+    session.execute(insert(ComparablesTree), [{
+        'city_code': city_code,
+        'ds': ds,
+        'etag': hashlib.sha1(data).hexdigest()[:16],
+        'data': data,
+    }])
+    session.commit()
+    return len(matrix)
+
+
+class ComparablesIndex:
+    def __init__(self, Session: sessionmaker, max_entries: int = 4) -> None:
+        self.Session = Session
+        # entries are versioned by the stored etag, so the ttl is never used
+        self.cache = DsCache(max_entries)
+
+    def latest_ds(self, city_code: str) -> str | None:
+        """The newest ds of the city whose tree is built."""
+        with self.Session() as session:
+            return session.scalar(
+                select(func.max(ComparablesTree.ds))
+                .where(ComparablesTree.city_code == city_code)
+            )
+
+    def matrix(self, city_code: str, ds: str) -> ComparablesMatrix | None:
+        """The stored tree of (city, ds), or None if it is not built."""
+        key = and_(
+            ComparablesTree.city_code == city_code, ComparablesTree.ds == ds
+        )
+
+        def load():
+            with self.Session() as session:
+                data = session.scalar(select(ComparablesTree.data).where(key))
+            return unpack_matrix(data) if data is not None else None
+
+        with self.Session() as session:
+            etag = session.scalar(select(ComparablesTree.etag).where(key))
+        if etag is None:
+            return None
+        return self.cache.get(
+            ('comparables', city_code, ds), load, version=etag
+        )
+
+    def comparables(
+        self, city_code: str, ds: str, house_id: int, k: int = 10
+    ) -> dict | None:
+        matrix = self.matrix(city_code, ds)
+        if matrix is None:
+            return None
+        i = matrix.position(house_id)
+        if i is None:
+            return None
+        positions, distances = matrix.nearest(i, k)
+        rows = matrix.frame.iloc[np.append(i, positions)].copy()
+        rows['unit_price'] = np.exp(rows['unit_price']).round(0)
+        rows['area'] = np.exp(rows['area']).round(2)
+        rows['distance_km'] = np.hypot(
+            rows['x'] - rows['x'].iloc[0], rows['y'] - rows['y'].iloc[0]
+        ).round(3)
+        rows['score'] = np.append(0.0, distances).round(4)
+        rows = rows.drop(columns=['x', 'y']).astype(object)
+        records = rows.where(rows.notna(), None).to_dict('records')
+        return {'ds': ds, 'house': records[0], 'comparables': records[1:]}
@@ -2,28 +2,108 @@ import json
 import logging
 import os
 
-from sqlalchemy import create_engine
+from sqlalchemy import (
+    create_engine, func, case, inspect, select, text, Engine
+)
 from sqlalchemy.orm import Session
 from sqlalchemy.orm import sessionmaker
 
-from .models import City
+from .cities import load_city_registry
+from .search import create_search_tables
+from .models import (
+    Base, City, Community, CommunityAttribute, CommunityProgress, House,
+    HouseProgress
+)
 
 
 class DatabaseService:
     def __init__(self) -> None:
         db_url = os.getenv('DATABASE_URL') or 'sqlite:///data/beike_house.db'
-        engine = create_engine(db_url)
-        self.Session = sessionmaker(bind=engine)
+        self.engine = create_engine(db_url)
+        init_database(self.engine)
+        self.Session = sessionmaker(bind=self.engine)
 
     def load_city_info(self) -> None:
         with self.Session() as session:
-            if session.query(City.id).count() > 0:
-                return
-            with open('data/city_list.json') as f:
-                city_list = json.load(f)
-            for city in city_list:
-                session.add(City(**city))
-            session.commit()
+            load_city_registry().upsert(session)
 
-    
 
+def init_database(engine: Engine) -> None:
+    """Create missing tables, and add columns and indexes introduced after 
+    a table was created. Only nullable columns are ever added, so this is 
+    safe to run on every start."""
+    if engine.dialect.name == 'sqlite':
+        with engine.connect() as conn:
+            # only takes effect on a new file, before anything is written
+            # to it; older ones are converted by
+            # `python -m spider retention --vacuum`
+            conn.exec_driver_sql('PRAGMA auto_vacuum=INCREMENTAL')
+            # readers, such as the warehouse, never block the spider's
+            # writes
+            conn.exec_driver_sql('PRAGMA journal_mode=WAL')
+    Base.metadata.create_all(bind=engine)
+    inspector = inspect(engine)
+    preparer = engine.dialect.identifier_preparer
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing = {c['name'] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(
+                    f'ALTER TABLE {preparer.format_table(table)} '
+                    f'ADD COLUMN {preparer.format_column(column)} '
+                    f'{column_type}'
+                ))
+            for index in table.indexes:
+                index.create(bind=conn, checkfirst=True)
+    create_search_tables(engine)
+
+
+def count_progress(
+    session: Session, ds: str, city_code: str | None = None
+) -> dict[str, dict[str, int]]:
+    """Count finished/total items of every stage with aggregate queries."""
+    def count(model, finished) -> dict[str, int]:
+        query = (
+            session
+            .query(
+                func.count(), 
+                func.coalesce(func.sum(case((finished, 1), else_=0)), 0)
+            )
+            .filter(model.ds == ds)
+        )
+        if city_code is not None:
+            query = query.filter(model.city_code == city_code)
+        total, done = query.one()
+        return {'finished': done, 'total': total}
+
+    return {
+        'community_list': count(
+            CommunityProgress, CommunityProgress.is_finished == True
+        ),
+        'house_list': count(HouseProgress, HouseProgress.has_more == False),
+        'community_detail': count(
+            Community, Community.is_detail_crawled == True
+        ),
+        'house_detail': count(House, House.is_detail_crawled == True),
+    }
+
+
+def crawl_version(session: Session, city_code: str, ds: str) -> tuple:
+    """Counts that change whenever a stage adds, completes or deletes rows
+    of (city, ds), for versioning values derived from them."""
+    houses = session.execute(
+        select(func.count(), func.count().filter(House.is_detail_crawled))
+        .where(House.city_code == city_code)
+        .where(House.ds == ds)
+    ).one()
+    build_years = session.scalar(
+        select(func.count())
+        .select_from(CommunityAttribute)
+        .where(CommunityAttribute.city_code == city_code)
+        .where(CommunityAttribute.ds == ds)
+        .where(CommunityAttribute.key == 'build_year')
+    )
+    return (*houses, build_years)
@@ -0,0 +1,132 @@
+"""Compact binary encoding of community border polygons.
+
+The `border` string of a bubble (`lon,lat;lon,lat;...`, rings separated by
+`|`) is stored once per distinct content in the `borders` table, keyed by
+its hash, instead of as text on every community row of every ds.
+
+Encoding, all little-endian:
+
+    uint32          ring count
+    uint32[rings]   point count of every ring
+    int32[2 * n]    lon/lat in 1e-6 degrees, the first point of every ring
+                    absolute and the following ones as deltas
+
+`decode_border` reads the payload with `np.frombuffer` without parsing and
+only runs a cumulative sum to rebuild the coordinates.
+"""
+import hashlib
+
+import numpy as np
+from sqlalchemy import insert, select
+from sqlalchemy.orm import Session
+
+from .models import Border, Community
+from .writer import BatchWriter
+
+
+SCALE = 1_000_000
+
+
+def border_hash(text: str) -> str:
+    return hashlib.sha1(text.encode()).hexdigest()[:16]
+
+
+def encode_border(text: str) -> bytes:
+    rings = [ring for ring in text.strip().split('|') if ring]
+    counts, deltas = [], []
+    for ring in rings:
+        points = np.array(
+            ring.strip('; ').replace(';', ',').split(','), dtype=np.float64
+        ).reshape(-1, 2)
+        fixed = np.round(points * SCALE).astype(np.int64)
+        delta = np.diff(fixed, axis=0, prepend=np.zeros((1, 2), np.int64))
+        counts.append(len(points))
+        deltas.append(delta.astype('<i4'))
+    header = np.array([len(rings), *counts], dtype='<u4')
+    return header.tobytes() + b''.join(d.tobytes() for d in deltas)
+
+
+def decode_border(data: bytes) -> list[np.ndarray]:
+    """Decode a border into one (n, 2) float64 lon/lat array per ring."""
+    ring_count = int(np.frombuffer(data, dtype='<u4', count=1)[0])
+    counts = np.frombuffer(data, dtype='<u4', count=ring_count, offset=4)
+    deltas = np.frombuffer(
+        data, dtype='<i4', offset=4 * (1 + ring_count)
+    ).reshape(-1, 2)
+    rings, start = [], 0
+    for count in counts:
+        ring = deltas[start:start + count]
+        rings.append(np.cumsum(ring, axis=0, dtype=np.int64) / SCALE)
+        start += int(count)
+    return rings
+
+
+def contains(rings: list[np.ndarray], lon: float, lat: float) -> bool:
+    """Even-odd point-in-polygon test over all rings of a border."""
+    inside = False
+    for ring in rings:
+        x, y = ring[:, 0], ring[:, 1]
+        x2, y2 = np.roll(x, -1), np.roll(y, -1)
+        crosses = (y > lat) != (y2 > lat)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x_cross = (x2 - x) * (lat - y) / (y2 - y) + x
+        inside ^= bool(np.count_nonzero(crosses & (lon < x_cross)) % 2)
+    return inside
+
+
+class BorderStore:
+    """Deduplicating writer for border blobs, shared across one session.
+    New blobs are queued on `writer` when one is given."""
+
+    def __init__(
+        self, session: Session, writer: BatchWriter | None = None
+    ) -> None:
+        self.session = session
+        self.writer = writer
+        self.known = set()
+
+    def put(self, text: str | None) -> str | None:
+        if not text:
+            return None
+        key = border_hash(text)
+        if key in self.known:
+            return key
+        exists = self.session.execute(
+            select(Border.hash).where(Border.hash == key)
+        ).first()
+        if exists is None:
+            data = encode_border(text)
+            row = {'hash': key, 'data': data, 'size': len(data)}
+            if self.writer is not None:
+                self.writer.insert(Border, row)
+            else:
+                self.session.execute(insert(Border), [row])
+        self.known.add(key)
+        return key
+
+    def get(self, key: str) -> list[np.ndarray] | None:
+        data = self.session.execute(
+            select(Border.data).where(Border.hash == key)
+        ).scalar()
+        return decode_border(data) if data is not None else None
+
+
+def compact_borders(session: Session, batch_size: int = 1000) -> int:
+    """Move text borders of existing communities into the borders table."""
+    store = BorderStore(session)
+    total = 0
+    while True:
+        communities = (
+            session
+            .query(Community)
+            .filter(Community.border.is_not(None))
+            .limit(batch_size)
+            .all()
+        )
+        if not communities:
+            return total
+        for community in communities:
+            community.border_hash = store.put(community.border)
+            community.border = None
+        session.commit()
+        total += len(communities)
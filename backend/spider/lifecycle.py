@@ -0,0 +1,195 @@
+"""Listing lifecycle tracking across ds.
+
+`listing_states` keeps one row per listing with a fingerprint of the
+fields that matter for change detection. Every house list page is diffed
+against the states of just its listings, found by primary key, and the
+differences are written to `listing_events`. Listings not seen by the end
+of a complete house list stage still have an older `last_ds`, so
+delisting is one range scan of the `(city_code, is_active, last_ds)`
+index rather than a join of two snapshots. The stage is only complete
+when the community list it ran on was complete too, see
+`house_list_complete`; otherwise the listings of communities not listed
+yet would be reported as removed.
+"""
+import hashlib
+
+from sqlalchemy import and_, func, insert, literal, select, update
+from sqlalchemy.orm import Session
+
+from .database import count_progress
+from .models import Community, ListingEvent, ListingState
+from .writer import BatchWriter
+
+
+FINGERPRINT_FIELDS = ('priceStr', 'unitPriceStr', 'tags', 'title')
+
+
+def fingerprint(house: dict) -> str:
+    content = '\x1f'.join(str(house.get(f) or '') for f in FINGERPRINT_FIELDS)
+    return hashlib.blake2b(content.encode(), digest_size=8).hexdigest()
+
+
+def track_listings(
+    writer: BatchWriter,
+    city_code: str,
+    ds: str,
+    community_id: int,
+    houses: dict[int, dict],
+) -> None:
+    """Diff one page of list houses, keyed by id, against their states.
+
+    `tags` must already be joined into a string. The changes are queued on
+    `writer`; a listing whose state is still queued there was already seen
+    at `ds` on an earlier page and is skipped.
+    """
+    houses = {
+        house_id: house for house_id, house in houses.items()
+        if not writer.is_pending(
+            ListingState, {'city_code': city_code, 'house_id': house_id}
+        )
+    }
+    if not houses:
+        return
+    states = {
+        state.house_id: state for state in writer.session.execute(
+            select(
+                ListingState.house_id,
+                ListingState.fingerprint,
+                ListingState.priceStr,
+                ListingState.last_ds,
+                ListingState.is_active,
+            )
+            .where(ListingState.city_code == city_code)
+            .where(ListingState.house_id.in_(list(houses)))
+        )
+    }
+    new_states, updates, events = [], [], []
+    for house_id, house in houses.items():
+        key = fingerprint(house)
+        price = house.get('priceStr')
+        state = states.get(house_id)
+        if state is None:
+            new_states.append({
+                'city_code': city_code,
+                'house_id': house_id,
+                'community_id': community_id,
+                'fingerprint': key,
+                'priceStr': price,
+                'first_ds': ds,
+                'last_ds': ds,
+                'is_active': True,
+            })
+            kind = 'new'
+        elif not state.is_active:
+            kind = 'relisted'
+        elif state.fingerprint != key:
+            kind = 'changed'
+        elif state.last_ds == ds:
+            continue
+        else:
+            kind = None
+        if state is not None:
+            updates.append({
+                'city_code': city_code,
+                'house_id': house_id,
+                'fingerprint': key,
+                'priceStr': price,
+                'last_ds': ds,
+                'is_active': True,
+            })
+        if kind is not None:
+            events.append({
+                'city_code': city_code,
+                'ds': ds,
+                'house_id': house_id,
+                'community_id': community_id,
+                'kind': kind,
+                'price_before': state.priceStr if state is not None else None,
+                'price_after': price,
+            })
+    for row in new_states:
+        writer.insert(ListingState, row)
+    for row in updates:
+        writer.update(ListingState, row)
+    for row in events:
+        writer.append(ListingEvent, row)
+
+
+def house_list_complete(session: Session, city_code: str, ds: str) -> bool:
+    """Whether the list stages of (city, ds) have seen every listing: every
+    tile of the community list is finished, and every community found has
+    a house list progress with no pages left."""
+    progress = count_progress(session, ds, city_code)
+    tiles, pages = progress['community_list'], progress['house_list']
+    communities = session.scalar(
+        select(func.count())
+        .select_from(Community)
+        .where(Community.city_code == city_code)
+        .where(Community.ds == ds)
+    )
+    return (
+        tiles['total'] > 0
+        and tiles['finished'] == tiles['total']
+        and pages['total'] == communities
+        and pages['finished'] == pages['total']
+    )
+
+
+def detect_removed(session: Session, city_code: str, ds: str) -> int:
+    """Emit `removed` events for active listings not seen at `ds`. Only
+    call this once `house_list_complete` is true for `ds`."""
+    stale = and_(
+        ListingState.city_code == city_code,
+        ListingState.is_active == True,
+        ListingState.last_ds < ds,
+    )
+    result = session.execute(
+        insert(ListingEvent).from_select(
+            [
+                'city_code',
+                'ds',
+                'house_id',
+                'community_id',
+                'kind',
+                'price_before',
+            ],
+            select(
+                ListingState.city_code,
+                literal(ds),
+                ListingState.house_id,
+                ListingState.community_id,
+                literal('removed'),
+                ListingState.priceStr,
+            ).where(stale)
+        )
+    )
+    session.execute(
+        update(ListingState).where(stale).values(is_active=False)
+    )
+    session.commit()
+    return result.rowcount
+
+
+def list_events(
+    session: Session,
+    city_code: str,
+    ds: str,
+    kind: str | None = None,
+    limit: int = 1000,
+) -> list[dict]:
+    stmt = (
+        select(
+            ListingEvent.house_id,
+            ListingEvent.community_id,
+            ListingEvent.kind,
+            ListingEvent.price_before,
+            ListingEvent.price_after,
+        )
+        .where(ListingEvent.city_code == city_code)
+        .where(ListingEvent.ds == ds)
+        .order_by(ListingEvent.id)
+        .limit(limit)
+    )
+    if kind is not None:
+        stmt = stmt.where(ListingEvent.kind == kind)
+    return [dict(row) for row in session.execute(stmt).mappings()]
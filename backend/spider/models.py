@@ -1,6 +1,9 @@
 from datetime import datetime
 
-from sqlalchemy import String, Text, Float, Integer, Boolean, ForeignKey
+from sqlalchemy import (
+    String, Text, Float, Integer, Boolean, DateTime, ForeignKey, LargeBinary, 
+    Index
+)
 from sqlalchemy.orm import Mapped, mapped_column, DeclarativeBase, relationship
 
 
@@ -38,6 +41,7 @@ class Community(Base):
     status: Mapped[str | None] = mapped_column(Text, nullable=True)
     priceUnit: Mapped[str | None] = mapped_column(Text, nullable=True)
     border: Mapped[str | None] = mapped_column(Text, nullable=True)
+    border_hash: Mapped[str | None] = mapped_column(String(16), nullable=True)
     bubbleDesc: Mapped[str | None] = mapped_column(Text, nullable=True)
     icon: Mapped[str | None] = mapped_column(Text, nullable=True)
     entityId: Mapped[str | None] = mapped_column(Text, nullable=True)
@@ -59,6 +63,22 @@ class Community(Base):
     price_desc: Mapped[str | None] = mapped_column(Text, nullable=True)
     info: Mapped[str | None] = mapped_column(Text, nullable=True)
 
+    # numeric values parsed from the text fields, for filtering and sorting
+    unit_price_value: Mapped[float | None] = mapped_column(
+        Float, nullable=True
+    )
+
+    __table_args__ = (
+        Index(
+            'ix_communities_city_ds_unit_price', 
+            'city_code', 'ds', 'unit_price_value', 'id'
+        ),
+        Index(
+            'ix_communities_city_ds_count', 'city_code', 'ds', 'count', 'id'
+        ),
+        Index('ix_communities_city_ds_block', 'city_code', 'ds', 'block_name'),
+    )
+
 
 class CommunityProgress(Base):
     __tablename__ = "community_progresses"
@@ -105,6 +125,33 @@ class House(Base):
     area_main_info: Mapped[str | None] = mapped_column(Text, nullable=True)
     area_sub_info: Mapped[str | None] = mapped_column(Text, nullable=True)
 
+    # numeric values parsed from the text fields, for filtering and sorting:
+    # total price in 万, unit price in 元/平 and area in 平米
+    total_price_value: Mapped[float | None] = mapped_column(
+        Float, nullable=True
+    )
+    unit_price_value: Mapped[float | None] = mapped_column(
+        Float, nullable=True
+    )
+    area_value: Mapped[float | None] = mapped_column(Float, nullable=True)
+
+    __table_args__ = (
+        Index(
+            'ix_houses_city_ds_total_price', 
+            'city_code', 'ds', 'total_price_value', 'id'
+        ),
+        Index(
+            'ix_houses_city_ds_unit_price', 
+            'city_code', 'ds', 'unit_price_value', 'id'
+        ),
+        Index('ix_houses_city_ds_area', 'city_code', 'ds', 'area_value', 'id'),
+        Index(
+            'ix_houses_city_ds_district', 
+            'city_code', 'ds', 'district_name', 'block_name'
+        ),
+        Index('ix_houses_city_ds_id', 'city_code', 'ds', 'id'),
+    )
+
 
 class HouseProgress(Base):
     __tablename__ = "house_progresses"
@@ -116,4 +163,142 @@ class HouseProgress(Base):
     community_id: Mapped[str] = mapped_column(String(20))
     finished_page: Mapped[int] = mapped_column(Integer, default=0)
     has_more: Mapped[bool] = mapped_column(Boolean, default=True)
-    
\ No newline at end of file
+
+
+class PriceTile(Base):
+    __tablename__ = "price_tiles"
+
+    city_code: Mapped[str] = mapped_column(String(8), primary_key=True)
+    ds: Mapped[str] = mapped_column(String(8), primary_key=True)
+    z: Mapped[int] = mapped_column(Integer, primary_key=True)
+    x: Mapped[int] = mapped_column(Integer, primary_key=True)
+    y: Mapped[int] = mapped_column(Integer, primary_key=True)
+
+    etag: Mapped[str] = mapped_column(String(16))
+    data: Mapped[bytes] = mapped_column(LargeBinary)
+
+
+class ComparablesTree(Base):
+    """Packed comparables matrix and KD-tree of a (city, ds)."""
+    __tablename__ = "comparables_trees"
+
+    city_code: Mapped[str] = mapped_column(String(8), primary_key=True)
+    ds: Mapped[str] = mapped_column(String(8), primary_key=True)
+
+    etag: Mapped[str] = mapped_column(String(16))
+    data: Mapped[bytes] = mapped_column(LargeBinary)
+
+
+class Border(Base):
+    __tablename__ = "borders"
+
+    hash: Mapped[str] = mapped_column(String(16), primary_key=True)
+    size: Mapped[int] = mapped_column(Integer)
+    data: Mapped[bytes] = mapped_column(LargeBinary)
+
+
+class CommunityAttribute(Base):
+    """One `.xiaoquInfoItem` of a community detail page, with the known 
+    labels mapped to stable keys and their numeric value parsed."""
+    __tablename__ = "community_attributes"
+
+    city_code: Mapped[str] = mapped_column(String(8), primary_key=True)
+    ds: Mapped[str] = mapped_column(String(8), primary_key=True)
+    key: Mapped[str] = mapped_column(String(32), primary_key=True)
+    community_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+
+    value: Mapped[str | None] = mapped_column(Text, nullable=True)
+    value_num: Mapped[float | None] = mapped_column(Float, nullable=True)
+
+
+class PriceIndex(Base):
+    """Daily unit price aggregates of a whole city (`level` 'city', empty 
+    `name`), of one district or of one block."""
+    __tablename__ = "price_index"
+
+    city_code: Mapped[str] = mapped_column(String(8), primary_key=True)
+    level: Mapped[str] = mapped_column(String(8), primary_key=True)
+    name: Mapped[str] = mapped_column(Text, primary_key=True)
+    ds: Mapped[str] = mapped_column(String(8), primary_key=True)
+
+    p25: Mapped[float | None] = mapped_column(Float, nullable=True)
+    median: Mapped[float | None] = mapped_column(Float, nullable=True)
+    p75: Mapped[float | None] = mapped_column(Float, nullable=True)
+    listing_count: Mapped[int] = mapped_column(Integer)
+    new_count: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    removed_count: Mapped[int | None] = mapped_column(Integer, nullable=True)
+
+
+class ListingState(Base):
+    """Latest known state of a listing, one row per house across all ds."""
+    __tablename__ = "listing_states"
+
+    city_code: Mapped[str] = mapped_column(String(8), primary_key=True)
+    house_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+
+    community_id: Mapped[int] = mapped_column(Integer)
+    fingerprint: Mapped[str] = mapped_column(String(16))
+    priceStr: Mapped[str | None] = mapped_column(Text, nullable=True)
+    first_ds: Mapped[str] = mapped_column(String(8))
+    last_ds: Mapped[str] = mapped_column(String(8))
+    is_active: Mapped[bool] = mapped_column(Boolean, default=True)
+
+    __table_args__ = (
+        Index(
+            'ix_listing_states_city_active_last_ds', 
+            'city_code', 'is_active', 'last_ds'
+        ),
+    )
+
+
+class ListingEvent(Base):
+    __tablename__ = "listing_events"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    city_code: Mapped[str] = mapped_column(String(8))
+    ds: Mapped[str] = mapped_column(String(8))
+    house_id: Mapped[int] = mapped_column(Integer)
+    community_id: Mapped[int] = mapped_column(Integer)
+    # new, changed, removed or relisted
+    kind: Mapped[str] = mapped_column(String(8))
+    price_before: Mapped[str | None] = mapped_column(Text, nullable=True)
+    price_after: Mapped[str | None] = mapped_column(Text, nullable=True)
+
+    __table_args__ = (
+        Index('ix_listing_events_city_ds_kind', 'city_code', 'ds', 'kind'),
+        Index('ix_listing_events_city_house', 'city_code', 'house_id'),
+    )
+
+
+class CrawlSession(Base):
+    """A logged-in cookie of the credential pool with its usage counters."""
+    __tablename__ = "crawl_sessions"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    name: Mapped[str | None] = mapped_column(Text, nullable=True)
+    cookie: Mapped[str] = mapped_column(Text)
+    created_at: Mapped[datetime] = mapped_column(DateTime)
+
+    request_count: Mapped[int] = mapped_column(Integer, default=0)
+    failure_count: Mapped[int] = mapped_column(Integer, default=0)
+    # failures since the last successful request
+    consecutive_failures: Mapped[int] = mapped_column(Integer, default=0)
+    last_used_at: Mapped[datetime | None] = mapped_column(
+        DateTime, nullable=True
+    )
+    cooldown_until: Mapped[datetime | None] = mapped_column(
+        DateTime, nullable=True
+    )
+    is_disabled: Mapped[bool] = mapped_column(Boolean, default=False)
+
+
+class PageValidator(Base):
+    """Cache validators and body hash of the last parsed copy of a page."""
+    __tablename__ = "page_validators"
+
+    url: Mapped[str] = mapped_column(Text, primary_key=True)
+    etag: Mapped[str | None] = mapped_column(Text, nullable=True)
+    last_modified: Mapped[str | None] = mapped_column(Text, nullable=True)
+    body_hash: Mapped[str] = mapped_column(String(32))
+    # ds whose rows hold the fields parsed from this body
+    ds: Mapped[str] = mapped_column(String(8))
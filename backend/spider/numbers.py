@@ -0,0 +1,27 @@
+import re
+
+
+NUMBER_PATTERN = re.compile(r'\d+(?:\.\d+)?')
+
+
+def parse_float(text: str | None) -> float | None:
+    """Extract the first number of a text field, e.g. `65,432元/平`."""
+    if not text:
+        return None
+    match = NUMBER_PATTERN.search(text.replace(',', ''))
+    return float(match.group()) if match is not None else None
+
+
+def parse_mean(text: str | None) -> float | None:
+    """Mean of all numbers of a text field, for ranges like `1.5至2.8元`."""
+    if not text:
+        return None
+    numbers = NUMBER_PATTERN.findall(text.replace(',', ''))
+    if not numbers:
+        return None
+    return sum(map(float, numbers)) / len(numbers)
+
+
+def coalesce(*values: float | None) -> float | None:
+    """The first value that is not None, so a parsed 0 is kept."""
+    return next((value for value in values if value is not None), None)
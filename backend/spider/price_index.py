@@ -0,0 +1,120 @@
+"""Materialized daily price index per city, district and block.
+
+After a crawl, the houses of the new ds are aggregated once against the
+previous ds and appended to `price_index`, so a trend over any period is
+a primary key range scan of one row per day instead of a rescan of every
+ds of raw houses.
+"""
+import pandas as pd
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.orm import Session
+
+from .analytics import read_house_frame
+from .models import House, PriceIndex
+
+
+# level -> column of the house frame grouped by, None for the whole city
+LEVELS = {'city': None, 'district': 'district_name', 'block': 'block_name'}
+
+
+def group_keys(df: pd.DataFrame, column: str | None) -> pd.Series:
+    if column is None:
+        return pd.Series('', index=df.index)
+    return df[column].astype(str)
+
+
+def aggregate(
+    df: pd.DataFrame, prev: pd.DataFrame | None
+) -> pd.DataFrame:
+    """Compute the index rows of every level for one ds."""
+    is_new = ~df.index.isin(prev.index) if prev is not None else None
+    removed = prev[~prev.index.isin(df.index)] if prev is not None else None
+    frames = []
+    for level, column in LEVELS.items():
+        keys = group_keys(df, column)
+        grouped = df['unit_price'].astype('float64').groupby(keys)
+        stats = pd.DataFrame({
+            'p25': grouped.quantile(0.25),
+            'median': grouped.median(),
+            'p75': grouped.quantile(0.75),
+            'listing_count': grouped.size(),
+        })
+        if prev is not None:
+            stats['new_count'] = (
+                pd.Series(is_new, index=df.index).groupby(keys).sum()
+            )
+            stats['removed_count'] = (
+                removed.groupby(group_keys(removed, column)).size()
+                .reindex(stats.index, fill_value=0)
+            )
+        else:
+            stats['new_count'] = None
+            stats['removed_count'] = None
+        stats['level'] = level
+        frames.append(stats.rename_axis('name').reset_index())
+    return pd.concat(frames, ignore_index=True)
+
+
+def build_price_index(session: Session, city_code: str, ds: str) -> int:
+    """Replace the index rows of (city, ds) and return how many were built."""
+    prev_ds = (
+        session
+        .query(func.max(House.ds))
+        .filter(House.city_code == city_code)
+        .filter(House.ds < ds)
+        .scalar()
+    )
+    df = read_house_frame(session, city_code, ds)
+    prev = (
+        read_house_frame(session, city_code, prev_ds)
+        if prev_ds is not None else None
+    )
+    stats = aggregate(df, prev) if len(df) else pd.DataFrame()
+    stats = stats.astype(object).where(stats.notna(), None)
+    rows = [
+        {'city_code': city_code, 'ds': ds, **row}
+        for row in stats.to_dict('records')
+    ]
+    session.execute(
+        delete(PriceIndex)
+        .where(PriceIndex.city_code == city_code)
+        .where(PriceIndex.ds == ds)
+    )
+    if rows:
+        session.execute(insert(PriceIndex), rows)
+    session.commit()
+    return len(rows)
+
+
+def price_trend(
+    session: Session,
+    city_code: str,
+    level: str = 'city',
+    name: str = '',
+    start_ds: str | None = None,
+    end_ds: str | None = None,
+) -> dict[str, list]:
+    stmt = (
+        select(
+            PriceIndex.ds,
+            PriceIndex.p25,
+            PriceIndex.median,
+            PriceIndex.p75,
+            PriceIndex.listing_count,
+            PriceIndex.new_count,
+            PriceIndex.removed_count,
+        )
+        .where(PriceIndex.city_code == city_code)
+        .where(PriceIndex.level == level)
+        .where(PriceIndex.name == name)
+        .order_by(PriceIndex.ds)
+    )
+    if start_ds is not None:
+        stmt = stmt.where(PriceIndex.ds >= start_ds)
+    if end_ds is not None:
+        stmt = stmt.where(PriceIndex.ds <= end_ds)
+    result = session.execute(stmt)
+    columns = list(result.keys())
+    return dict(zip(columns, map(list, zip(*result.all())))) or {
+        column: [] for column in columns
+    }
@@ -0,0 +1,142 @@
+"""Order the detail stages so the most valuable pages are fetched first.
+
+Scores only use data that is already in the database: whether the item is
+new since the previous ds, whether its list price changed, the follow count
+seen on its last detail page and the size of its community. When a run is
+cut short by its `CrawlBudget`, the pages left over are the least useful.
+"""
+import math
+import re
+import time
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from .models import Community, House
+
+
+NEW_WEIGHT = 100.0
+PRICE_CHANGE_WEIGHT = 50.0
+FOLLOW_WEIGHT = 10.0
+COUNT_WEIGHT = 5.0
+
+
+class CrawlBudget:
+    def __init__(
+        self, max_requests: int | None = None, max_minutes: float | None = None
+    ) -> None:
+        self.max_requests = max_requests
+        self.max_minutes = max_minutes
+        self.requests = 0
+        self.start_time = time.monotonic()
+        # set once a budgeted fetch leaves urls unsent, as opposed to a
+        # run that spent the budget exactly or ran out of time afterwards
+        self.cut_off = False
+
+    def spend(self, requests: int = 1) -> None:
+        self.requests += requests
+
+    def exhausted(self) -> bool:
+        if self.max_requests is not None:
+            if self.requests >= self.max_requests:
+                return True
+        if self.max_minutes is not None:
+            return time.monotonic() - self.start_time >= self.max_minutes * 60
+        return False
+
+
+def parse_count(text: str | None) -> int:
+    if not text:
+        return 0
+    match = re.search(r'\d+', text.replace(',', ''))
+    return int(match.group()) if match is not None else 0
+
+
+def previous_ds(
+    session: Session, model, ds: str, city_code: str
+) -> str | None:
+    return (
+        session
+        .query(func.max(model.ds))
+        .filter(model.ds < ds)
+        .filter(model.city_code == city_code)
+        .scalar()
+    )
+
+
+def score(
+    is_new: bool, price_changed: bool, follow_cnt: int, count: int
+) -> float:
+    return (
+        NEW_WEIGHT * is_new
+        + PRICE_CHANGE_WEIGHT * price_changed
+        + FOLLOW_WEIGHT * math.log1p(follow_cnt)
+        + COUNT_WEIGHT * math.log1p(count)
+    )
+
+
+def rank_communities(
+    session: Session, communities: list[Community], ds: str, city_code: str
+) -> list[Community]:
+    prev_ds = previous_ds(session, Community, ds, city_code)
+    prev = {}
+    if prev_ds is not None:
+        prev = {
+            row.id: row for row in (
+                session
+                .query(Community.id, Community.priceStr, Community.follow_cnt)
+                .filter(Community.ds == prev_ds)
+                .filter(Community.city_code == city_code)
+            )
+        }
+
+    def community_score(community: Community) -> float:
+        old = prev.get(community.id)
+        return score(
+            is_new=old is None,
+            price_changed=(
+                old is not None and old.priceStr != community.priceStr
+            ),
+            follow_cnt=parse_count(old.follow_cnt if old else None),
+            count=community.count or 0,
+        )
+
+    return sorted(communities, key=community_score, reverse=True)
+
+
+def rank_houses(
+    session: Session, houses: list[House], ds: str, city_code: str
+) -> list[House]:
+    prev_ds = previous_ds(session, House, ds, city_code)
+    prev = {}
+    if prev_ds is not None:
+        prev = {
+            (row.id, row.community_id): row for row in (
+                session
+                .query(
+                    House.id,
+                    House.community_id,
+                    House.priceStr,
+                    House.follow_cnt
+                )
+                .filter(House.ds == prev_ds)
+                .filter(House.city_code == city_code)
+            )
+        }
+    counts = dict(
+        session
+        .query(Community.id, Community.count)
+        .filter(Community.ds == ds)
+        .filter(Community.city_code == city_code)
+    )
+
+    def house_score(house: House) -> float:
+        old = prev.get((house.id, house.community_id))
+        return score(
+            is_new=old is None,
+            price_changed=old is not None and old.priceStr != house.priceStr,
+            follow_cnt=parse_count(old.follow_cnt if old else None),
+            count=counts.get(house.community_id) or 0,
+        )
+
+    return sorted(houses, key=house_score, reverse=True)
@@ -0,0 +1,311 @@
+"""Filtered, keyset-paginated reads of crawled houses and communities.
+
+Results are ordered by `(sort column, id)` and a page continues strictly
+after the last row of the previous one, so every page is an index range
+scan on the `(city_code, ds, <sort column>, id)` indexes no matter how deep
+it is. Cursors are opaque base64 strings of the sort, the order and that
+last `(value, id)`; a cursor is rejected with any other sort or order,
+whose keyset it does not belong to.
+"""
+import base64
+import json
+from collections.abc import Iterator
+
+from sqlalchemy import Select, func, or_, select, tuple_, update
+from sqlalchemy.orm import Session, sessionmaker
+
+from .models import Community, House
+from .numbers import coalesce, parse_float
+
+
+HOUSE_FIELDS = [
+    House.id,
+    House.ds,
+    House.city_code,
+    House.community_id,
+    House.title,
+    House.desc,
+    House.tags,
+    House.priceStr,
+    House.unitPriceStr,
+    House.actionUrl,
+    House.main_title,
+    House.district_name,
+    House.block_name,
+    House.follow_cnt,
+    House.room_main_info,
+    House.type_main_info,
+    House.area_main_info,
+    House.total_price_value,
+    House.unit_price_value,
+    House.area_value,
+]
+
+COMMUNITY_FIELDS = [
+    Community.id,
+    Community.ds,
+    Community.city_code,
+    Community.name,
+    Community.longitude,
+    Community.latitude,
+    Community.count,
+    Community.priceStr,
+    Community.main_title,
+    Community.block_name,
+    Community.follow_cnt,
+    Community.unit_price,
+    Community.unit_price_value,
+    Community.border_hash,
+]
+
+SORT_COLUMNS = {
+    House: {
+        'id': House.id,
+        'total_price': House.total_price_value,
+        'unit_price': House.unit_price_value,
+        'area': House.area_value,
+    },
+    Community: {
+        'id': Community.id,
+        'unit_price': Community.unit_price_value,
+        'count': Community.count,
+    },
+}
+
+
+class QueryError(ValueError):
+    pass
+
+
+def encode_cursor(sort: str, order: str, value, row_id: int) -> str:
+    content = json.dumps([sort, order, value, row_id]).encode()
+    return base64.urlsafe_b64encode(content).decode()
+
+
+def decode_cursor(cursor: str, sort: str, order: str) -> tuple:
+    """Return the sort value and id of the last row of the previous page.
+    A cursor only continues the sort and order it was issued for."""
+    try:
+        decoded = json.loads(base64.urlsafe_b64decode(cursor))
+    except (ValueError, TypeError):
+        raise QueryError(f'Invalid cursor: {cursor}')
+    # any valid json decodes, only a `[sort, order, value, id]` list is a
+    # cursor
+    if not (
+        isinstance(decoded, list)
+        and len(decoded) == 4
+        and isinstance(decoded[0], str)
+        and isinstance(decoded[1], str)
+        and isinstance(decoded[2], (int, float, str, type(None)))
+        and type(decoded[3]) is int
+    ):
+        raise QueryError(f'Invalid cursor: {cursor}')
+    cursor_sort, cursor_order, value, row_id = decoded
+    if (cursor_sort, cursor_order) != (sort, order):
+        raise QueryError(
+            f'Cursor was issued for sort={cursor_sort} order={cursor_order}, '
+            f'not sort={sort} order={order}'
+        )
+    return value, row_id
+
+
+def latest_ds(session: Session, model, city_code: str) -> str | None:
+    return (
+        session
+        .query(func.max(model.ds))
+        .filter(model.city_code == city_code)
+        .scalar()
+    )
+
+
+def build_query(
+    model,
+    city_code: str,
+    ds: str,
+    district: str | None = None,
+    block: str | None = None,
+    min_price: float | None = None,
+    max_price: float | None = None,
+    min_unit_price: float | None = None,
+    max_unit_price: float | None = None,
+    min_area: float | None = None,
+    max_area: float | None = None,
+    sort: str = 'id',
+    order: str = 'asc',
+    cursor: str | None = None,
+) -> tuple[Select, object]:
+    """Build the select for one listing query and return it together with
+    its sort column, which the caller needs to encode the next cursor."""
+    if sort not in SORT_COLUMNS[model]:
+        raise QueryError(
+            f'sort must be one of {", ".join(SORT_COLUMNS[model])}'
+        )
+    if order not in ('asc', 'desc'):
+        raise QueryError('order must be asc or desc')
+    fields = HOUSE_FIELDS if model is House else COMMUNITY_FIELDS
+    sort_column = SORT_COLUMNS[model][sort]
+    stmt = (
+        select(*fields)
+        .where(model.city_code == city_code)
+        .where(model.ds == ds)
+    )
+
+    if district is not None:
+        if model is not House:
+            raise QueryError('district filter is only available for houses')
+        stmt = stmt.where(House.district_name == district)
+    if block is not None:
+        stmt = stmt.where(model.block_name == block)
+    ranges = [
+        (model.unit_price_value, min_unit_price, max_unit_price),
+    ]
+    if model is House:
+        ranges += [
+            (House.total_price_value, min_price, max_price),
+            (House.area_value, min_area, max_area),
+        ]
+    elif any(
+        value is not None
+        for value in (min_price, max_price, min_area, max_area)
+    ):
+        raise QueryError(
+            'price and area filters are only available for houses'
+        )
+    for column, low, high in ranges:
+        if low is not None:
+            stmt = stmt.where(column >= low)
+        if high is not None:
+            stmt = stmt.where(column <= high)
+
+    keys = [model.id]
+    if sort_column is not model.id:
+        # rows without a value can not be placed in the key order
+        stmt = stmt.where(sort_column.is_not(None))
+        keys = [sort_column, model.id]
+    if cursor is not None:
+        value, row_id = decode_cursor(cursor, sort, order)
+        if len(keys) == 1:
+            key, bound = model.id, row_id
+        else:
+            key, bound = tuple_(*keys), (value, row_id)
+        stmt = stmt.where(key > bound if order == 'asc' else key < bound)
+    stmt = stmt.order_by(
+        *[k.asc() if order == 'asc' else k.desc() for k in keys]
+    )
+    return stmt, sort_column
+
+
+def fetch_page(
+    session: Session,
+    stmt: Select,
+    sort_column,
+    limit: int,
+    *,
+    sort: str,
+    order: str,
+) -> dict:
+    """One page of a query from `build_query`, with the cursor of the next
+    page for the same `sort` and `order`."""
+    rows = session.execute(stmt.limit(limit + 1)).mappings().all()
+    items = [dict(row) for row in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        last = items[-1]
+        next_cursor = encode_cursor(
+            sort, order, last[sort_column.key], last['id']
+        )
+    return {'items': items, 'next_cursor': next_cursor}
+
+
+def backfill_numeric_columns(session: Session) -> int:
+    """Fill the parsed numeric columns of rows crawled before they existed."""
+    total = 0
+    partitions = (
+        session
+        .query(House.city_code, House.ds)
+        .filter(
+            or_(
+                House.total_price_value.is_(None),
+                House.unit_price_value.is_(None),
+                House.area_value.is_(None),
+            )
+        )
+        .distinct()
+        .all()
+    )
+    for city_code, ds in partitions:
+        rows = [
+            {
+                'id': row.id,
+                'ds': ds,
+                'community_id': row.community_id,
+                'city_code': city_code,
+                'total_price_value': coalesce(
+                    parse_float(row.total_price_num),
+                    parse_float(row.priceStr),
+                ),
+                'unit_price_value': coalesce(
+                    parse_float(row.unit_price),
+                    parse_float(row.unitPriceStr),
+                ),
+                'area_value': parse_float(row.area_main_info),
+            }
+            for row in (
+                session
+                .query(
+                    House.id,
+                    House.community_id,
+                    House.priceStr,
+                    House.unitPriceStr,
+                    House.total_price_num,
+                    House.unit_price,
+                    House.area_main_info,
+                )
+                .filter(House.city_code == city_code)
+                .filter(House.ds == ds)
+            )
+        ]
+        if rows:
+            session.execute(update(House), rows)
+        session.commit()
+        total += len(rows)
+
+    rows = [
+        {
+            'id': row.id,
+            'ds': row.ds,
+            'city_code': row.city_code,
+            'unit_price_value': parse_float(row.unit_price),
+        }
+        for row in (
+            session
+            .query(
+                Community.id,
+                Community.ds,
+                Community.city_code,
+                Community.unit_price
+            )
+            .filter(Community.unit_price_value.is_(None))
+            .filter(Community.unit_price.is_not(None))
+        )
+    ]
+    if rows:
+        session.execute(update(Community), rows)
+    session.commit()
+    return total + len(rows)
+
+
+def iter_rows(Session: sessionmaker, stmt: Select) -> Iterator[dict]:
+    """Yield all rows of `stmt` from a session of its own, so the rows can
+    be streamed after the request handler has returned."""
+    with Session() as session:
+        result = session.execute(stmt.execution_options(yield_per=1000))
+        for row in result.mappings():
+            yield dict(row)
+
+
+def column_types(stmt: Select) -> dict[str, type]:
+    return {
+        column.key: column.type.python_type
+        for column in stmt.selected_columns
+    }
@@ -0,0 +1,110 @@
+"""Response helpers for the API: orjson rendering and streamed bodies."""
+import codecs
+import io
+import json
+from collections.abc import Iterable, Iterator
+from itertools import batched
+
+import orjson
+from fastapi.responses import JSONResponse, StreamingResponse
+
+try:
+    from brotli_asgi import BrotliMiddleware as CompressionMiddleware
+except ImportError:
+    from starlette.middleware.gzip import GZipMiddleware as CompressionMiddleware
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+HAS_ARROW = pa is not None
+
+
+ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+
+def dumps(content) -> bytes:
+    return orjson.dumps(content, default=str, option=ORJSON_OPTIONS)
+
+
+class ORJSONResponse(JSONResponse):
+    """JSON response rendered with orjson.
+
+    Returning it directly from an endpoint also skips FastAPI's 
+    `jsonable_encoder` pass, which dominates the cost of large payloads.
+    """
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+def stream_ndjson(rows: Iterable[dict]) -> StreamingResponse:
+    return StreamingResponse(
+        (dumps(row) + b'\n' for row in rows),
+        media_type='application/x-ndjson'
+    )
+
+
+def stream_arrow(
+    columns: dict[str, type], rows: Iterable[dict], batch_size: int = 10000
+) -> StreamingResponse:
+    """Stream rows as an Arrow IPC stream, one record batch at a time.
+
+    `columns` maps column names to python types, so the schema is fixed up
+    front and does not depend on the values of the first batch.
+    """
+    types = {int: pa.int64(), float: pa.float64()}
+    schema = pa.schema([
+        (name, types.get(python_type, pa.string()))
+        for name, python_type in columns.items()
+    ])
+
+    def generate() -> Iterator[bytes]:
+        sink = io.BytesIO()
+
+        def flush() -> bytes:
+            data = sink.getvalue()
+            sink.seek(0)
+            sink.truncate()
+            return data
+
+        with pa.ipc.new_stream(sink, schema) as writer:
+            for batch in batched(rows, batch_size):
+                writer.write_batch(
+                    pa.RecordBatch.from_pylist(list(batch), schema=schema)
+                )
+                yield flush()
+        yield flush()
+
+    return StreamingResponse(
+        generate(), media_type='application/vnd.apache.arrow.stream'
+    )
+
+
+def stream_text_field(
+    head: dict, field: str, chunks: Iterable[str]
+) -> Iterator[bytes]:
+    """Stream `{**head, field: "<chunks joined>"}` as JSON without ever 
+    holding the whole text in memory."""
+    yield dumps(head)[:-1] + (b',' if head else b'') + dumps(field) + b':"'
+    for chunk in chunks:
+        yield dumps(chunk)[1:-1]
+    yield b'"}'
+
+
+def read_chunks(
+    path: str, size: int = 1 << 16, start: int = 0, end: int | None = None
+) -> Iterator[str]:
+    """Decode the bytes `[start, end)` of a file, so a file that is still 
+    being appended to is read up to a known offset only."""
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start if end is not None else None
+        while chunk := f.read(
+            size if remaining is None else min(size, remaining)
+        ):
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield decoder.decode(chunk)
+        yield decoder.decode(b'', final=True)
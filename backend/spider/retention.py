@@ -0,0 +1,263 @@
+"""Retention of old ds partitions, with archival and database maintenance.
+
+The online database keeps what the API serves day to day:
+
+- progress rows only for the last `progress_days` ds, since a crawl never
+  resumes an older ds,
+- listing snapshots (`houses`, `communities`, `community_attributes`) for
+  the last `online_days` ds,
+- comparables trees for the same ds as the snapshots they are built from,
+  dropped without an archive copy,
+- aggregates (`price_index`, `price_tiles`, `listing_events`,
+  `listing_states`) forever.
+
+Older snapshots are first written to Parquet under `archive_dir`, one
+file per table and (city, ds) in a hive layout such as
+`houses/city_code=310000/ds=20260101/part.parquet`, and only then deleted.
+Borders no longer referenced by any community are archived once and
+dropped too. Archiving needs pyarrow; with `archive=False` old snapshots
+are deleted without a copy.
+
+On SQLite, deleted pages are handed back to the file system with an
+incremental vacuum after every pass, and statistics are refreshed with
+ANALYZE when rows were deleted, or `PRAGMA optimize` otherwise. That needs
+the file in incremental auto-vacuum mode; switching it takes one full
+VACUUM, which locks the whole database, so it is only done when asked for
+with `convert`, by `python -m spider retention --vacuum` while no crawl is
+running.
+
+Retention never runs as part of a default crawl: it is its own CLI
+subcommand, or the `retention` stage when selected explicitly.
+"""
+import os
+import pathlib
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+
+import pandas as pd
+from sqlalchemy import Engine, delete, select, text
+from sqlalchemy.orm import Session
+
+from .models import (
+    Border, Community, CommunityAttribute, CommunityProgress,
+    ComparablesTree, House, HouseProgress
+)
+from .search import prune_search_index
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+
+SNAPSHOT_MODELS = (House, Community, CommunityAttribute)
+PROGRESS_MODELS = (CommunityProgress, HouseProgress)
+
+
+class RetentionError(RuntimeError):
+    pass
+
+
+@dataclass
+class RetentionPolicy:
+    progress_days: int = 2
+    online_days: int = 30
+    archive: bool = True
+    archive_dir: str = 'data/archive'
+
+    @classmethod
+    def from_env(cls) -> 'RetentionPolicy':
+        return cls(
+            progress_days=int(os.getenv('RETENTION_PROGRESS_DAYS', 2)),
+            online_days=int(os.getenv('RETENTION_ONLINE_DAYS', 30)),
+            archive=os.getenv('RETENTION_ARCHIVE', '1') != '0',
+            archive_dir=os.getenv('RETENTION_ARCHIVE_DIR', 'data/archive'),
+        )
+
+
+def cutoff_ds(days: int, today: date | None = None) -> str:
+    """The oldest ds still kept when keeping `days` days."""
+    today = today or date.today()
+    return (today - timedelta(days=days - 1)).strftime(r'%Y%m%d')
+
+
+def prune_progress(
+    session: Session, before_ds: str, city_code: str | None = None
+) -> int:
+    total = 0
+    for model in PROGRESS_MODELS:
+        stmt = delete(model).where(model.ds < before_ds)
+        if city_code is not None:
+            stmt = stmt.where(model.city_code == city_code)
+        total += session.execute(stmt).rowcount
+    session.commit()
+    return total
+
+
+def old_partitions(
+    session: Session, before_ds: str, city_code: str | None = None
+) -> list[tuple[str, str]]:
+    partitions = set()
+    for model in SNAPSHOT_MODELS:
+        stmt = (
+            select(model.city_code, model.ds)
+            .distinct()
+            .where(model.ds < before_ds)
+        )
+        if city_code is not None:
+            stmt = stmt.where(model.city_code == city_code)
+        partitions.update(tuple(row) for row in session.execute(stmt))
+    return sorted(partitions, key=lambda p: (p[1], p[0]))
+
+
+def partition_path(
+    archive_dir: str, table: str, city_code: str, ds: str
+) -> pathlib.Path:
+    return (
+        pathlib.Path(archive_dir) / table
+        / f'city_code={city_code}' / f'ds={ds}' / 'part.parquet'
+    )
+
+
+def write_parquet(frame: pd.DataFrame, path: pathlib.Path) -> None:
+    """Write atomically, so a crash never leaves a partial archive."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix('.tmp')
+    frame.to_parquet(tmp, engine='pyarrow', compression='zstd', index=False)
+    os.replace(tmp, path)
+
+
+def archive_partition(
+    session: Session, model, city_code: str, ds: str, archive_dir: str
+) -> int:
+    """Write the rows of one (city, ds) of a snapshot table to Parquet.
+    The partition columns live in the path only."""
+    table = model.__table__
+    columns = [c for c in table.columns if c.name not in ('city_code', 'ds')]
+    frame = pd.read_sql(
+        select(*columns)
+        .where(table.c.city_code == city_code)
+        .where(table.c.ds == ds),
+        session.connection()
+    )
+    if len(frame):
+        write_parquet(
+            frame, partition_path(archive_dir, table.name, city_code, ds)
+        )
+    return len(frame)
+
+
+def read_archive(
+    archive_dir: str, table: str, city_code: str, ds: str
+) -> pd.DataFrame | None:
+    """Read back one archived partition, or None if it was not archived."""
+    path = partition_path(archive_dir, table, city_code, ds)
+    if not path.exists():
+        return None
+    frame = pd.read_parquet(path)
+    return frame.assign(city_code=city_code, ds=ds)
+
+
+def prune_borders(session: Session, policy: RetentionPolicy) -> int:
+    """Drop borders that no community references any more, archiving them
+    first unless archival is off."""
+    referenced = (
+        select(Community.border_hash)
+        .where(Community.border_hash.is_not(None))
+    )
+    orphaned = Border.hash.not_in(referenced)
+    if policy.archive:
+        frame = pd.read_sql(
+            select(Border.__table__).where(orphaned), session.connection()
+        )
+        if len(frame):
+            stamp = datetime.now().strftime(r'%Y%m%d%H%M%S')
+            write_parquet(
+                frame,
+                pathlib.Path(policy.archive_dir) / 'borders'
+                / f'part-{stamp}.parquet'
+            )
+    total = session.execute(delete(Border).where(orphaned)).rowcount
+    session.commit()
+    return total
+
+
+def apply_retention(
+    session: Session,
+    policy: RetentionPolicy,
+    city_code: str | None = None,
+    today: date | None = None,
+) -> dict[str, int]:
+    """Prune progress rows and move old snapshots out of the database,
+    one (city, ds) per commit."""
+    if policy.archive and pyarrow is None:
+        raise RetentionError(
+            'pyarrow is required to archive old partitions; install it or '
+            'turn archival off'
+        )
+    summary = {
+        'progress_rows': prune_progress(
+            session, cutoff_ds(policy.progress_days, today), city_code
+        ),
+        'partitions': 0,
+        'archived_rows': 0,
+        'deleted_rows': 0,
+        'borders': 0,
+    }
+    before_ds = cutoff_ds(policy.online_days, today)
+    for city, ds in old_partitions(session, before_ds, city_code):
+        for model in SNAPSHOT_MODELS:
+            if policy.archive:
+                summary['archived_rows'] += archive_partition(
+                    session, model, city, ds, policy.archive_dir
+                )
+            summary['deleted_rows'] += session.execute(
+                delete(model)
+                .where(model.city_code == city)
+                .where(model.ds == ds)
+            ).rowcount
+        session.execute(
+            delete(ComparablesTree)
+            .where(ComparablesTree.city_code == city)
+            .where(ComparablesTree.ds == ds)
+        )
+        session.commit()
+        summary['partitions'] += 1
+    if summary['partitions']:
+        prune_search_index(session, before_ds, city_code)
+        summary['borders'] = prune_borders(session, policy)
+    return summary
+
+
+def maintain_database(
+    engine: Engine, analyze: bool = False, convert: bool = False
+) -> dict:
+    """Reclaim free pages and refresh planner statistics. SQLite only.
+
+    Free pages are only reclaimed once the file is in incremental
+    auto-vacuum mode; with `convert` a file that is not yet is switched
+    with a full VACUUM."""
+    if engine.dialect.name != 'sqlite':
+        return {'skipped': engine.dialect.name}
+    # VACUUM can not run inside a transaction
+    with engine.connect().execution_options(
+        isolation_level='AUTOCOMMIT'
+    ) as conn:
+        free_pages = conn.execute(text('PRAGMA freelist_count')).scalar()
+        # 2 is INCREMENTAL
+        if conn.execute(text('PRAGMA auto_vacuum')).scalar() != 2:
+            if convert:
+                conn.execute(text('PRAGMA auto_vacuum = INCREMENTAL'))
+                conn.execute(text('VACUUM'))
+                mode = 'vacuum'
+            else:
+                mode = 'not_incremental'
+        else:
+            # every row of the pragma frees one page, so step through all
+            # of them on the driver cursor
+            cursor = conn.connection.cursor()
+            cursor.execute('PRAGMA incremental_vacuum').fetchall()
+            cursor.close()
+            mode = 'incremental_vacuum'
+        conn.execute(text('ANALYZE' if analyze else 'PRAGMA optimize'))
+    return {'mode': mode, 'free_pages': free_pages, 'analyzed': analyze}
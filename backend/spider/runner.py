@@ -0,0 +1,178 @@
+"""Run the spider in a child process managed by the API server.
+
+The server only talks to the child through a pipe (``stop``, ``pause``,
+``resume``), so a multi-hour crawl never occupies the event loop or the
+request threadpool. A child that dies unexpectedly is restarted, and the new
+run picks up from the progress tables where the old one stopped.
+"""
+import logging
+import multiprocessing
+import threading
+import time
+from collections.abc import Iterable
+from multiprocessing.connection import Connection
+
+
+logger = logging.getLogger(__name__)
+
+
+def spider_process(
+    city_code: str,
+    stages: list[str] | None,
+    concurrency: int,
+    conn: Connection
+) -> None:
+    from .database import DatabaseService
+    from .spider import BeikeMapSpider
+
+    db_service = DatabaseService()
+    spider = BeikeMapSpider(city_code, db_service.Session, concurrency)
+
+    def listen():
+        while True:
+            try:
+                command = conn.recv()
+            except (EOFError, OSError):
+                # the server went away, finish the current item and exit
+                command = 'stop'
+            if command == 'stop':
+                spider.stop()
+                return
+            if command == 'pause':
+                spider.pause()
+            elif command == 'resume':
+                spider.resume()
+
+    threading.Thread(target=listen, daemon=True).start()
+    with spider:
+        spider.run(stages)
+
+
+class SpiderRunner:
+    def __init__(
+        self, max_restarts: int = 3, restart_delay: float = 5.0
+    ) -> None:
+        self.context = multiprocessing.get_context('spawn')
+        self.max_restarts = max_restarts
+        self.restart_delay = restart_delay
+        self.lock = threading.Lock()
+        self.process = None
+        self.conn = None
+        self.state = 'idle'
+        self.city_code = None
+        self.stages = None
+        self.concurrency = 1
+        self.restarts = 0
+        self.exitcode = None
+
+    def is_running(self) -> bool:
+        return self.state in ('running', 'paused', 'stopping', 'restarting')
+
+    def status(self) -> dict:
+        return {
+            'state': self.state,
+            'city_code': self.city_code,
+            'pid': self.process.pid if self.process is not None else None,
+            'restarts': self.restarts,
+            'exitcode': self.exitcode,
+        }
+
+    def start(
+        self,
+        city_code: str,
+        stages: Iterable[str] | None = None,
+        concurrency: int = 1
+    ) -> bool:
+        with self.lock:
+            if self.is_running():
+                return False
+            self.city_code = city_code
+            self.stages = list(stages) if stages is not None else None
+            self.concurrency = concurrency
+            self.restarts = 0
+            self.exitcode = None
+            self.spawn()
+        threading.Thread(target=self.monitor, daemon=True).start()
+        return True
+
+    def spawn(self) -> None:
+        parent_conn, child_conn = self.context.Pipe()
+        self.process = self.context.Process(
+            target=spider_process,
+            args=(self.city_code, self.stages, self.concurrency, child_conn),
+            name=f'spider_{self.city_code}',
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+        self.conn = parent_conn
+        self.state = 'running'
+        logger.info(f'Spider process {self.process.pid} started')
+
+    def monitor(self) -> None:
+        while True:
+            self.process.join()
+            with self.lock:
+                self.exitcode = self.process.exitcode
+                self.conn.close()
+                if self.state == 'stopping' or self.exitcode == 0:
+                    self.state = 'idle'
+                    return
+                if self.restarts >= self.max_restarts:
+                    logger.error(
+                        f'Spider process exited with {self.exitcode}, '
+                        f'giving up after {self.restarts} restarts'
+                    )
+                    self.state = 'failed'
+                    return
+                self.restarts += 1
+                self.state = 'restarting'
+                logger.warning(
+                    f'Spider process exited with {self.exitcode}, '
+                    f'restarting ({self.restarts}/{self.max_restarts})'
+                )
+            time.sleep(self.restart_delay)
+            with self.lock:
+                if self.state == 'stopping':
+                    self.state = 'idle'
+                    return
+                self.spawn()
+
+    def send(self, command: str) -> None:
+        try:
+            self.conn.send(command)
+        except (BrokenPipeError, OSError):
+            # the child is already exiting, the monitor will pick it up
+            pass
+
+    def stop(self) -> bool:
+        with self.lock:
+            if not self.is_running():
+                return False
+            if self.state != 'restarting':
+                self.send('stop')
+            self.state = 'stopping'
+            return True
+
+    def pause(self) -> bool:
+        with self.lock:
+            if self.state != 'running':
+                return False
+            self.send('pause')
+            self.state = 'paused'
+            return True
+
+    def resume(self) -> bool:
+        with self.lock:
+            if self.state != 'paused':
+                return False
+            self.send('resume')
+            self.state = 'running'
+            return True
+
+    def shutdown(self, timeout: float = 30) -> None:
+        self.stop()
+        if self.process is not None:
+            self.process.join(timeout)
+            if self.process.is_alive():
+                self.process.terminate()
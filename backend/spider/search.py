@@ -0,0 +1,230 @@
+"""Full-text search over community and house texts.
+
+Each listing is one document of an SQLite FTS5 table, keyed by its id as
+rowid and replaced whenever a newer ds of it is indexed, so the index
+grows with the number of distinct listings rather than with every crawl.
+
+FTS5's `unicode61` tokenizer treats a run of Chinese characters as one
+token, so texts are segmented here before they are stored: every run of
+CJK characters becomes its overlapping bigrams (plus its last character,
+so single character queries can match as prefixes), and latin words and
+numbers are kept as lowercase tokens. Queries are segmented the same way
+and a CJK keyword becomes a phrase of its bigrams.
+"""
+import re
+from collections.abc import Iterator
+from itertools import batched
+
+from sqlalchemy import Engine, or_, select, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from .models import Community, House
+from .query import COMMUNITY_FIELDS, HOUSE_FIELDS
+
+
+TOKEN_PATTERN = re.compile(r'[\u3400-\u4dbf\u4e00-\u9fff]+|[0-9a-zA-Z]+')
+
+# (table, model, indexed title fields, indexed body fields)
+INDEXES = {
+    'house': (
+        'house_search',
+        House,
+        ('title', 'main_title'),
+        ('desc', 'tags', 'sub_title', 'district_name', 'block_name'),
+    ),
+    'community': (
+        'community_search',
+        Community,
+        ('name', 'main_title'),
+        ('sub_title', 'block_name'),
+    ),
+}
+
+# bm25 weights of the title and body columns
+RANK_WEIGHTS = '2.0, 1.0'
+
+
+def segment(text: str | None) -> Iterator[str]:
+    for token in TOKEN_PATTERN.findall(text or ''):
+        if token.isascii():
+            yield token.lower()
+        elif len(token) == 1:
+            yield token
+        else:
+            for i in range(len(token) - 1):
+                yield token[i:i + 2]
+            yield token[-1]
+
+
+def match_query(keyword: str) -> str | None:
+    """Translate a keyword string into an FTS5 query in which every term
+    has to match."""
+    terms = []
+    for token in TOKEN_PATTERN.findall(keyword):
+        if token.isascii():
+            terms.append(f'"{token.lower()}"*')
+        elif len(token) == 1:
+            terms.append(f'"{token}"*')
+        else:
+            bigrams = [token[i:i + 2] for i in range(len(token) - 1)]
+            terms.append(f'"{" ".join(bigrams)}"')
+    if not terms:
+        return None
+    return ' AND '.join(terms)
+
+
+def create_search_tables(engine: Engine) -> bool:
+    """Create the FTS5 tables, returning False where FTS5 is unavailable."""
+    if engine.dialect.name != 'sqlite':
+        return False
+    try:
+        with engine.begin() as conn:
+            for table, *_ in INDEXES.values():
+                conn.execute(text(
+                    f'CREATE VIRTUAL TABLE IF NOT EXISTS {table} USING fts5('
+                    'title, body, city_code UNINDEXED, ds UNINDEXED, '
+                    "tokenize = 'unicode61')"
+                ))
+    except OperationalError:
+        return False
+    return True
+
+
+def has_search_tables(session: Session) -> bool:
+    if session.bind.dialect.name != 'sqlite':
+        return False
+    return session.execute(text(
+        "SELECT 1 FROM sqlite_master WHERE name = 'house_search'"
+    )).first() is not None
+
+
+def index_listings(
+    session: Session, city_code: str, ds: str, batch_size: int = 5000
+) -> int:
+    """Add or refresh the documents of every listing crawled at (city, ds)."""
+    if not has_search_tables(session):
+        return 0
+    total = 0
+    for table, model, title_fields, body_fields in INDEXES.values():
+        fields = [getattr(model, name) for name in title_fields + body_fields]
+        rows = session.execute(
+            select(model.id, *fields)
+            .where(model.city_code == city_code)
+            .where(model.ds == ds)
+            .execution_options(yield_per=batch_size)
+        )
+        for batch in batched(rows, batch_size):
+            docs = [
+                {
+                    'rowid': row[0],
+                    'city_code': city_code,
+                    'ds': ds,
+                    'title': ' '.join(
+                        token for value in row[1:1 + len(title_fields)]
+                        for token in segment(value)
+                    ),
+                    'body': ' '.join(
+                        token for value in row[1 + len(title_fields):]
+                        for token in segment(value)
+                    ),
+                }
+                for row in batch
+            ]
+            session.execute(
+                text(f'DELETE FROM {table} WHERE rowid = :rowid'), docs
+            )
+            session.execute(
+                text(
+                    f'INSERT INTO {table} (rowid, title, body, city_code, ds) '
+                    'VALUES (:rowid, :title, :body, :city_code, :ds)'
+                ),
+                docs
+            )
+            total += len(docs)
+    session.commit()
+    return total
+
+
+def search(
+    session: Session,
+    kind: str,
+    keyword: str,
+    city_code: str | None = None,
+    limit: int = 20,
+) -> list[dict]:
+    """Return the best matching listings, each as of the latest ds it was
+    indexed at, ordered by bm25 rank."""
+    table, model, title_fields, body_fields = INDEXES[kind]
+    fields = HOUSE_FIELDS if model is House else COMMUNITY_FIELDS
+    if not has_search_tables(session):
+        return like_search(
+            session, model, fields, title_fields + body_fields,
+            keyword, city_code, limit
+        )
+
+    query = match_query(keyword)
+    if query is None:
+        return []
+    city_filter = 'AND city_code = :city_code' if city_code is not None else ''
+    # every match is ranked; ordering by the rank column lets FTS5 keep
+    # only the best `limit` of them instead of sorting all
+    hits = session.execute(
+        text(
+            f'SELECT rowid, ds, rank FROM {table} '
+            f'WHERE {table} MATCH :query '
+            f"AND rank MATCH 'bm25({RANK_WEIGHTS})' {city_filter} "
+            'ORDER BY rank LIMIT :limit'
+        ),
+        {'query': query, 'city_code': city_code, 'limit': limit}
+    ).all()
+    if not hits:
+        return []
+
+    # a row-value IN can not use the primary key index on SQLite
+    rows = session.execute(
+        select(*fields)
+        .where(model.id.in_({id_ for id_, _, _ in hits}))
+        .where(model.ds.in_({ds for _, ds, _ in hits}))
+    ).mappings().all()
+    by_key = {(row['id'], row['ds']): dict(row) for row in rows}
+    return [
+        {**by_key[(id_, ds)], 'rank': rank}
+        for id_, ds, rank in hits if (id_, ds) in by_key
+    ]
+
+
+def like_search(
+    session: Session,
+    model,
+    fields: list,
+    field_names: tuple[str, ...],
+    keyword: str,
+    city_code: str | None,
+    limit: int,
+) -> list[dict]:
+    """Fallback scan for databases without FTS5."""
+    stmt = select(*fields).order_by(model.ds.desc()).limit(limit)
+    if city_code is not None:
+        stmt = stmt.where(model.city_code == city_code)
+    columns = [getattr(model, name) for name in field_names]
+    for term in keyword.split():
+        stmt = stmt.where(or_(*[column.contains(term) for column in columns]))
+    return [dict(row) for row in session.execute(stmt).mappings()]
+
+
+def prune_search_index(
+    session: Session, before_ds: str, city_code: str | None = None
+) -> int:
+    """Drop the documents of listings last indexed before `before_ds`."""
+    if not has_search_tables(session):
+        return 0
+    city_filter = 'AND city_code = :city_code' if city_code is not None else ''
+    total = 0
+    for table, *_ in INDEXES.values():
+        total += session.execute(
+            text(f'DELETE FROM {table} WHERE ds < :ds {city_filter}'),
+            {'ds': before_ds, 'city_code': city_code}
+        ).rowcount
+    session.commit()
+    return total
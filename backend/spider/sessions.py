@@ -0,0 +1,177 @@
+"""Pool of logged-in cookies shared by the requests of one spider run.
+
+Requests are spread over the enabled sessions, least used first, and a
+session is never used twice within `min_interval` seconds, which caps the
+request rate per account. A request answered with 401/403/429 or failing
+outright puts its session in a cooldown that doubles with every
+consecutive failure. After `max_failures` in a row the session is
+disabled until it is re-added. Counters are kept in memory and written
+back to `crawl_sessions` every `flush_every` requests and on close.
+Waiting for a session happens in slices of `WAIT_SLICE` seconds, so a
+stopped caller does not sit out a whole cooldown.
+
+With no sessions in the pool, requests are sent without a cookie, as
+before the pool existed.
+"""
+import threading
+import time
+from collections.abc import Callable
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+from sqlalchemy import bindparam, update
+from sqlalchemy.orm import sessionmaker
+
+from .models import CrawlSession
+
+
+RETIRE_STATUS = (401, 403, 429)
+WAIT_SLICE = 0.5
+
+
+@dataclass
+class PooledSession:
+    id: int
+    cookie: str
+    request_count: int = 0
+    failure_count: int = 0
+    consecutive_failures: int = 0
+    last_used: float = 0.0
+    cooldown_until: float = 0.0
+    is_disabled: bool = False
+
+
+class SessionPool:
+    def __init__(
+        self,
+        Session: sessionmaker,
+        min_interval: float = 1.0,
+        cooldown: float = 300,
+        max_failures: int = 5,
+        flush_every: int = 100,
+    ) -> None:
+        self.Session = Session
+        self.min_interval = min_interval
+        self.cooldown = cooldown
+        self.max_failures = max_failures
+        self.flush_every = flush_every
+        self.lock = threading.Lock()
+        self.available = threading.Condition(self.lock)
+        self.unflushed = 0
+        self.sessions = self.load()
+
+    def __len__(self) -> int:
+        return len(self.sessions)
+
+    def load(self) -> list[PooledSession]:
+        now, wall = time.monotonic(), datetime.now()
+        with self.Session() as session:
+            rows = (
+                session
+                .query(CrawlSession)
+                .filter(CrawlSession.is_disabled == False)
+                .all()
+            )
+            return [
+                PooledSession(
+                    id=row.id,
+                    cookie=row.cookie,
+                    request_count=row.request_count or 0,
+                    failure_count=row.failure_count or 0,
+                    consecutive_failures=row.consecutive_failures or 0,
+                    cooldown_until=(
+                        now + (row.cooldown_until - wall).total_seconds()
+                        if row.cooldown_until is not None
+                        and row.cooldown_until > wall
+                        else 0.0
+                    ),
+                )
+                for row in rows
+            ]
+
+    def acquire(
+        self, stopped: Callable[[], bool] | None = None
+    ) -> PooledSession | None:
+        """Take the least used session that is ready, waiting for one if
+        all are cooling down or were used too recently. Returns None when
+        the pool has no usable session at all, or once `stopped` returns
+        True while waiting."""
+        with self.available:
+            while True:
+                if stopped is not None and stopped():
+                    return None
+                candidates = [s for s in self.sessions if not s.is_disabled]
+                if not candidates:
+                    return None
+                now = time.monotonic()
+                ready_at = {
+                    s.id: max(
+                        s.last_used + self.min_interval, s.cooldown_until
+                    )
+                    for s in candidates
+                }
+                ready = [s for s in candidates if ready_at[s.id] <= now]
+                if ready:
+                    chosen = min(ready, key=lambda s: s.request_count)
+                    chosen.last_used = now
+                    chosen.request_count += 1
+                    return chosen
+                self.available.wait(
+                    min(min(ready_at.values()) - now, WAIT_SLICE)
+                )
+
+    def release(
+        self, pooled: PooledSession, status: int | None, blame: bool = True
+    ) -> None:
+        """Record the outcome of a request; `status` is None when the
+        request raised before a response arrived. With `blame` False, such
+        as when the request failed on its proxy, it does not count against
+        the session."""
+        with self.available:
+            if blame and (status is None or status in RETIRE_STATUS):
+                pooled.failure_count += 1
+                pooled.consecutive_failures += 1
+                pooled.cooldown_until = time.monotonic() + self.cooldown * (
+                    2 ** (pooled.consecutive_failures - 1)
+                )
+                if pooled.consecutive_failures >= self.max_failures:
+                    pooled.is_disabled = True
+            elif blame:
+                pooled.consecutive_failures = 0
+            self.unflushed += 1
+            flush = self.unflushed >= self.flush_every
+            self.available.notify_all()
+        if flush:
+            self.flush()
+
+    def flush(self) -> None:
+        with self.lock:
+            self.unflushed = 0
+            now, wall = time.monotonic(), datetime.now()
+            rows = [
+                {
+                    'session_id': s.id,
+                    'request_count': s.request_count,
+                    'failure_count': s.failure_count,
+                    'consecutive_failures': s.consecutive_failures,
+                    'is_disabled': s.is_disabled,
+                    'last_used_at': (
+                        wall - timedelta(seconds=now - s.last_used)
+                        if s.last_used else None
+                    ),
+                    'cooldown_until': (
+                        wall + timedelta(seconds=s.cooldown_until - now)
+                        if s.cooldown_until > now else None
+                    ),
+                }
+                for s in self.sessions if s.last_used
+            ]
+        if rows:
+            # a core update, since sessions may be deleted while in use
+            table = CrawlSession.__table__
+            with self.Session() as session:
+                session.execute(
+                    update(table).where(table.c.id == bindparam('session_id')),
+                    rows
+                )
+                session.commit()
@@ -0,0 +1,226 @@
+"""In-memory grid index over community coordinates, one per ds.
+
+Communities are bucketed into a uniform lon/lat grid and stored sorted by
+cell, so every grid row of a viewport is one contiguous `searchsorted`
+range. Candidates are then filtered exactly and either clustered on a
+zoom-dependent grid or returned as a page of points ordered by id.
+"""
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.orm import sessionmaker
+
+from .cache import DsCache
+from .geometry import BorderStore, contains
+from .models import Community
+
+
+CELL_SIZE = 0.05
+GRID_COLS = int(360 / CELL_SIZE)
+# below this zoom level viewports are answered with clusters
+CLUSTER_MAX_ZOOM = 14
+# a cluster covers roughly a quarter of a 256px tile
+CLUSTER_CELLS_PER_TILE = 4
+
+
+class CommunityGrid:
+    def __init__(
+        self,
+        ids: np.ndarray,
+        city_codes: np.ndarray,
+        names: np.ndarray,
+        lon: np.ndarray,
+        lat: np.ndarray,
+        counts: np.ndarray,
+        prices: np.ndarray,
+        border_hashes: np.ndarray,
+    ) -> None:
+        cells = self.cell_of(lon, lat)
+        order = np.argsort(cells, kind='stable')
+        self.cells = cells[order]
+        self.ids = ids[order]
+        self.city_codes = city_codes[order]
+        self.names = names[order]
+        self.lon = lon[order]
+        self.lat = lat[order]
+        self.counts = counts[order]
+        self.prices = prices[order]
+        self.border_hashes = border_hashes[order]
+
+    @staticmethod
+    def cell_of(lon: np.ndarray, lat: np.ndarray) -> np.ndarray:
+        col = np.floor((lon + 180) / CELL_SIZE).astype(np.int64)
+        row = np.floor((lat + 90) / CELL_SIZE).astype(np.int64)
+        return row * GRID_COLS + col
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def query(
+        self, min_lon: float, min_lat: float, max_lon: float, max_lat: float
+    ) -> np.ndarray:
+        """Return positions of the communities inside the bbox."""
+        if len(self) == 0:
+            return np.empty(0, dtype=np.int64)
+        # keep cell columns inside the grid so rows never overlap
+        min_lon, max_lon = max(min_lon, -180), min(max_lon, 180 - 1e-9)
+        min_lat, max_lat = max(min_lat, -90), min(max_lat, 90 - 1e-9)
+        min_col = int(np.floor((min_lon + 180) / CELL_SIZE))
+        max_col = int(np.floor((max_lon + 180) / CELL_SIZE))
+        min_row = int(np.floor((min_lat + 90) / CELL_SIZE))
+        max_row = int(np.floor((max_lat + 90) / CELL_SIZE))
+        rows = np.arange(min_row, max_row + 1, dtype=np.int64)
+        starts = np.searchsorted(self.cells, rows * GRID_COLS + min_col)
+        ends = np.searchsorted(
+            self.cells, rows * GRID_COLS + max_col, side='right'
+        )
+        candidates = np.concatenate([
+            np.arange(start, end) for start, end in zip(starts, ends)
+            if end > start
+        ] or [np.empty(0, dtype=np.int64)])
+        lon, lat = self.lon[candidates], self.lat[candidates]
+        inside = (
+            (lon >= min_lon) & (lon <= max_lon)
+            & (lat >= min_lat) & (lat <= max_lat)
+        )
+        return candidates[inside]
+
+    def points(
+        self, positions: np.ndarray, limit: int, cursor: int | None
+    ) -> dict:
+        positions = positions[np.argsort(self.ids[positions], kind='stable')]
+        if cursor is not None:
+            start = np.searchsorted(self.ids[positions], cursor, side='right')
+            positions = positions[start:]
+        page = positions[:limit]
+        return {
+            'type': 'points',
+            'items': [
+                {
+                    'id': int(self.ids[i]),
+                    'city_code': self.city_codes[i],
+                    'name': self.names[i],
+                    'longitude': float(self.lon[i]),
+                    'latitude': float(self.lat[i]),
+                    'count': int(self.counts[i]),
+                    'priceStr': self.prices[i],
+                    'border_hash': self.border_hashes[i],
+                }
+                for i in page
+            ],
+            'next_cursor': (
+                int(self.ids[page[-1]]) if len(positions) > limit else None
+            ),
+        }
+
+    def clusters(self, positions: np.ndarray, zoom: int) -> dict:
+        size = 360 / 2 ** zoom / CLUSTER_CELLS_PER_TILE
+        lon, lat = self.lon[positions], self.lat[positions]
+        keys = (
+            np.floor((lat + 90) / size).astype(np.int64) * (2 ** 32)
+            + np.floor((lon + 180) / size).astype(np.int64)
+        )
+        uniques, inverse, sizes = np.unique(
+            keys, return_inverse=True, return_counts=True
+        )
+        center_lon = np.bincount(inverse, weights=lon) / sizes
+        center_lat = np.bincount(inverse, weights=lat) / sizes
+        listings = np.bincount(inverse, weights=self.counts[positions])
+        return {
+            'type': 'clusters',
+            'items': [
+                {
+                    'longitude': round(float(x), 6),
+                    'latitude': round(float(y), 6),
+                    'size': int(n),
+                    'count': int(c),
+                }
+                for x, y, n, c in zip(center_lon, center_lat, sizes, listings)
+            ],
+            'next_cursor': None,
+        }
+
+
+class SpatialIndex:
+    def __init__(
+        self, Session: sessionmaker, max_entries: int = 4, ttl: float = 300
+    ) -> None:
+        self.Session = Session
+        self.cache = DsCache(max_entries, ttl)
+
+    def latest_ds(self) -> str | None:
+        with self.Session() as session:
+            return session.query(func.max(Community.ds)).scalar()
+
+    def grid(self, ds: str) -> CommunityGrid:
+        return self.cache.get(('grid', ds), lambda: self.build(ds))
+
+    def build(self, ds: str) -> CommunityGrid:
+        with self.Session() as session:
+            rows = (
+                session
+                .query(
+                    Community.id,
+                    Community.city_code,
+                    Community.name,
+                    Community.longitude,
+                    Community.latitude,
+                    Community.count,
+                    Community.priceStr,
+                    Community.border_hash,
+                )
+                .filter(Community.ds == ds)
+                .filter(Community.longitude.is_not(None))
+                .filter(Community.latitude.is_not(None))
+                .all()
+            )
+        columns = list(zip(*rows)) or [()] * 8
+        return CommunityGrid(
+            ids=np.array(columns[0], dtype=np.int64),
+            city_codes=np.array(columns[1], dtype=object),
+            names=np.array(columns[2], dtype=object),
+            lon=np.array(columns[3], dtype=np.float64),
+            lat=np.array(columns[4], dtype=np.float64),
+            counts=np.array(
+                [count or 0 for count in columns[5]], dtype=np.int64
+            ),
+            prices=np.array(columns[6], dtype=object),
+            border_hashes=np.array(columns[7], dtype=object),
+        )
+
+    def locate(
+        self, ds: str, lon: float, lat: float, radius: float = 0.02
+    ) -> int | None:
+        """Find the community whose border contains the point."""
+        grid = self.grid(ds)
+        positions = grid.query(
+            lon - radius, lat - radius, lon + radius, lat + radius
+        )
+        distance = (
+            (grid.lon[positions] - lon) ** 2 + (grid.lat[positions] - lat) ** 2
+        )
+        with self.Session() as session:
+            store = BorderStore(session)
+            for i in positions[np.argsort(distance)]:
+                if grid.border_hashes[i] is None:
+                    continue
+                rings = store.get(grid.border_hashes[i])
+                if rings is not None and contains(rings, lon, lat):
+                    return int(grid.ids[i])
+        return None
+
+    def search(
+        self,
+        ds: str,
+        bbox: tuple[float, float, float, float],
+        zoom: int | None = None,
+        limit: int = 500,
+        cursor: int | None = None,
+    ) -> dict:
+        grid = self.grid(ds)
+        positions = grid.query(*bbox)
+        result = {'ds': ds, 'total': len(positions)}
+        if zoom is not None and zoom < CLUSTER_MAX_ZOOM:
+            result.update(grid.clusters(positions, zoom))
+        else:
+            result.update(grid.points(positions, limit, cursor))
+        return result
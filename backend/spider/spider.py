@@ -1,32 +1,128 @@
 import asyncio
 import json
 import logging
+import math
 import os
 import pathlib
+import threading
 import time
+from collections import deque
+from collections.abc import Iterable, Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import closing
 from datetime import datetime
-from itertools import product
+from itertools import product, repeat
 
 import requests
 from bs4 import BeautifulSoup
-from sqlalchemy import create_engine, Engine, func
+from sqlalchemy import create_engine, Engine, select
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import Session
 from sqlalchemy.orm import sessionmaker
 
-from .database import DatabaseService
+from .attributes import save_attributes
+from .comparables import build_comparables
+from .database import count_progress
 from .constant import USER_AGENT, COMMUNITY_LIST_URL, HOUSE_LIST_URL
+from .geometry import BorderStore
+from .lifecycle import detect_removed, house_list_complete, track_listings
+from .numbers import coalesce, parse_float
+from .price_index import build_price_index
+from .proxies import BAN_STATUS, ProxyPool, parse_proxies
+from .retention import (
+    RetentionError, RetentionPolicy, apply_retention, maintain_database
+)
+from .search import index_listings
+from .sessions import SessionPool
+from .tiles import build_price_tiles
+from .transport import HostSessions
+from .validators import (
+    PAGE_STATUS, Validator, conditional_headers, is_unchanged,
+    load_validators, save_validator
+)
+from .writer import BatchWriter
+from .priority import CrawlBudget, rank_communities, rank_houses
 from .models import (
     Base, City, Community, CommunityProgress, House, HouseProgress
 )
 
 
+# detail page fields of a community, copied forward when it is unchanged
+DETAIL_FIELDS = (
+    'main_title',
+    'sub_title',
+    'block_name',
+    'follow_cnt',
+    'unit_price',
+    'unit_price_value',
+    'price_desc',
+    'info',
+)
+
+
 class BeikeMapSpider:
-    def __init__(self) -> None:
+    # stages of a run that does not name any
+    STAGES = (
+        'community_list', 
+        'community_detail', 
+        'house_list', 
+        'house_detail', 
+        'price_tiles',
+        'price_index',
+        'search_index',
+        'comparables',
+    )
+    # stages that only run when named, since they delete data
+    OPTIONAL_STAGES = (
+        'retention',
+    )
+
+    def __init__(
+        self, 
+        city_code: str, 
+        Session: sessionmaker, 
+        concurrency: int = 1,
+        budget: CrawlBudget | None = None,
+        proxy_pool: ProxyPool | None = None,
+        session_pool: SessionPool | None = None,
+    ) -> None:
         self.ds = datetime.today().strftime(r'%Y%m%d')
-        self.db_service = DatabaseService()
+        self.city_code = city_code
+        self.Session = Session
+        self.concurrency = max(concurrency, 1)
+        self.budget = budget or CrawlBudget()
+        self.interrupted = False
+        self.unpaused = threading.Event()
+        self.unpaused.set()
         self.headers = {'user-agent': USER_AGENT}
-        self.logger = logging.getLogger(f'spider_{self.ds}')
+        self.timeout = 30
+        self.retries = 2
+        if session_pool is None:
+            session_pool = SessionPool(
+                Session,
+                min_interval=float(
+                    os.getenv('SPIDER_SESSION_INTERVAL', 1.0)
+                ),
+            )
+        self.session_pool = session_pool
+        self.http = HostSessions(pool_size=self.concurrency)
+        self.proxy_pool = proxy_pool or ProxyPool(
+            parse_proxies(os.getenv('SPIDER_PROXIES'))
+        )
+        with self.Session() as session:
+            city = session.query(City).filter(City.code == city_code).first()
+            if city is None:
+                raise ValueError(f'Unknown city code: {city_code}')
+            if not city.url:
+                raise ValueError(f'No host known for city code: {city_code}')
+            self.city_url = city.url.rstrip('/')
+            self.min_lat, self.max_lat = city.min_lat, city.max_lat
+            self.min_lon, self.max_lon = city.min_lon, city.max_lon
+        self.logger = logging.getLogger(f'spider_{city_code}_{self.ds}')
         self.logger.setLevel(logging.INFO)
+        # set up in __enter__
+        self.db_session = None
+        self.writer = None
 
     def __enter__(self):
         # add console handler
@@ -35,23 +131,219 @@ class BeikeMapSpider:
         self.logger.addHandler(console_handler)
 
         # add file handler
-        log_file = Path(f'log/spider_{self.city_code}_{self.ds}.log')
+        log_file = pathlib.Path(f'log/spider_{self.city_code}_{self.ds}.log')
         log_file.parent.mkdir(parents=True, exist_ok=True)
         file_handler = logging.FileHandler(log_file)
         file_handler.setLevel(logging.INFO)
         self.logger.addHandler(file_handler)
+
+        self.db_session = self.Session()
+        self.writer = BatchWriter(self.db_session)
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        for handler in self.logger.handlers:
+        self.logger.info(f'Writer stats: {self.writer.stats()}')
+        self.db_session.close()
+        self.session_pool.flush()
+        self.logger.info(f'HTTP stats: {self.http.stats()}')
+        self.http.close()
+        if len(self.proxy_pool):
+            self.logger.info(f'Proxy stats: {self.proxy_pool.stats()}')
+        for handler in list(self.logger.handlers):
             self.logger.removeHandler(handler)
             handler.close()
 
+    def pause(self) -> None:
+        self.unpaused.clear()
+        self.logger.info('Spider paused')
+
+    def resume(self) -> None:
+        if not self.unpaused.is_set():
+            self.unpaused.set()
+            self.logger.info('Spider resumed')
+
+    def stop(self) -> None:
+        self.interrupted = True
+        self.resume()
+
+    def should_stop(self) -> bool:
+        """Block while paused, then tell whether the run should end.
+
+        Called between items, once the previous item is queued on the 
+        writer; its group is committed before pausing, so the database is 
+        not locked and finished items are not held back for the pause.
+        """
+        if not self.unpaused.is_set() and self.writer is not None:
+            self.writer.flush()
+        self.unpaused.wait()
+        return self.interrupted
+
+    def budget_exhausted(self) -> bool:
+        if self.budget.exhausted():
+            self.logger.info(
+                f'Crawl budget exhausted after {self.budget.requests} requests'
+            )
+            return True
+        return False
+
     @staticmethod
     def float_range(start, end, step, decimal=2):
         while start < end:
             yield round(start, decimal)
             start += step
+
+    def get(
+        self, 
+        url: str, 
+        key: str | None = None, 
+        headers: dict[str, str] | None = None
+    ) -> requests.Response | None:
+        """GET through the proxy pool with a cookie of the session pool, 
+        when either has any. Requests with the same `key` stick to one 
+        proxy.
+
+        A request that fails before a response arrives, such as on a dead 
+        or slow proxy, or that a proxy got banned for, is retried up to 
+        `retries` times, each time through a proxy not tried yet while 
+        there is one. The last ban response is returned as it is. Returns 
+        None when the run is stopped while waiting for a proxy or cookie.
+        """
+        tried = []
+        for attempt in range(self.retries + 1):
+            last = attempt == self.retries
+            try:
+                res = self.send(url, key, headers, tried)
+            except requests.RequestException as e:
+                if last:
+                    raise
+                reason = f'{type(e).__name__}: {e}'
+            else:
+                if (
+                    res is None or last or not len(self.proxy_pool)
+                    or res.status_code not in BAN_STATUS
+                ):
+                    return res
+                res.close()
+                reason = f'status {res.status_code} through a proxy'
+            self.logger.warning(f'Retrying {url} after {reason}')
+
+    def send(
+        self, 
+        url: str, 
+        key: str | None, 
+        headers: dict[str, str] | None,
+        tried: list[str],
+    ) -> requests.Response | None:
+        """One attempt of `get`. Proxies in `tried` are avoided, and the 
+        one this attempt goes through is appended to it."""
+        pooled = self.session_pool.acquire(lambda: self.interrupted)
+        if pooled is None and self.interrupted:
+            return None
+        proxy = self.proxy_pool.acquire(
+            key, exclude=tried, stopped=lambda: self.interrupted
+        )
+        if proxy is None and self.interrupted:
+            return None
+        if proxy is not None:
+            tried.append(proxy.url)
+        headers = {**self.headers, **(headers or {})}
+        if pooled is not None:
+            headers = {**headers, 'cookie': pooled.cookie}
+        status = None
+        start = time.monotonic()
+        try:
+            res = self.http.get(
+                url, 
+                headers=headers, 
+                proxies=proxy.proxies if proxy is not None else None,
+                timeout=self.timeout,
+            )
+            status = res.status_code
+            return res
+        finally:
+            if pooled is not None:
+                # a request that never reached the site says nothing
+                # about the cookie
+                self.session_pool.release(
+                    pooled, status, blame=status is not None or proxy is None
+                )
+            if proxy is not None:
+                self.proxy_pool.release(
+                    proxy, status, time.monotonic() - start
+                )
+
+    def fetch_all(
+        self, 
+        urls: Iterable[str], 
+        keys: Iterable[str | None] | None = None,
+        headers: Iterable[dict[str, str] | None] | None = None,
+        budgeted: bool = False,
+    ) -> Iterator[requests.Response]:
+        """Fetch urls with up to `concurrency` requests in flight, each 
+        with the proxy stickiness key and extra headers of the same 
+        position in `keys` and `headers`.
+
+        Responses are yielded in the order of `urls` so that parsing and 
+        database writes stay on the calling thread. A request is only 
+        submitted once the consumer is at most `concurrency` responses 
+        behind, so a paused consumer stops the crawl after the requests 
+        already in flight; those wait for the pause too before sending. 
+        Once the run is stopped nothing more is sent and the generator 
+        ends. Closing the generator cancels the requests not yet sent.
+
+        With `budgeted`, every request is charged to the crawl budget when 
+        it is submitted, and none is submitted once the budget is spent; 
+        urls left over then mark the budget as `cut_off`.
+        """
+        def fetch(
+            url: str, key: str | None, headers: dict[str, str] | None
+        ) -> requests.Response | None:
+            self.unpaused.wait()
+            if self.interrupted:
+                return None
+            res = self.get(url, key, headers)
+            time.sleep(0.1)
+            return res
+
+        def wait(future: Future) -> requests.Response | None:
+            # a group of the writer coming due while the response is
+            # outstanding, e.g. behind a proxy cooldown, is committed first
+            try:
+                return future.result(
+                    timeout=self.writer and self.writer.time_left()
+                )
+            except TimeoutError:
+                self.writer.flush()
+                return future.result()
+
+        if keys is None:
+            keys = repeat(None)
+        if headers is None:
+            headers = repeat(None)
+        executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        pending = deque()
+        try:
+            for args in zip(urls, keys, headers):
+                if self.interrupted:
+                    break
+                if budgeted and self.budget_exhausted():
+                    self.budget.cut_off = True
+                    break
+                if len(pending) >= self.concurrency:
+                    res = wait(pending.popleft())
+                    if res is None:
+                        return
+                    yield res
+                if budgeted:
+                    self.budget.spend()
+                pending.append(executor.submit(fetch, *args))
+            while pending:
+                res = wait(pending.popleft())
+                if res is None:
+                    return
+                yield res
+        finally:
+            executor.shutdown(cancel_futures=True)
         
     def get_community_list_url(
         self,
@@ -103,50 +395,57 @@ class BeikeMapSpider:
         self.logger.info('Community progress initialized')
 
     def crawl_community_list(self):
-        if self.interrupted:
+        if self.should_stop():
             return
-        with self.Session() as session:
-            progresses = (
-                session
-                .query(CommunityProgress)
-                .filter(CommunityProgress.ds == self.ds)
-                .filter(CommunityProgress.city_code == self.city_code)
-                .filter(CommunityProgress.is_finished == 0)
-                .order_by(CommunityProgress.id)
-                .all()
-            )
-            if not progresses:
-                self.logger.info(f'All communities are crawled')
-                return
-            for progress in progresses:
-                if self.interrupted:
-                    return
+        progresses = (
+            self.db_session
+            .query(CommunityProgress.id, CommunityProgress.url)
+            .filter(CommunityProgress.ds == self.ds)
+            .filter(CommunityProgress.city_code == self.city_code)
+            .filter(CommunityProgress.is_finished == 0)
+            .order_by(CommunityProgress.id)
+            .all()
+        )
+        if not progresses:
+            self.logger.info(f'All communities are crawled')
+            return
+        last_id = progresses[-1].id
+        border_store = BorderStore(self.db_session, self.writer)
+        responses = self.fetch_all([progress.url for progress in progresses])
+        with self.writer:
+            for progress, res in zip(progresses, responses):
+                if self.should_stop():
+                    responses.close()
+                    break
                 self.logger.info(
-                    f'Crawling community list '
-                    f'({progress.id}/{progresses[-1].id})'
+                    f'Crawling community list ({progress.id}/{last_id})'
                 )
-                res = requests.get(progress.url, headers=self.headers)
                 res.raise_for_status()
                 data = res.json()['data']
-                if 'bubbleList' in data:
-                    for bubble in data['bubbleList']:
-                        if (
-                            session.query(Community.id)
-                            .filter(Community.id == bubble['id'])
-                            .filter(Community.ds == self.ds)
-                            .filter(Community.city_code == self.city_code)
-                            .first()
-                        ):
-                            continue
-                        session.add(Community(
-                            **bubble, ds=self.ds, city_code=self.city_code
-                        ))
-                progress.is_finished = True
-                session.commit()
-                time.sleep(0.1)
+                for bubble in data.get('bubbleList', ()):
+                    row = {
+                        **bubble,
+                        'ds': self.ds,
+                        'city_code': self.city_code,
+                    }
+                    if self.writer.is_pending(Community, row) or (
+                        self.db_session.query(Community.id)
+                        .filter(Community.id == bubble['id'])
+                        .filter(Community.ds == self.ds)
+                        .filter(Community.city_code == self.city_code)
+                        .first()
+                    ):
+                        continue
+                    border = row.pop('border', None)
+                    row['border_hash'] = border_store.put(border)
+                    self.writer.insert(Community, row)
+                self.writer.mark(
+                    CommunityProgress, {'id': progress.id, 'is_finished': True}
+                )
+                self.writer.done()
 
     def crawl_community_detail(self):
-        if self.interrupted:
+        if self.should_stop():
             return
         communities = (
             self.db_session
@@ -159,66 +458,163 @@ class BeikeMapSpider:
         if not communities:
             self.logger.info(f'All community details are crawled')
             return
+        communities = rank_communities(
+            self.db_session, communities, self.ds, self.city_code
+        )
+        urls = [
+            self.get_community_detail_url(community.id) 
+            for community in communities
+        ]
+        validators = load_validators(self.db_session, urls)
+        previous = self.load_previous_details(validators, communities)
+        responses = self.fetch_all(
+            urls,
+            [str(community.id) for community in communities],
+            [
+                conditional_headers(validators.get(url)) 
+                if community.id in previous else None
+                for url, community in zip(urls, communities)
+            ],
+            budgeted=True,
+        )
+        # plain ids, since every group commit expires the loaded objects
+        community_ids = [community.id for community in communities]
+        parsed = unchanged = failed = downloaded = 0
+        with self.writer:
+            for url, community_id, res in zip(urls, community_ids, responses):
+                if self.should_stop():
+                    responses.close()
+                    break
+                downloaded += len(res.content)
+                if res.status_code not in PAGE_STATUS or (
+                    res.status_code == 304 and community_id not in previous
+                ):
+                    # left uncrawled, so the next run tries again
+                    self.logger.warning(
+                        f'Status {res.status_code} for community '
+                        f'{community_id}, skipped'
+                    )
+                    failed += 1
+                    continue
+                validator = validators.get(url)
+                if community_id in previous and is_unchanged(validator, res):
+                    self.logger.info(
+                        f'Unchanged details for community {community_id}'
+                    )
+                    values = previous[community_id]
+                    unchanged += 1
+                else:
+                    self.logger.info(
+                        f'Crawling details for community {community_id}'
+                    )
+                    values = self.parse_community_detail(res.content)
+                    parsed += 1
+                if values.get('info'):
+                    save_attributes(
+                        self.writer,
+                        community_id,
+                        self.ds,
+                        self.city_code,
+                        values['info']
+                    )
+                save_validator(self.writer, validator, url, res, self.ds)
+                self.writer.update(Community, {
+                    'id': community_id,
+                    'ds': self.ds,
+                    'city_code': self.city_code,
+                    **values,
+                    'is_detail_crawled': True,
+                })
+                self.writer.done()
+        self.logger.info(
+            f'Community details: {parsed} parsed, {unchanged} unchanged, '
+            f'{failed} failed, {downloaded} bytes downloaded'
+        )
+
+    def parse_community_detail(self, html: bytes) -> dict:
+        """Parse a community detail page into column values."""
+        values = {}
+        soup = BeautifulSoup(html, 'html.parser')
+
+        # crawl title
+        title = soup.select_one('.title')
+        if title is not None:
+            main_title = title.select_one('.main')
+            if main_title is not None:
+                values['main_title'] = main_title.get_text(strip=True)
+            sub_title = title.select_one('.sub')
+            if sub_title is not None:
+                values['sub_title'] = sub_title.get_text(strip=True)
+
+        # crawl catalog
+        catalog = soup.select_one('.intro.clear')
+        if catalog is not None:
+            catalogs = catalog.find_all('a')
+            if len(catalogs) > 2:
+                values['block_name'] = catalogs[2].get_text(strip=True)
+
+        # crawl follow count
+        follow_cnt = soup.find(id='favCount')
+        if follow_cnt is not None:
+            values['follow_cnt'] = follow_cnt.get_text(strip=True)
+
+        # crawl unit price
+        unit_price = soup.select_one('.xiaoquUnitPrice')
+        if unit_price is not None:
+            values['unit_price'] = unit_price.get_text(strip=True)
+            values['unit_price_value'] = parse_float(values['unit_price'])
+
+        # crawl unit price
+        price_desc = soup.select_one('.xiaoquUnitPriceDesc')
+        if price_desc is not None:
+            values['price_desc'] = price_desc.get_text(strip=True)
+
+        # crawl other info
+        info = {}
+        info_items = soup.select('.xiaoquInfoItem')
+        if info_items is not None:
+            for item in info_items:
+                label = item.select_one('.xiaoquInfoLabel')
+                content = item.select_one('.xiaoquInfoContent')
+                if label is not None and content is not None:
+                    label_text = label.get_text(strip=True)
+                    content_text = content.get_text(strip=True)
+                    info[label_text] = content_text
+        if len(info) > 0:
+            values['info'] = json.dumps(info, ensure_ascii=False)
+        return values
+
+    def load_previous_details(
+        self, validators: dict[str, Validator], communities: list
+    ) -> dict[int, dict]:
+        """Parsed detail fields of the ds each validator was saved at, for 
+        the communities that have them."""
+        ids_by_ds = {}
         for community in communities:
-            if self.interrupted:
-                return
-            self.logger.info(f'Crawling details for community {community.id}')
-            res = requests.get(
-                url=f'https://sh.ke.com/xiaoqu/{community.id}/',
-                headers=self.headers
+            validator = validators.get(
+                self.get_community_detail_url(community.id)
             )
-            soup = BeautifulSoup(res.content, 'html.parser')
-            
-            # crawl title
-            title = soup.select_one('.title')
-            if title is not None:
-                main_title = title.select_one('.main')
-                if main_title is not None:
-                    community.main_title = main_title.get_text(strip=True)
-                sub_title = title.select_one('.sub')
-                if sub_title is not None:
-                    community.sub_title = sub_title.get_text(strip=True)
-
-            # crawl catalog
-            catalog = soup.select_one('.intro.clear')
-            if catalog is not None: 
-                catalogs = catalog.find_all('a')
-                if len(catalogs) > 2:
-                    community.block_name = catalogs[2].get_text(strip=True)
-
-            # crawl follow count
-            follow_cnt = soup.find(id='favCount')
-            if follow_cnt is not None:
-                community.follow_cnt = follow_cnt.get_text(strip=True)
-            
-            # crawl unit price
-            unit_price = soup.select_one('.xiaoquUnitPrice')
-            if unit_price is not None:
-                community.unit_price = unit_price.get_text(strip=True)
-            
-            # crawl unit price
-            price_desc = soup.select_one('.xiaoquUnitPriceDesc')
-            if price_desc is not None:
-                community.price_desc = price_desc.get_text(strip=True)
-
-            # crawl other info
-            info = {}
-            info_items = soup.select('.xiaoquInfoItem')
-            if info_items is not None:
-                for item in info_items:
-                    label = item.select_one('.xiaoquInfoLabel')
-                    content = item.select_one('.xiaoquInfoContent')
-                    if label is not None and content is not None:
-                        label_text = label.get_text(strip=True)
-                        content_text = content.get_text(strip=True)
-                        info[label_text] = content_text
-            if len(info) > 0:
-                community.info = json.dumps(info, ensure_ascii=False)
-                
-            # save to database
-            community.is_detail_crawled = True
-            self.db_session.commit()
-            time.sleep(0.1)
+            if validator is not None and validator.ds != self.ds:
+                ids_by_ds.setdefault(validator.ds, []).append(community.id)
+        columns = [getattr(Community, field) for field in DETAIL_FIELDS]
+        previous = {}
+        for ds, ids in ids_by_ds.items():
+            for i in range(0, len(ids), 500):
+                rows = self.db_session.execute(
+                    select(Community.id, *columns)
+                    .where(Community.city_code == self.city_code)
+                    .where(Community.ds == ds)
+                    .where(Community.id.in_(ids[i:i + 500]))
+                    .where(Community.is_detail_crawled == True)
+                )
+                for row in rows:
+                    previous[row.id] = {
+                        field: getattr(row, field) for field in DETAIL_FIELDS
+                    }
+        return previous
+
+    def get_community_detail_url(self, community_id: int) -> str:
+        return f'{self.city_url}/xiaoqu/{community_id}/'
 
     def get_house_list_url(self, community_id: int, page: int):
         params = {
@@ -234,32 +630,37 @@ class BeikeMapSpider:
         return base_url + '?' + param_str
 
     def init_house_progress(self):
-        if not (
-            self.db_session
-            .query(HouseProgress)
-            .filter(HouseProgress.ds == self.ds)
-            .filter(HouseProgress.city_code == self.city_code)
-            .first()
-        ):
-            communities = (
+        # communities found by a community list resumed after this stage
+        # ran get their progress on the next run
+        known = {
+            community_id for community_id, in (
                 self.db_session
-                .query(Community.id)
-                .filter(Community.ds == self.ds)
-                .filter(Community.city_code == self.city_code)
-                .all()
+                .query(HouseProgress.community_id)
+                .filter(HouseProgress.ds == self.ds)
+                .filter(HouseProgress.city_code == self.city_code)
             )
-            for community in communities:
-                progress = HouseProgress(
-                    ds=self.ds, 
-                    community_id=community.id, 
-                    city_code=self.city_code
-                )
-                self.db_session.add(progress)
-            self.db_session.commit()
+        }
+        communities = (
+            self.db_session
+            .query(Community.id)
+            .filter(Community.ds == self.ds)
+            .filter(Community.city_code == self.city_code)
+            .all()
+        )
+        for community in communities:
+            if str(community.id) in known:
+                continue
+            progress = HouseProgress(
+                ds=self.ds, 
+                community_id=community.id, 
+                city_code=self.city_code
+            )
+            self.db_session.add(progress)
+        self.db_session.commit()
         self.logger.info('House progress initialized')
         
     def crawl_house_list(self):
-        if self.interrupted:
+        if self.should_stop():
             return
         progresses = (
             self.db_session
@@ -272,46 +673,135 @@ class BeikeMapSpider:
         if not progresses:
             self.logger.info(f'All houses are crawled for')
             return
-        for progress in progresses:
+        listing_counts = {
+            str(community_id): count for community_id, count in (
+                self.db_session
+                .query(Community.id, Community.count)
+                .filter(Community.ds == self.ds)
+                .filter(Community.city_code == self.city_code)
+            )
+        }
+        # plain values, since every group commit expires the loaded objects
+        progresses = [
+            (progress.id, progress.community_id, progress.finished_page)
+            for progress in progresses
+        ]
+        with self.writer:
+            for progress_id, community_id, finished_page in progresses:
+                if self.should_stop():
+                    return
+                self.logger.info(
+                    f'Crawling houses for community {community_id}'
+                )
+                pages = self.fetch_house_pages(
+                    community_id,
+                    finished_page + 1,
+                    listing_counts.get(str(community_id))
+                )
+                with closing(pages):
+                    for page, data in pages:
+                        self.save_house_page(community_id, data['list'])
+                        self.writer.mark(HouseProgress, {
+                            'id': progress_id,
+                            'finished_page': page,
+                            'has_more': data['hasMore'],
+                        })
+                        self.writer.done()
+
+        # only complete list stages tell which listings are gone
+        if house_list_complete(self.db_session, self.city_code, self.ds):
+            removed = detect_removed(self.db_session, self.city_code, self.ds)
+            self.logger.info(f'{removed} listings removed since last crawl')
+
+    def fetch_house_pages(
+        self, community_id: str, first_page: int, listing_count: int | None
+    ) -> Iterator[tuple[int, dict]]:
+        """Yield `(page, data)` for every remaining house list page, in order.
+
+        The first page tells the page size; together with the community's 
+        listing count from the bubble list that gives the number of pages, 
+        which are then fetched concurrently. Without a usable count, pages 
+        are prefetched speculatively `concurrency` at a time until one 
+        reports `hasMore` false.
+        """
+        with closing(self.fetch_all(
+            [self.get_house_list_url(community_id, first_page)],
+            [str(community_id)]
+        )) as responses:
+            res = next(responses, None)
+        if res is None:
+            return
+        res.raise_for_status()
+        data = res.json()['data']
+        yield first_page, data
+        if not data['hasMore']:
+            return
+
+        page = first_page + 1
+        page_size = len(data['list'])
+        if listing_count and page_size:
+            last_page = math.ceil(listing_count / page_size)
+            window = max(last_page - first_page, 0)
+        else:
+            window = self.concurrency
+        while True:
+            urls = [
+                self.get_house_list_url(community_id, p) 
+                for p in range(page, page + max(window, 1))
+            ]
+            keys = [str(community_id)] * len(urls)
+            with closing(self.fetch_all(urls, keys)) as responses:
+                for res in responses:
+                    res.raise_for_status()
+                    data = res.json()['data']
+                    yield page, data
+                    if not data['hasMore']:
+                        return
+                    page += 1
             if self.interrupted:
                 return
-            self.logger.info(
-                f'Crawling houses for community {progress.community_id}'
+            # the listing count was stale, continue speculatively
+            window = self.concurrency
+
+    def save_house_page(self, community_id: str, house_list: list[dict]):
+        houses = {
+            house['actionUrl'].split('/')[-1].split('.')[0]: {
+                **house, 
+                'tags': '|'.join([tag['desc'] for tag in house['tags']])
+            }
+            for house in house_list
+        }
+        track_listings(
+            self.writer,
+            self.city_code, 
+            self.ds, 
+            int(community_id), 
+            {int(house_id): house for house_id, house in houses.items()}
+        )
+        existing = {
+            str(house_id) for house_id, in (
+                self.db_session.query(House.id)
+                .filter(House.community_id == community_id)
+                .filter(House.ds == self.ds)
+                .filter(House.city_code == self.city_code)
+                .filter(House.id.in_(list(houses)))
             )
-            page = progress.finished_page + 1
-            while progress.has_more:
-                res = requests.get(
-                    url=self.get_house_list_url(progress.community_id, page), 
-                    headers=self.headers
-                )
-                house_list = res.json()['data']['list']
-                for house in house_list:
-                    house_id = house['actionUrl'].split('/')[-1].split('.')[0]
-                    if (
-                        self.db_session.query(House)
-                        .filter(House.community_id == progress.community_id)
-                        .filter(House.ds == self.ds)
-                        .filter(House.city_code == self.city_code)
-                        .filter(House.id == house_id)
-                        .first()
-                    ):
-                        continue
-                    self.db_session.add(House(
-                        **house,
-                        id=house_id,
-                        tags='|'.join([tag['desc'] for tag in house['tags']]),
-                        ds=self.ds,
-                        city_code=self.city_code,
-                        community_id=progress.community_id
-                    ))
-                progress.finished_page = page
-                progress.has_more = res.json()['data']['hasMore']
-                self.db_session.commit()
-                page += 1
-            time.sleep(0.1)
+        }
+        for house_id, house in houses.items():
+            if house_id in existing:
+                continue
+            self.writer.insert(House, {
+                **house,
+                'id': int(house_id),
+                'ds': self.ds,
+                'city_code': self.city_code,
+                'community_id': int(community_id),
+                'total_price_value': parse_float(house.get('priceStr')),
+                'unit_price_value': parse_float(house.get('unitPriceStr')),
+            })
 
     def crawl_house_detail(self):
-        if self.interrupted:
+        if self.should_stop():
             return
         houses = (
             self.db_session
@@ -324,84 +814,206 @@ class BeikeMapSpider:
         if not houses:
             self.logger.info(f'All house details are crawled')
             return
-        for house in houses:
-            if self.interrupted:
-                return
-            self.logger.info(f'Crawling details for house {house.id}')
-            res = requests.get(
-                url=house.actionUrl, 
-                headers=self.headers
+        houses = rank_houses(self.db_session, houses, self.ds, self.city_code)
+        urls = [house.actionUrl for house in houses]
+        responses = self.fetch_all(
+            urls,
+            [str(house.community_id) for house in houses],
+            budgeted=True
+        )
+        # plain values, since every group commit expires the loaded objects
+        houses = [
+            (
+                house.id,
+                house.community_id,
+                house.total_price_value,
+                house.unit_price_value,
             )
-            soup = BeautifulSoup(res.content, 'html.parser')
+            for house in houses
+        ]
+        with self.writer:
+            for (house_id, community_id, *prices), res in zip(
+                houses, responses
+            ):
+                if self.should_stop():
+                    responses.close()
+                    return
+                if res.status_code != 200:
+                    # left uncrawled, so the next run tries again
+                    self.logger.warning(
+                        f'Status {res.status_code} for house {house_id}, '
+                        'skipped'
+                    )
+                    continue
+                self.logger.info(f'Crawling details for house {house_id}')
+                values = self.parse_house_detail(res.content, *prices)
+                self.writer.update(House, {
+                    'id': house_id,
+                    'ds': self.ds,
+                    'community_id': community_id,
+                    'city_code': self.city_code,
+                    **values,
+                    'is_detail_crawled': True,
+                })
+                self.writer.done()
             
-            # crawl title
-            title = soup.select_one('.title')
-            if title is not None:
-                main_title = title.select_one('.main')
-                if main_title is not None:
-                    house.main_title = main_title.get_text(strip=True)
-                sub_title = title.select_one('.sub')
-                if sub_title is not None:
-                    house.sub_title = sub_title.get_text(strip=True)
-
-            # crawl catalog
-            catalog = soup.select_one('.intro.clear')
-            if catalog is not None: 
-                catalogs = catalog.find_all('a')
-                if len(catalogs) > 2:
-                    house.district_name = catalogs[2].get_text(strip=True)
-                if len(catalogs) > 3:
-                    house.block_name = catalogs[3].get_text(strip=True)
-
-            # crawl follow count
-            follow_cnt = soup.find(id='favCount')
-            if follow_cnt is not None:
-                house.follow_cnt = follow_cnt.get_text(strip=True)
-
-            # crawl price
-            price = soup.select_one('.price-container')
-            if price is not None:
-                total_price_num = price.select_one('.total')
-                total_price_unit = price.select_one('.unit')
-                unit_price = price.select_one('.unitPrice')
-                if total_price_num is not None:
-                    house.total_price_num = total_price_num.get_text(strip=True)
-                if total_price_unit is not None:
-                    house.total_price_unit = total_price_unit.get_text(strip=True)
-                if unit_price is not None:
-                    house.unit_price = unit_price.get_text(strip=True)
+    def parse_house_detail(
+        self,
+        html: bytes,
+        total_price_value: float | None,
+        unit_price_value: float | None
+    ) -> dict:
+        """Parse a house detail page into column values; the prices parsed
+        from the list page are kept where the page has none."""
+        values = {}
+        soup = BeautifulSoup(html, 'html.parser')
+
+        # crawl title
+        title = soup.select_one('.title')
+        if title is not None:
+            main_title = title.select_one('.main')
+            if main_title is not None:
+                values['main_title'] = main_title.get_text(strip=True)
+            sub_title = title.select_one('.sub')
+            if sub_title is not None:
+                values['sub_title'] = sub_title.get_text(strip=True)
+
+        # crawl catalog
+        catalog = soup.select_one('.intro.clear')
+        if catalog is not None:
+            catalogs = catalog.find_all('a')
+            if len(catalogs) > 2:
+                values['district_name'] = catalogs[2].get_text(strip=True)
+            if len(catalogs) > 3:
+                values['block_name'] = catalogs[3].get_text(strip=True)
+
+        # crawl follow count
+        follow_cnt = soup.find(id='favCount')
+        if follow_cnt is not None:
+            values['follow_cnt'] = follow_cnt.get_text(strip=True)
+
+        # crawl price
+        price = soup.select_one('.price-container')
+        if price is not None:
+            total_price_num = price.select_one('.total')
+            total_price_unit = price.select_one('.unit')
+            unit_price = price.select_one('.unitPrice')
+            if total_price_num is not None:
+                values['total_price_num'] = (
+                    total_price_num.get_text(strip=True)
+                )
+            if total_price_unit is not None:
+                values['total_price_unit'] = (
+                    total_price_unit.get_text(strip=True)
+                )
+            if unit_price is not None:
+                values['unit_price'] = unit_price.get_text(strip=True)
+            values['total_price_value'] = coalesce(
+                parse_float(values.get('total_price_num')),
+                total_price_value,
+            )
+            values['unit_price_value'] = coalesce(
+                parse_float(values.get('unit_price')), unit_price_value
+            )
                     
-            # crawl house info
-            house_info = soup.select_one('.houseInfo')
-            if house_info is not None:
-                for info in ['room', 'type', 'area']:
-                    info_tag = house_info.select_one(f'.{info}')
-                    if info_tag is not None:
-                        main_info = info_tag.select_one('.mainInfo')
-                        sub_info = info_tag.select_one('.subInfo')
-                        if main_info is not None:
-                            setattr(
-                                house, 
-                                f'{info}_main_info', 
-                                main_info.get_text(strip=True)
-                            )
-                        if sub_info is not None:
-                            setattr(
-                                house, 
-                                f'{info}_sub_info', 
-                                sub_info.get_text(strip=True)
-                            )
+        # crawl house info
+        house_info = soup.select_one('.houseInfo')
+        if house_info is not None:
+            for info in ['room', 'type', 'area']:
+                info_tag = house_info.select_one(f'.{info}')
+                if info_tag is not None:
+                    main_info = info_tag.select_one('.mainInfo')
+                    sub_info = info_tag.select_one('.subInfo')
+                    if main_info is not None:
+                        values[f'{info}_main_info'] = (
+                            main_info.get_text(strip=True)
+                        )
+                    if sub_info is not None:
+                        values[f'{info}_sub_info'] = (
+                            sub_info.get_text(strip=True)
+                        )
             
-            # submit to database
-            house.is_detail_crawled = True
-            self.db_session.commit()
-            time.sleep(0.1)
+        values['area_value'] = parse_float(values.get('area_main_info'))
+        return values
+
+    def build_tiles(self):
+        if self.should_stop():
+            return
+        tile_count = build_price_tiles(
+            self.db_session, self.city_code, self.ds
+        )
+        self.logger.info(f'{tile_count} price tiles built')
+
+    def build_index(self):
+        if self.should_stop():
+            return
+        row_count = build_price_index(self.db_session, self.city_code, self.ds)
+        self.logger.info(f'{row_count} price index rows built')
+
+    def build_search_index(self):
+        if self.should_stop():
+            return
+        doc_count = index_listings(self.db_session, self.city_code, self.ds)
+        self.logger.info(f'{doc_count} listings indexed for search')
+
+    def build_comparables(self):
+        if self.should_stop():
+            return
+        house_count = build_comparables(
+            self.db_session, self.city_code, self.ds
+        )
+        self.logger.info(f'Comparables tree of {house_count} houses built')
+
+    def apply_retention(self):
+        if self.should_stop():
+            return
+        try:
+            summary = apply_retention(
+                self.db_session, RetentionPolicy.from_env(), self.city_code
+            )
+        except RetentionError as e:
+            self.logger.warning(f'Retention skipped: {e}')
+            return
+        self.logger.info(f'Retention: {summary}')
+        try:
+            # never the full VACUUM of a conversion, which locks the
+            # database for the API and other crawls
+            maintenance = maintain_database(
+                self.db_session.get_bind(), 
+                analyze=summary['deleted_rows'] > 0
+            )
+        except OperationalError as e:
+            # e.g. another connection holds a write lock
+            self.logger.warning(f'Database maintenance skipped: {e}')
+            return
+        self.logger.info(f'Database maintenance: {maintenance}')
+
+    def get_progress(self) -> dict[str, dict[str, int]]:
+        with self.Session() as session:
+            return count_progress(session, self.ds, self.city_code)
+
+    def run(self, stages: Iterable[str] | None = None):
+        stages = set(stages or self.STAGES)
+        if 'community_list' in stages:
+            self.init_community_progress()
+            self.crawl_community_list()
+        if 'community_detail' in stages:
+            self.crawl_community_detail()
+
+        if 'house_list' in stages:
+            self.init_house_progress()
+            self.crawl_house_list()
+        if 'house_detail' in stages:
+            self.crawl_house_detail()
 
-    def run(self):
-        self.init_community_progress()
-        self.crawl_community_list()
-        self.crawl_community_detail()
+        if 'price_tiles' in stages:
+            self.build_tiles()
+        if 'price_index' in stages:
+            self.build_index()
+        if 'search_index' in stages:
+            self.build_search_index()
+        if 'comparables' in stages:
+            self.build_comparables()
+        if 'retention' in stages:
+            self.apply_retention()
 
-        self.init_house_progress()
-        self.crawl_house_list()
-        self.crawl_house_detail()
@@ -0,0 +1,172 @@
+"""Precomputed unit-price heatmap tiles in web-mercator z/x/y.
+
+After the community detail stage, every priced community of a (city, ds)
+is projected once and binned into a `TILE_BINS` x `TILE_BINS` grid per tile
+for every zoom level between `MIN_ZOOM` and `MAX_ZOOM`. Each tile stores
+three arrays, packed with `np.savez_compressed`:
+
+    median  float32  median community unit price of the bin (NaN if empty)
+    count   uint32   listings on sale in the bin
+    change  float32  relative change of the median vs the previous ds
+"""
+import hashlib
+import io
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import delete, func, insert
+from sqlalchemy.orm import Session
+
+from .analytics import parse_number
+from .models import Community, PriceTile
+
+
+MIN_ZOOM = 8
+MAX_ZOOM = 14
+TILE_BINS = 64
+
+
+def mercator(
+    lon: np.ndarray, lat: np.ndarray, zoom: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """Project coordinates to global bin indices at `zoom`."""
+    n = 2 ** zoom * TILE_BINS
+    lat = np.clip(lat, -85.05112878, 85.05112878)
+    x = (lon + 180) / 360 * n
+    y = (1 - np.arcsinh(np.tan(np.radians(lat))) / np.pi) / 2 * n
+    return (
+        np.clip(x.astype(np.int64), 0, n - 1),
+        np.clip(y.astype(np.int64), 0, n - 1),
+    )
+
+
+def group_median(
+    keys: np.ndarray, values: np.ndarray, weights: np.ndarray
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Median of `values` and sum of `weights` for every distinct key."""
+    order = np.lexsort((values, keys))
+    keys, values, weights = keys[order], values[order], weights[order]
+    uniques, starts, counts = np.unique(
+        keys, return_index=True, return_counts=True
+    )
+    median = (
+        values[starts + (counts - 1) // 2] + values[starts + counts // 2]
+    ) / 2
+    totals = np.add.reduceat(weights, starts) if len(starts) else weights
+    return uniques, median, totals
+
+
+def load_prices(
+    session: Session, city_code: str, ds: str
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    rows = (
+        session
+        .query(
+            Community.longitude,
+            Community.latitude,
+            Community.unit_price,
+            Community.count,
+        )
+        .filter(Community.city_code == city_code)
+        .filter(Community.ds == ds)
+        .filter(Community.longitude.is_not(None))
+        .filter(Community.latitude.is_not(None))
+        .all()
+    )
+    df = pd.DataFrame(rows, columns=['lon', 'lat', 'unit_price', 'count'])
+    price = parse_number(df['unit_price']).to_numpy()
+    valid = ~np.isnan(price)
+    return (
+        df['lon'].to_numpy(dtype=np.float64)[valid],
+        df['lat'].to_numpy(dtype=np.float64)[valid],
+        price[valid],
+        df['count'].fillna(0).to_numpy(dtype=np.int64)[valid],
+    )
+
+
+def bin_prices(
+    lon: np.ndarray,
+    lat: np.ndarray,
+    price: np.ndarray,
+    count: np.ndarray,
+    zoom: int
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    x, y = mercator(lon, lat, zoom)
+    keys = y * (2 ** zoom * TILE_BINS) + x
+    return group_median(keys, price, count)
+
+
+def pack_tile(
+    median: np.ndarray, count: np.ndarray, change: np.ndarray
+) -> bytes:
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, median=median, count=count, change=change)
+    return buffer.getvalue()
+
+
+def unpack_tile(data: bytes) -> dict[str, np.ndarray]:
+    with np.load(io.BytesIO(data)) as arrays:
+        return {name: arrays[name] for name in arrays.files}
+
+
+def build_price_tiles(session: Session, city_code: str, ds: str) -> int:
+    """Rebuild all price tiles of (city, ds) and return how many were built."""
+    prev_ds = (
+        session
+        .query(func.max(Community.ds))
+        .filter(Community.city_code == city_code)
+        .filter(Community.ds < ds)
+        .scalar()
+    )
+    current = load_prices(session, city_code, ds)
+    previous = (
+        load_prices(session, city_code, prev_ds) if prev_ds is not None
+        else None
+    )
+    rows = []
+    for zoom in range(MIN_ZOOM, MAX_ZOOM + 1):
+        keys, median, count = bin_prices(*current, zoom)
+        change = np.full(len(keys), np.nan)
+        if previous is not None:
+            prev_keys, prev_median, _ = bin_prices(*previous, zoom)
+            pos = np.searchsorted(prev_keys, keys)
+            pos = np.minimum(pos, max(len(prev_keys) - 1, 0))
+            matched = (
+                (prev_keys[pos] == keys) if len(prev_keys)
+                else np.zeros(len(keys), dtype=bool)
+            )
+            change[matched] = median[matched] / prev_median[pos[matched]] - 1
+
+        n = 2 ** zoom * TILE_BINS
+        gx, gy = keys % n, keys // n
+        tile_keys = (gy // TILE_BINS) * (2 ** zoom) + gx // TILE_BINS
+        order = np.argsort(tile_keys, kind='stable')
+        tiles, starts = np.unique(tile_keys[order], return_index=True)
+        for tile, part in zip(tiles, np.split(order, starts[1:])):
+            bx, by = gx[part] % TILE_BINS, gy[part] % TILE_BINS
+            tile_median = np.full((TILE_BINS, TILE_BINS), np.nan, np.float32)
+            tile_count = np.zeros((TILE_BINS, TILE_BINS), np.uint32)
+            tile_change = np.full((TILE_BINS, TILE_BINS), np.nan, np.float32)
+            tile_median[by, bx] = median[part]
+            tile_count[by, bx] = count[part]
+            tile_change[by, bx] = change[part]
+            data = pack_tile(tile_median, tile_count, tile_change)
+            rows.append({
+                'city_code': city_code,
+                'ds': ds,
+                'z': zoom,
+                'x': int(tile % 2 ** zoom),
+                'y': int(tile // 2 ** zoom),
+                'etag': hashlib.sha1(data).hexdigest()[:16],
+                'data': data,
+            })
+
+    session.execute(
+        delete(PriceTile)
+        .where(PriceTile.city_code == city_code)
+        .where(PriceTile.ds == ds)
+    )
+    if rows:
+        session.execute(insert(PriceTile), rows)
+    session.commit()
+    return len(rows)
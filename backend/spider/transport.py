@@ -0,0 +1,68 @@
+"""Keep-alive HTTP connections for the spider, one pool per host.
+
+A crawl talks to a few hosts only: `map.ke.com` for the list APIs and the
+city host such as `hf.ke.com` for detail pages. Every host gets its own
+`requests.Session`, whose connection pool is sized for the spider's
+concurrency, so consecutive requests reuse open TLS connections instead
+of reconnecting. Sessions never store cookies from responses; the cookie
+of a request always comes from the session pool.
+
+Redirects are followed but counted per host, since each one is a wasted
+round trip that usually means a wrong host or URL.
+"""
+import threading
+from collections import Counter
+from http.cookiejar import DefaultCookiePolicy
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class HostSessions:
+    def __init__(self, pool_size: int = 1) -> None:
+        self.pool_size = pool_size
+        self.sessions: dict[str, requests.Session] = {}
+        self.requests = Counter()
+        self.redirects = Counter()
+        self.lock = threading.Lock()
+
+    def session(self, host: str) -> requests.Session:
+        with self.lock:
+            session = self.sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                session.cookies.set_policy(
+                    DefaultCookiePolicy(allowed_domains=())
+                )
+                adapter = HTTPAdapter(
+                    pool_connections=1, pool_maxsize=self.pool_size
+                )
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                self.sessions[host] = session
+            return session
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        host = urlsplit(url).netloc
+        res = self.session(host).get(url, **kwargs)
+        with self.lock:
+            self.requests[host] += 1
+            self.redirects[host] += len(res.history)
+        return res
+
+    def stats(self) -> dict[str, dict]:
+        with self.lock:
+            return {
+                host: {
+                    'requests': self.requests[host],
+                    'redirects': self.redirects[host],
+                }
+                for host in self.requests
+            }
+
+    def close(self) -> None:
+        with self.lock:
+            for session in self.sessions.values():
+                session.close()
+            self.sessions.clear()
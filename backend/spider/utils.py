@@ -2,7 +2,6 @@ import asyncio
 import base64
 import pathlib
 
-import csv
 import json
 import os
 import time
@@ -13,6 +12,8 @@ import requests
 from bs4 import BeautifulSoup
 from pydoll.browser.tab import Tab 
 
+from .cities import load_adcode_index
+
 
 async def crawl_login_qr_code(tab: Tab) -> str:
     await tab.go_to('https://sh.ke.com/')
@@ -83,14 +84,7 @@ def crawl_city_coordinate(city_code: str):
 
 
 def update_city_list():
-    city_code_resource = 'data/AMap_adcode_citycode.csv'
-    with open(city_code_resource, 'r', encoding='utf-8') as file:
-        csv_reader = csv.reader(file)
-        city_code_mapping = {}
-        for row in list(csv_reader)[1:]:
-            city_name_prefix = row[0][:2]
-            city_code = row[1]
-            city_code_mapping[city_name_prefix] = city_code
+    adcode_index = load_adcode_index()
     res = requests.get(
         'https://www.ke.com/city/', 
         headers={
@@ -111,7 +105,7 @@ def update_city_list():
             city_a_tag = city_li.find("a")
             city_name = city_a_tag.get_text(strip=True)
             city_url = city_a_tag.get("href")
-            city_code = city_code_mapping[city_name[:2]]
+            city_code = adcode_index.lookup(city_name)
             city_coordinate = crawl_city_coordinate(city_code)
             city_data.append({
                 'name': city_name,
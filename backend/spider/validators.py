@@ -0,0 +1,109 @@
+"""Conditional requests for pages that rarely change between ds.
+
+For every parsed page `page_validators` keeps its ETag/Last-Modified and a
+hash of its body, together with the ds whose rows hold the fields parsed
+from it. The next crawl sends these validators; a 304, or a 200 whose
+body hashes the same, means the page is unchanged and the parsed fields
+can be copied forward from that ds instead of parsing the page again.
+The body hash covers servers that ignore the conditional headers.
+
+Validators are loaded as plain `Validator` values rather than ORM rows:
+the detail stage reads them while its BatchWriter commits, and every
+commit would expire the rows and reload each one with its own SELECT.
+
+Only a 200 or a 304 is a page; anything else, such as the 403/429 of a
+ban or a 5xx, is neither compared with nor recorded as a validator.
+"""
+import hashlib
+from dataclasses import dataclass
+
+import requests
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from .models import PageValidator
+from .writer import BatchWriter
+
+
+PAGE_STATUS = (200, 304)
+
+
+@dataclass(frozen=True)
+class Validator:
+    url: str
+    etag: str | None
+    last_modified: str | None
+    body_hash: str
+    ds: str
+
+
+def body_hash(content: bytes) -> str:
+    return hashlib.blake2b(content, digest_size=16).hexdigest()
+
+
+def load_validators(
+    session: Session, urls: list[str]
+) -> dict[str, Validator]:
+    validators = {}
+    # stay below the bound parameter limit of SQLite
+    for i in range(0, len(urls), 500):
+        rows = session.execute(
+            select(
+                PageValidator.url,
+                PageValidator.etag,
+                PageValidator.last_modified,
+                PageValidator.body_hash,
+                PageValidator.ds,
+            )
+            .where(PageValidator.url.in_(urls[i:i + 500]))
+        )
+        validators.update((row.url, Validator(*row)) for row in rows)
+    return validators
+
+
+def conditional_headers(validator: Validator | None) -> dict[str, str]:
+    headers = {}
+    if validator is not None:
+        if validator.etag:
+            headers['if-none-match'] = validator.etag
+        if validator.last_modified:
+            headers['if-modified-since'] = validator.last_modified
+    return headers
+
+
+def is_unchanged(
+    validator: Validator | None, res: requests.Response
+) -> bool:
+    if validator is None:
+        return False
+    return res.status_code == 304 or (
+        res.status_code == 200
+        and body_hash(res.content) == validator.body_hash
+    )
+
+
+def save_validator(
+    writer: BatchWriter,
+    validator: Validator | None,
+    url: str,
+    res: requests.Response,
+    ds: str,
+) -> None:
+    """Record the validators of a response whose fields were stored at
+    `ds`. A 304 only moves the ds forward, a response that is not a page
+    is ignored. The row is queued on `writer`."""
+    if res.status_code not in PAGE_STATUS:
+        return
+    if validator is not None and res.status_code == 304:
+        values = {'ds': ds}
+    else:
+        values = {
+            'etag': res.headers.get('etag'),
+            'last_modified': res.headers.get('last-modified'),
+            'body_hash': body_hash(res.content),
+            'ds': ds,
+        }
+    if validator is None:
+        writer.insert(PageValidator, {'url': url, **values})
+    else:
+        writer.update(PageValidator, {'url': url, **values})
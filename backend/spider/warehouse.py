@@ -0,0 +1,245 @@
+"""DuckDB query layer over the crawl store and its Parquet archive.
+
+The SQLite file is attached read-only through DuckDB's sqlite extension,
+and the partitions moved out by `spider.retention` are read from Parquet.
+Every table of `TABLES` is exposed as one view over both, so a query sees
+all ds whether they are still online or archived. Scans run columnar and
+multithreaded inside DuckDB; on the SQLite side they only take the read
+locks of WAL mode, which never block the spider's writes.
+
+Ad-hoc SQL is limited to one SELECT statement with bound parameters, a
+row limit and a timeout. The connection is locked down after setup:
+external access is off except for the archive directory and the
+configuration can not be changed from a query. `REPORTS` holds the named
+queries of the analysis page.
+
+The sqlite extension is installed into the image at build time and only
+loaded here, never downloaded, so an offline host fails fast. A warehouse
+that can not come up logs an error instead of failing the whole app.
+"""
+import logging
+import pathlib
+import threading
+
+from sqlalchemy.engine import make_url
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+
+logger = logging.getLogger(__name__)
+
+TABLES = (
+    'houses',
+    'communities',
+    'community_attributes',
+    'price_index',
+    'listing_events',
+    'listing_states',
+)
+
+# name -> (description, parameter names, sql)
+REPORTS = {
+    'district_prices': (
+        'Unit price quartiles and listing count by district',
+        ('city_code', 'ds'),
+        '''
+        SELECT
+            district_name,
+            count(*) AS listing_count,
+            quantile_cont(unit_price_value, 0.25) AS p25,
+            quantile_cont(unit_price_value, 0.5) AS median,
+            quantile_cont(unit_price_value, 0.75) AS p75,
+            avg(area_value) AS mean_area
+        FROM houses
+        WHERE city_code = $city_code AND ds = $ds
+            AND unit_price_value IS NOT NULL
+        GROUP BY district_name
+        ORDER BY listing_count DESC
+        ''',
+    ),
+    'price_history': (
+        'Median unit price and listing count of every ds, archive included',
+        ('city_code',),
+        '''
+        SELECT
+            ds,
+            count(*) AS listing_count,
+            median(unit_price_value) AS median_unit_price,
+            median(total_price_value) AS median_total_price
+        FROM houses
+        WHERE city_code = $city_code
+        GROUP BY ds
+        ORDER BY ds
+        ''',
+    ),
+    'listing_turnover': (
+        'New, changed, removed and relisted listings of every ds',
+        ('city_code',),
+        '''
+        SELECT
+            ds,
+            count(*) FILTER (WHERE kind = 'new') AS new,
+            count(*) FILTER (WHERE kind = 'changed') AS changed,
+            count(*) FILTER (WHERE kind = 'removed') AS removed,
+            count(*) FILTER (WHERE kind = 'relisted') AS relisted
+        FROM listing_events
+        WHERE city_code = $city_code
+        GROUP BY ds
+        ORDER BY ds
+        ''',
+    ),
+    'build_year_prices': (
+        'Median unit price by the build decade of the community',
+        ('city_code', 'ds'),
+        '''
+        SELECT
+            CAST(floor(a.value_num / 10) * 10 AS INTEGER) AS build_decade,
+            count(*) AS listing_count,
+            median(h.unit_price_value) AS median_unit_price
+        FROM houses AS h
+        JOIN community_attributes AS a
+            ON a.city_code = h.city_code
+            AND a.ds = h.ds
+            AND a.community_id = h.community_id
+            AND a.key = 'build_year'
+        WHERE h.city_code = $city_code AND h.ds = $ds
+            AND h.unit_price_value IS NOT NULL
+            AND a.value_num IS NOT NULL
+        GROUP BY build_decade
+        ORDER BY build_decade
+        ''',
+    ),
+}
+
+
+class WarehouseError(ValueError):
+    pass
+
+
+class Warehouse:
+    def __init__(
+        self,
+        db_url: str,
+        archive_dir: str = 'data/archive',
+        memory_limit: str = '1GB',
+        max_rows: int = 10000,
+        timeout: float = 30,
+    ) -> None:
+        self.archive_dir = pathlib.Path(archive_dir).resolve()
+        self.max_rows = max_rows
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.attached = False
+        self.archived = frozenset()
+        self.conn = None
+        if duckdb is None:
+            logger.error('duckdb is not installed, the warehouse is off')
+            return
+        self.conn = duckdb.connect(config={
+            'memory_limit': memory_limit,
+            'autoinstall_known_extensions': False,
+        })
+        url = make_url(db_url)
+        if url.get_backend_name() == 'sqlite' and url.database:
+            path = str(pathlib.Path(url.database).resolve())
+            try:
+                self.conn.execute('LOAD sqlite')
+                # ATTACH takes no parameters
+                self.conn.execute(
+                    f"ATTACH '{path.replace(chr(39), chr(39) * 2)}' "
+                    'AS store (TYPE sqlite, READ_ONLY)'
+                )
+                self.attached = True
+            except duckdb.Error as e:
+                logger.error(
+                    'Online tables not attached, only the archive can be '
+                    f'queried: {e}'
+                )
+        self.create_views()
+        self.conn.execute(
+            'SET allowed_directories = ?', [[str(self.archive_dir)]]
+        )
+        self.conn.execute('SET enable_external_access = false')
+        self.conn.execute('SET lock_configuration = true')
+
+    @property
+    def available(self) -> bool:
+        return self.conn is not None
+
+    def archived_tables(self) -> frozenset[str]:
+        return frozenset(
+            table for table in TABLES
+            if next((self.archive_dir / table).glob('*/*/*.parquet'), None)
+        )
+
+    def create_views(self) -> None:
+        """(Re)create the views, once more tables got archived."""
+        archived = self.archived_tables()
+        for table in TABLES:
+            sources = []
+            if self.attached:
+                sources.append(f'SELECT * FROM store.{table}')
+            if table in archived:
+                pattern = (self.archive_dir / table / '*/*/*.parquet')
+                sources.append(
+                    f"SELECT * FROM read_parquet('{pattern.as_posix()}', "
+                    'hive_partitioning = true, union_by_name = true, '
+                    "hive_types = {'city_code': 'VARCHAR', 'ds': 'VARCHAR'})"
+                )
+            if not sources:
+                continue
+            self.conn.execute(
+                f'CREATE OR REPLACE VIEW {table} AS '
+                + ' UNION ALL BY NAME '.join(sources)
+            )
+        self.archived = archived
+
+    def query(self, sql: str, params: dict | None = None) -> dict:
+        """Run one SELECT statement, returning at most `max_rows` rows."""
+        if not self.available:
+            raise WarehouseError('duckdb is not installed')
+        with self.lock:
+            if self.archived_tables() != self.archived:
+                self.create_views()
+            # a connection is not thread safe, every query gets a cursor
+            cursor = self.conn.cursor()
+        timer = threading.Timer(self.timeout, cursor.interrupt)
+        timer.start()
+        try:
+            statements = cursor.extract_statements(sql)
+            if (
+                len(statements) != 1
+                or statements[0].type != duckdb.StatementType.SELECT
+            ):
+                raise WarehouseError(
+                    'only a single SELECT statement is allowed'
+                )
+            cursor.execute(sql, params or {})
+            columns = [column[0] for column in cursor.description]
+            rows = cursor.fetchmany(self.max_rows + 1)
+        except duckdb.InterruptException as e:
+            raise WarehouseError(
+                f'query cancelled after {self.timeout} seconds'
+            ) from e
+        except duckdb.Error as e:
+            raise WarehouseError(str(e)) from e
+        finally:
+            timer.cancel()
+            cursor.close()
+        return {
+            'columns': columns,
+            'rows': rows[:self.max_rows],
+            'truncated': len(rows) > self.max_rows,
+        }
+
+    def report(self, name: str, params: dict[str, str]) -> dict:
+        if name not in REPORTS:
+            raise WarehouseError(f'unknown report: {name}')
+        _, names, sql = REPORTS[name]
+        missing = [p for p in names if p not in params]
+        if missing:
+            raise WarehouseError(f'missing parameters: {", ".join(missing)}')
+        return self.query(sql, {p: params[p] for p in names})
@@ -0,0 +1,215 @@
+"""Write-behind batching of crawl results with group commit.
+
+Stages hand their parsed rows to a `BatchWriter` instead of committing
+every item: new rows with `insert` (or `append` for rows with an
+autoincrement key), changed columns of existing rows with `update`, rows
+to replace with `delete` and progress flags with `mark`. Every
+`max_items` items, or once the oldest pending item is `max_delay` seconds
+old, all of it is written as one executemany statement per table and
+column set and committed in a single transaction, i.e. one fsync for the
+whole group.
+
+Every write of a stage goes through the writer, so the database is only
+locked while a group is flushed, never while the stage waits for a
+response or a pause. A stage about to block past the deadline of its
+group flushes first, see `time_left`.
+
+Progress flags are written after the data in that same transaction, so a
+crash can lose at most the last group, data and flags together, and the
+lost items are simply crawled again; a flag is never committed without
+its data.
+
+Used as a context manager around a stage, the writer flushes when the
+stage ends or stops and rolls the group back if the stage raised.
+"""
+import time
+from collections import defaultdict
+
+from sqlalchemy import bindparam, delete, insert, update
+from sqlalchemy.orm import Session
+
+
+class BatchWriter:
+    def __init__(
+        self, session: Session, max_items: int = 200, max_delay: float = 2.0
+    ) -> None:
+        self.session = session
+        self.max_items = max_items
+        self.max_delay = max_delay
+        # model -> {primary key: row}, so a row handed over twice before a
+        # flush is written once
+        self.deletes = defaultdict(dict)
+        self.inserts = defaultdict(dict)
+        self.appends = defaultdict(list)
+        self.updates = defaultdict(dict)
+        self.marks = defaultdict(dict)
+        self.pending_items = 0
+        self.oldest = None
+        self.commit_count = 0
+        self.item_count = 0
+        self.row_count = 0
+        self.flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+
+    def __enter__(self) -> 'BatchWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        if exc_type is None:
+            self.flush()
+        else:
+            self.rollback()
+
+    @staticmethod
+    def key(model, row: dict) -> tuple:
+        return tuple(row[c.key] for c in model.__table__.primary_key)
+
+    def insert(self, model, row: dict) -> None:
+        """Queue a new row; a second row with the same key is ignored."""
+        self.inserts[model].setdefault(self.key(model, row), row)
+
+    def append(self, model, row: dict) -> None:
+        """Queue a new row without its primary key, which the database
+        assigns."""
+        self.appends[model].append(row)
+
+    def delete(self, model, criteria: dict) -> None:
+        """Queue a delete of the rows matching all `criteria`, applied
+        before the inserts, so that rows can be replaced."""
+        self.deletes[model][tuple(sorted(criteria.items()))] = criteria
+
+    def is_pending(self, model, row: dict) -> bool:
+        """Whether the row with the primary key in `row` is queued."""
+        key = self.key(model, row)
+        return (
+            key in self.inserts.get(model, ())
+            or key in self.updates.get(model, ())
+        )
+
+    def update(self, model, row: dict) -> None:
+        """Queue new values for the row with the primary key in `row`."""
+        self.updates[model].setdefault(self.key(model, row), {}).update(row)
+
+    def mark(self, model, row: dict) -> None:
+        """Queue a progress flag update, applied after all data rows."""
+        self.marks[model].setdefault(self.key(model, row), {}).update(row)
+
+    def time_left(self) -> float | None:
+        """Seconds until the pending group is due, None if there is none."""
+        if self.oldest is None:
+            return None
+        return max(self.oldest + self.max_delay - time.monotonic(), 0.0)
+
+    def done(self) -> None:
+        """Count one finished item and flush if the group is full or old."""
+        now = time.monotonic()
+        self.pending_items += 1
+        if self.oldest is None:
+            self.oldest = now
+        if (
+            self.pending_items >= self.max_items
+            or now - self.oldest >= self.max_delay
+        ):
+            self.flush()
+
+    @staticmethod
+    def by_columns(rows: dict) -> dict[frozenset, list[dict]]:
+        """Split rows by their column set, one executemany each."""
+        groups = defaultdict(list)
+        for row in rows.values():
+            groups[frozenset(row)].append(row)
+        return groups
+
+    def execute_deletes(self, buffer: dict) -> int:
+        total = 0
+        for model, rows in buffer.items():
+            table = model.__table__
+            for columns, group in self.by_columns(rows).items():
+                self.session.execute(
+                    delete(table).where(*[
+                        table.c[c] == bindparam(f'where_{c}') for c in columns
+                    ]),
+                    [{f'where_{c}': row[c] for c in columns} for row in group]
+                )
+            total += len(rows)
+        return total
+
+    def execute_inserts(self, buffer: dict) -> int:
+        total = 0
+        for model, rows in buffer.items():
+            if isinstance(rows, list):
+                rows = dict(enumerate(rows))
+            for group in self.by_columns(rows).values():
+                self.session.execute(insert(model.__table__), group)
+            total += len(rows)
+        return total
+
+    def execute_updates(self, buffer: dict) -> int:
+        total = 0
+        for model, rows in buffer.items():
+            table = model.__table__
+            keys = [c.key for c in table.primary_key]
+            where = [table.c[key] == bindparam(f'pk_{key}') for key in keys]
+            for columns, group in self.by_columns(rows).items():
+                values = [c for c in columns if c not in keys]
+                # the SET clause follows the column keys of the parameters
+                self.session.execute(
+                    update(table).where(*where),
+                    [
+                        {
+                            **{f'pk_{key}': row[key] for key in keys},
+                            **{c: row[c] for c in values},
+                        }
+                        for row in group
+                    ]
+                )
+            total += len(rows)
+        return total
+
+    def flush(self) -> None:
+        """Write everything queued and commit it as one transaction."""
+        start = time.monotonic()
+        rows = self.execute_deletes(self.deletes)
+        rows += self.execute_inserts(self.inserts)
+        rows += self.execute_inserts(self.appends)
+        rows += self.execute_updates(self.updates)
+        # progress last, so it is never ahead of the data it stands for
+        rows += self.execute_updates(self.marks)
+        self.session.commit()
+        if self.pending_items or rows:
+            elapsed = time.monotonic() - start
+            self.commit_count += 1
+            self.item_count += self.pending_items
+            self.row_count += rows
+            self.flush_seconds += elapsed
+            self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+        self.reset()
+
+    def rollback(self) -> None:
+        self.session.rollback()
+        self.reset()
+
+    def reset(self) -> None:
+        self.deletes.clear()
+        self.inserts.clear()
+        self.appends.clear()
+        self.updates.clear()
+        self.marks.clear()
+        self.pending_items = 0
+        self.oldest = None
+
+    def stats(self) -> dict:
+        return {
+            'commits': self.commit_count,
+            'items': self.item_count,
+            'rows': self.row_count,
+            'items_per_commit': (
+                round(self.item_count / self.commit_count, 1)
+                if self.commit_count else None
+            ),
+            'flush_ms_mean': (
+                round(self.flush_seconds / self.commit_count * 1e3, 2)
+                if self.commit_count else None
+            ),
+            'flush_ms_max': round(self.max_flush_seconds * 1e3, 2),
+        }
@@ -0,0 +1,60 @@
+import pathlib
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from spider.database import init_database
+
+
+BACKEND_DIR = pathlib.Path(__file__).resolve().parent.parent
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f'sqlite:///{tmp_path / "test.db"}')
+    init_database(engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def Session(engine):
+    return sessionmaker(bind=engine)
+
+
+@pytest.fixture
+def session(Session):
+    with Session() as session:
+        yield session
+
+
+@pytest.fixture
+def backend_dir(monkeypatch, tmp_path):
+    """Run from the backend directory against a fresh database file."""
+    monkeypatch.chdir(BACKEND_DIR)
+    monkeypatch.setenv('DATABASE_URL', f'sqlite:///{tmp_path / "cli.db"}')
+    return BACKEND_DIR
+
+
+@pytest.fixture
+def spider(Session, monkeypatch, tmp_path):
+    from spider.models import City
+    from spider.spider import BeikeMapSpider
+
+    with Session() as session:
+        session.add(City(
+            name='上海',
+            code='310000',
+            url='https://sh.ke.com',
+            min_lat=31.0,
+            max_lat=31.1,
+            min_lon=121.0,
+            max_lon=121.1,
+        ))
+        session.commit()
+    # the run log is written to log/ under the working directory
+    monkeypatch.chdir(tmp_path)
+    spider = BeikeMapSpider('310000', Session, concurrency=2)
+    yield spider
+    spider.http.close()
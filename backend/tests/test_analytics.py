@@ -0,0 +1,73 @@
+import pandas as pd
+
+from spider.analytics import AnalyticsEngine, group_stats
+from spider.models import House
+
+
+def house(id, ds, district, unit_price, total_price='500万'):
+    return House(
+        id=id, ds=ds, community_id=1, city_code='310000',
+        district_name=district, unitPriceStr=unit_price,
+        priceStr=total_price
+    )
+
+
+def test_group_stats_of_no_rows():
+    df = pd.DataFrame({'district_name': [], 'unit_price': []})
+    assert group_stats(df, 'district_name') == {
+        'district_name': [], 'p25': [], 'median': [], 'p75': [],
+        'count': [],
+    }
+
+
+def test_dashboard_of_unknown_ds_is_empty(Session):
+    dashboard = AnalyticsEngine(Session).dashboard('310000', '20990101')
+    assert dashboard['summary']['listing_count'] == 0
+    assert dashboard['districts']['district_name'] == []
+    assert dashboard['day_over_day'] is None
+
+
+def test_dashboard(Session):
+    with Session() as session:
+        session.add_all([
+            house(1, '20240101', '浦东', '50,000元/平'),
+            house(1, '20240102', '浦东', '50,000元/平', '450万'),
+            house(2, '20240102', '浦东', '60,000元/平'),
+            house(3, '20240102', '徐汇', '80,000元/平'),
+        ])
+        session.commit()
+    dashboard = AnalyticsEngine(Session).dashboard('310000', '20240102')
+    assert dashboard['summary']['listing_count'] == 3
+    assert dashboard['districts'] == {
+        'district_name': ['浦东', '徐汇'],
+        'p25': [52500.0, 80000.0],
+        'median': [55000.0, 80000.0],
+        'p75': [57500.0, 80000.0],
+        'count': [2, 1],
+    }
+    day_over_day = dashboard['day_over_day']
+    assert day_over_day['new_count'] == 2
+    assert day_over_day['price_down_count'] == 1
+
+
+def test_dashboard_follows_writes_to_a_past_ds(Session):
+    analytics = AnalyticsEngine(Session)
+
+    def listing_count():
+        dashboard = analytics.dashboard('310000', '20240101')
+        return dashboard['summary']['listing_count']
+
+    with Session() as session:
+        session.add(house(1, '20240101', '浦东', '50,000元/平'))
+        session.commit()
+    assert listing_count() == 1
+    # a crawl that started on 20240101 is still writing after midnight
+    with Session() as session:
+        session.add(house(2, '20240101', '浦东', '60,000元/平'))
+        session.commit()
+    assert listing_count() == 2
+    # and retention deleted a partition
+    with Session() as session:
+        session.query(House).filter(House.id == 2).delete()
+        session.commit()
+    assert listing_count() == 1
@@ -0,0 +1,38 @@
+import json
+
+from sqlalchemy import func, select
+
+from spider.attributes import backfill_attributes, explode_info
+from spider.models import Community, CommunityAttribute
+
+
+def test_explode_info():
+    rows = explode_info(1, '20240101', '310000', {
+        '建筑年代': '2005年',
+        '物业费用': '2至4元/平米/月',
+        '绿化率': '30%',
+    })
+    assert [(row['key'], row['value_num']) for row in rows] == [
+        ('build_year', 2005.0), ('property_fee', 3.0), ('绿化率', None),
+    ]
+
+
+def test_backfill_walks_past_communities_without_labels(session):
+    infos = ['{}', json.dumps({'建筑年代': '2005年'}), '{}', None]
+    session.add_all([
+        Community(id=id, ds=ds, city_code='310000', info=info)
+        for ds in ('20240101', '20240102')
+        for id, info in enumerate(infos)
+    ])
+    session.commit()
+    assert backfill_attributes(session, batch_size=2) == 6
+    assert session.scalars(
+        select(CommunityAttribute.ds)
+        .where(CommunityAttribute.community_id == 1)
+        .order_by(CommunityAttribute.ds)
+    ).all() == ['20240101', '20240102']
+    # communities that got rows are not exploded again
+    assert backfill_attributes(session) == 4
+    assert session.scalar(
+        select(func.count()).select_from(CommunityAttribute)
+    ) == 2
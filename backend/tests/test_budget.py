@@ -0,0 +1,47 @@
+import time
+
+from spider.priority import CrawlBudget
+
+
+class FakeResponse:
+    status_code = 200
+
+
+def test_budget_is_spent_when_requests_are_submitted(monkeypatch, spider):
+    sent = []
+
+    def get(url, key=None, headers=None):
+        sent.append(url)
+        return FakeResponse()
+
+    monkeypatch.setattr(spider, 'get', get)
+    spider.budget = CrawlBudget(max_requests=5)
+    responses = list(
+        spider.fetch_all([f'u{i}' for i in range(50)], budgeted=True)
+    )
+    assert len(responses) == 5
+    assert len(sent) == 5
+    assert spider.budget.requests == 5
+    assert spider.budget.cut_off
+
+
+def test_budget_spent_exactly_does_not_cut_off(monkeypatch, spider):
+    monkeypatch.setattr(spider, 'get', lambda *args: FakeResponse())
+    spider.budget = CrawlBudget(max_requests=3)
+    assert len(list(spider.fetch_all(['a', 'b', 'c'], budgeted=True))) == 3
+    assert spider.budget.exhausted()
+    assert not spider.budget.cut_off
+
+
+def test_unbudgeted_fetch_ignores_budget(monkeypatch, spider):
+    monkeypatch.setattr(spider, 'get', lambda *args: FakeResponse())
+    spider.budget = CrawlBudget(max_requests=1)
+    assert len(list(spider.fetch_all(['a', 'b', 'c']))) == 3
+    assert spider.budget.requests == 0
+
+
+def test_time_budget():
+    budget = CrawlBudget(max_minutes=0)
+    time.sleep(0.01)
+    assert budget.exhausted()
+    assert not CrawlBudget().exhausted()
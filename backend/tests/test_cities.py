@@ -0,0 +1,58 @@
+from spider.cities import AdcodeIndex, CityRegistry, load_city_registry
+from spider.models import City
+
+
+def city(name, code, url=''):
+    return {
+        'name': name, 'code': code, 'url': url,
+        'min_lat': 0.0, 'max_lat': 1.0, 'min_lon': 0.0, 'max_lon': 1.0,
+    }
+
+
+CITIES = [city('上海', '310000'), city('三亚', '460200'), city('三河', '131082')]
+
+
+def test_registry_lookups():
+    registry = CityRegistry(CITIES)
+    assert registry.get('310000')['name'] == '上海'
+    assert registry.get('三亚')['code'] == '460200'
+    assert registry.get('北京') is None
+    assert [c['name'] for c in registry.search('三')] == ['三亚', '三河']
+    assert registry.search('北') == []
+    assert registry.name_to_code['上海'] == '310000'
+
+
+def test_registry_version_follows_content():
+    version = CityRegistry(CITIES).version
+    assert CityRegistry(list(reversed(CITIES))).version != version
+    assert CityRegistry([dict(c) for c in CITIES]).version == version
+    assert CityRegistry(CITIES[:2]).version != version
+
+
+def test_upsert_inserts_then_updates(session):
+    CityRegistry(CITIES).upsert(session)
+    CityRegistry([city('上海', '310000', 'https://sh.ke.com')]) \
+        .upsert(session)
+    assert session.query(City).count() == 3
+    assert session.get(City, '上海').url == 'https://sh.ke.com'
+
+
+def test_adcode_lookup():
+    index = AdcodeIndex([
+        ('黔南布依族苗族自治州', '522700'),
+        ('黔南州某县', '522701'),
+        ('上海市', '310000'),
+        ('三亚', '460200'),
+        ('三亚市', '460201'),
+    ])
+    assert index.lookup('三亚') == '460200'
+    assert index.lookup('上海') == '310000'
+    assert index.lookup('黔南') == '522700'
+    assert index.lookup('北京') is None
+    assert index.by_adcode['460201'] == '三亚市'
+
+
+def test_bundled_city_list(backend_dir):
+    registry = load_city_registry()
+    assert registry.get('上海')['code'] == registry.name_to_code['上海']
+    assert len(registry.by_code) == len(registry.cities)
@@ -0,0 +1,98 @@
+import json
+
+import pytest
+
+import city_list
+from city_list import build_city_list, fetch_district, polyline_bounds
+from spider.cities import AdcodeIndex
+
+
+POLYLINE = '121.0,31.2;121.5,30.9|120.8,31.4'
+
+
+def district(polyline: str = POLYLINE) -> dict:
+    return {'status': '1', 'districts': [{'polyline': polyline}]}
+
+
+class FakeResponse:
+    def __init__(self, content: dict) -> None:
+        self.content = content
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.content
+
+
+@pytest.fixture
+def amap(monkeypatch, tmp_path):
+    """Answer AMap requests offline, recording the adcodes requested."""
+    requested = []
+
+    def get(url, headers=None, params=None):
+        requested.append(params['keywords'])
+        if params['keywords'] == '000000':
+            return FakeResponse({'status': '1', 'districts': []})
+        return FakeResponse(district())
+
+    monkeypatch.setattr(city_list, 'AMAP_CACHE_DIR', tmp_path / 'amap')
+    monkeypatch.setattr(city_list.requests, 'get', get)
+    return requested
+
+
+def test_polyline_bounds():
+    # the first coordinate is stored as *_lat, like the shipped list
+    assert polyline_bounds(POLYLINE) == {
+        'min_lat': 120.8, 'max_lat': 121.5, 'min_lon': 30.9, 'max_lon': 31.4,
+    }
+
+
+def test_fetch_district_caches_on_disk(amap, tmp_path):
+    assert fetch_district('310000') == district()
+    assert json.loads((tmp_path / 'amap/310000.json').read_text()) \
+        == district()
+    assert fetch_district('310000') == district()
+    assert amap == ['310000']
+    fetch_district('310000', refresh=True)
+    assert amap == ['310000', '310000']
+
+
+def test_fetch_district_does_not_cache_unknown_adcodes(amap, tmp_path):
+    with pytest.raises(ValueError):
+        fetch_district('000000')
+    assert not (tmp_path / 'amap/000000.json').exists()
+
+
+def test_build_city_list_reuses_unchanged_cities(amap, monkeypatch):
+    monkeypatch.setattr(city_list, 'load_adcode_index', lambda: AdcodeIndex([
+        ('上海市', '310000'), ('北京市', '110000'), ('苏州市', '320500'),
+    ]))
+    old = {
+        'name': '上海', 'url': 'https://sh.ke.com', 'code': '310000',
+        'min_lat': 1.0, 'max_lat': 2.0, 'min_lon': 3.0, 'max_lon': 4.0,
+    }
+    moved = {
+        **old, 'name': '苏州', 'url': 'https://su.ke.com', 'code': '320500'
+    }
+    ke_cities = [
+        ('上海', 'https://sh.ke.com'),
+        ('北京', 'https://bj.ke.com'),
+        ('无名', 'https://wm.ke.com'),
+        # the url changed, so the source hash does too
+        ('苏州', 'https://suzhou.ke.com'),
+    ]
+    cities = build_city_list(ke_cities, [old, moved], max_workers=2)
+    assert [c['name'] for c in cities] == ['上海', '北京', '苏州']
+    assert cities[0] is old
+    assert cities[1] == {
+        'name': '北京', 'url': 'https://bj.ke.com', 'code': '110000',
+        **polyline_bounds(POLYLINE),
+    }
+    assert cities[2]['url'] == 'https://suzhou.ke.com'
+    assert sorted(amap) == ['110000', '320500']
+
+    # a refresh rebuilds every city, from the network again
+    cities = build_city_list(ke_cities, cities, refresh=True)
+    assert cities[0] is not old
+    assert sorted(amap) == ['110000', '110000', '310000', '320500', '320500']
@@ -0,0 +1,51 @@
+import argparse
+import json
+
+import pytest
+
+from spider.__main__ import (
+    EXIT_USAGE, STAGE_GROUPS, main, parse_stages, positive_int
+)
+
+
+def test_parse_stages_expands_groups_in_order():
+    assert parse_stages('detail,community') == [
+        'community_detail', 'house_detail', 'community_list'
+    ]
+
+
+def test_parse_stages_accepts_single_stages():
+    assert parse_stages(' house_list , price_index') == [
+        'house_list', 'price_index'
+    ]
+    assert parse_stages('all') == list(STAGE_GROUPS['all'])
+
+
+def test_parse_stages_rejects_unknown_stage():
+    with pytest.raises(argparse.ArgumentTypeError):
+        parse_stages('list,bogus')
+
+
+def test_positive_int():
+    assert positive_int('3') == 3
+    with pytest.raises(argparse.ArgumentTypeError):
+        positive_int('0')
+
+
+def test_invalid_arguments_exit_with_usage_code():
+    with pytest.raises(SystemExit) as exc:
+        main(['crawl', '--city', '310000', '--stages', 'bogus'])
+    assert exc.value.code == EXIT_USAGE
+
+
+def test_budget_requests_must_be_positive():
+    with pytest.raises(SystemExit) as exc:
+        main(['crawl', '--city', '310000', '--budget-requests', '0'])
+    assert exc.value.code == EXIT_USAGE
+
+
+def test_unknown_city_exits_with_usage_code(backend_dir, capsys):
+    assert main(['crawl', '--city', 'nowhere']) == EXIT_USAGE
+    summary = json.loads(capsys.readouterr().out)
+    assert summary['status'] == 'invalid'
+    assert summary['city_code'] == 'nowhere'
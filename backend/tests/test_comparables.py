@@ -0,0 +1,84 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import delete
+
+from spider import comparables
+from spider.cache import DsCache
+from spider.comparables import ComparablesIndex, build_comparables
+from spider.models import Community, House
+
+TODAY = datetime.today().strftime(r'%Y%m%d')
+
+
+def test_cache_ttl_and_version():
+    cache = DsCache(ttl=0)
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return len(calls)
+
+    # plain entries expire whatever their ds, versioned ones only when
+    # the version changes
+    assert [cache.get(('a',), compute) for _ in range(2)] == [1, 2]
+    assert [
+        cache.get(('b',), compute, version=version)
+        for version in (1, 1, 2, 2)
+    ] == [3, 3, 4, 4]
+
+
+@pytest.fixture
+def index(Session):
+    with Session() as session:
+        session.add(Community(
+            id=1, ds=TODAY, city_code='310000',
+            longitude=121.0, latitude=31.0
+        ))
+        session.add_all([
+            House(
+                id=id, ds=TODAY, community_id=1, city_code='310000',
+                unit_price_value=price, area_value=area
+            )
+            for id, price, area in [
+                (1, 50000, 90), (2, 51000, 88), (3, 80000, 40),
+                (4, 49000, 92),
+            ]
+        ])
+        session.commit()
+        assert build_comparables(session, '310000', TODAY) == 4
+    return ComparablesIndex(Session)
+
+
+def test_comparables(index):
+    result = index.comparables('310000', TODAY, 1, k=2)
+    assert result['house']['id'] == 1
+    assert [row['id'] for row in result['comparables']] == [2, 4]
+    assert index.comparables('310000', TODAY, 99) is None
+
+
+def test_unbuilt_ds_has_no_comparables(index):
+    assert index.latest_ds('310000') == TODAY
+    assert index.latest_ds('110000') is None
+    assert index.matrix('310000', '20200101') is None
+    assert index.comparables('310000', '20200101', 1) is None
+
+
+def test_index_only_swaps_in_built_trees(index, Session, monkeypatch):
+    builds = []
+    read_features = comparables.read_features
+    monkeypatch.setattr(
+        comparables, 'read_features',
+        lambda *args: builds.append(1) or read_features(*args)
+    )
+    matrix = index.matrix('310000', TODAY)
+    assert index.matrix('310000', TODAY) is matrix
+    with Session() as session:
+        session.execute(delete(House).where(House.id == 3))
+        session.commit()
+        # the API keeps serving the stored tree until the next build
+        assert index.matrix('310000', TODAY) is matrix
+        build_comparables(session, '310000', TODAY)
+    assert len(builds) == 1
+    assert len(index.matrix('310000', TODAY)) == 3
+    assert len(builds) == 1
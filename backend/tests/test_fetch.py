@@ -0,0 +1,54 @@
+import threading
+import time
+
+
+class FakeResponse:
+    status_code = 200
+
+    def __init__(self, url: str) -> None:
+        self.url = url
+
+
+def record_gets(monkeypatch, spider) -> list[str]:
+    sent = []
+
+    def get(url, key=None, headers=None):
+        sent.append(url)
+        return FakeResponse(url)
+
+    monkeypatch.setattr(spider, 'get', get)
+    return sent
+
+
+def test_fetch_all_keeps_order(monkeypatch, spider):
+    record_gets(monkeypatch, spider)
+    urls = [f'u{i}' for i in range(7)]
+    assert [res.url for res in spider.fetch_all(urls)] == urls
+
+
+def test_fetch_all_submits_at_most_concurrency_ahead(monkeypatch, spider):
+    sent = record_gets(monkeypatch, spider)
+    responses = spider.fetch_all([f'u{i}' for i in range(50)])
+    for _ in range(3):
+        next(responses)
+    time.sleep(0.3)
+    assert len(sent) <= 3 + spider.concurrency
+    responses.close()
+
+
+def test_paused_fetch_sends_nothing_and_stop_ends_it(monkeypatch, spider):
+    sent = record_gets(monkeypatch, spider)
+    spider.pause()
+    received = []
+    consumer = threading.Thread(
+        target=lambda: received.extend(
+            spider.fetch_all([f'u{i}' for i in range(10)])
+        )
+    )
+    consumer.start()
+    time.sleep(0.3)
+    assert sent == []
+    spider.stop()
+    consumer.join(timeout=5)
+    assert not consumer.is_alive()
+    assert sent == [] and received == []
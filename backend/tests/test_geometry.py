@@ -0,0 +1,71 @@
+import numpy as np
+from sqlalchemy import func, select
+
+from spider.geometry import (
+    BorderStore, border_hash, compact_borders, contains, decode_border,
+    encode_border
+)
+from spider.models import Border, Community
+from spider.writer import BatchWriter
+
+
+SQUARE = '121.0,31.0;121.1,31.0;121.1,31.1;121.0,31.1'
+HOLE = '121.04,31.04;121.06,31.04;121.06,31.06;121.04,31.06'
+
+
+def test_round_trip():
+    text = f'{SQUARE}|{HOLE}|'
+    data = encode_border(text)
+    # header of ring count and point counts, then 4 bytes per coordinate
+    assert len(data) == 4 * 3 + 4 * 2 * 8
+    rings = decode_border(data)
+    assert [ring.shape for ring in rings] == [(4, 2), (4, 2)]
+    np.testing.assert_allclose(rings[0][2], [121.1, 31.1])
+    np.testing.assert_allclose(rings[1][0], [121.04, 31.04])
+
+
+def test_round_trip_keeps_microdegrees():
+    rings = decode_border(encode_border('-0.000001,89.999999;180,-90'))
+    np.testing.assert_array_equal(
+        rings[0], [[-0.000001, 89.999999], [180.0, -90.0]]
+    )
+
+
+def test_contains_with_hole():
+    rings = decode_border(encode_border(f'{SQUARE}|{HOLE}'))
+    assert contains(rings, 121.02, 31.02)
+    assert not contains(rings, 121.05, 31.05)
+    assert not contains(rings, 121.2, 31.05)
+
+
+def test_store_deduplicates(session):
+    store = BorderStore(session)
+    assert store.put(None) is None
+    key = store.put(SQUARE)
+    assert key == border_hash(SQUARE) == BorderStore(session).put(SQUARE)
+    assert session.scalar(select(func.count()).select_from(Border)) == 1
+    np.testing.assert_allclose(store.get(key)[0][1], [121.1, 31.0])
+    assert store.get('missing') is None
+
+
+def test_store_queues_on_the_writer(session):
+    writer = BatchWriter(session)
+    store = BorderStore(session, writer)
+    key = store.put(SQUARE)
+    assert store.put(SQUARE) == key
+    assert session.scalar(select(func.count()).select_from(Border)) == 0
+    writer.flush()
+    assert store.get(key) is not None
+
+
+def test_compact_borders(session):
+    session.add_all([
+        Community(id=id, ds='20240101', city_code='310000', border=SQUARE)
+        for id in (1, 2)
+    ])
+    session.commit()
+    assert compact_borders(session, batch_size=1) == 2
+    communities = session.query(Community).all()
+    assert {c.border for c in communities} == {None}
+    assert {c.border_hash for c in communities} == {border_hash(SQUARE)}
+    assert session.scalar(select(func.count()).select_from(Border)) == 1
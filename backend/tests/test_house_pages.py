@@ -0,0 +1,142 @@
+import pytest
+from sqlalchemy import select
+
+from spider.models import Community, House, HouseProgress
+
+
+PAGE_SIZE = 2
+
+
+class HouseSite:
+    """House list pages of one community with `pages` full pages."""
+
+    def __init__(self, pages: int) -> None:
+        self.pages = pages
+        self.requested = []
+
+    def get(self, url, key=None, headers=None):
+        page = int(url.split('curPage=')[1].split('&')[0])
+        self.requested.append(page)
+        return ListResponse(page, self.pages)
+
+
+class ListResponse:
+    status_code = 200
+
+    def __init__(self, page: int, pages: int) -> None:
+        self.page = page
+        self.pages = pages
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        houses = range(PAGE_SIZE) if self.page <= self.pages else ()
+        return {'data': {
+            'hasMore': self.page < self.pages,
+            'list': [{
+                'actionUrl': f'https://sh.ke.com/ershoufang/{house}.html',
+                'priceStr': '500万',
+                'unitPriceStr': '5万',
+                'title': 't',
+                'tags': [],
+            } for house in (self.page * 10 + i for i in houses)],
+        }}
+
+
+@pytest.fixture
+def site(monkeypatch, spider):
+    def serve(pages: int) -> HouseSite:
+        site = HouseSite(pages)
+        monkeypatch.setattr(spider, 'get', site.get)
+        return site
+    return serve
+
+
+def pages(spider, first_page=1, listing_count=None) -> list[int]:
+    return [
+        page for page, _ in
+        spider.fetch_house_pages('1', first_page, listing_count)
+    ]
+
+
+def test_listing_count_fetches_exactly_the_pages(site, spider):
+    served = site(3)
+    assert pages(spider, listing_count=3 * PAGE_SIZE) == [1, 2, 3]
+    assert sorted(served.requested) == [1, 2, 3]
+
+
+def test_single_page_stops_at_has_more(site, spider):
+    served = site(1)
+    assert pages(spider, listing_count=50) == [1]
+    assert served.requested == [1]
+
+
+def test_pages_past_has_more_are_discarded(site, spider):
+    # a stale count asks for 10 pages of a community with 3 left
+    served = site(3)
+    assert pages(spider, listing_count=10 * PAGE_SIZE) == [1, 2, 3]
+    # the window is only ever `concurrency` requests ahead of the pages
+    # consumed, so little is fetched in vain
+    assert max(served.requested) <= 3 + spider.concurrency
+
+
+def test_speculative_pages_without_count(site, spider):
+    served = site(5)
+    assert pages(spider) == [1, 2, 3, 4, 5]
+    assert max(served.requested) <= 5 + spider.concurrency
+
+
+def test_low_count_continues_speculatively(site, spider):
+    site(4)
+    assert pages(spider, listing_count=PAGE_SIZE) == [1, 2, 3, 4]
+
+
+def test_pages_resume_after_the_first_page(site, spider):
+    served = site(4)
+    assert pages(spider, first_page=3, listing_count=4 * PAGE_SIZE) \
+        == [3, 4]
+    assert sorted(served.requested) == [3, 4]
+
+
+def test_house_list_resumes_after_interruption(
+    site, spider, Session, monkeypatch
+):
+    served = site(4)
+    with Session() as session:
+        session.add(Community(
+            id=1, ds=spider.ds, city_code='310000', count=4 * PAGE_SIZE
+        ))
+        session.commit()
+    save_house_page = spider.save_house_page
+
+    def save_and_stop(community_id, house_list):
+        save_house_page(community_id, house_list)
+        if house_list[0]['actionUrl'].endswith('/20.html'):
+            spider.stop()
+
+    monkeypatch.setattr(spider, 'save_house_page', save_and_stop)
+    with spider:
+        spider.init_house_progress()
+        spider.crawl_house_list()
+    with Session() as session:
+        # responses already in flight when the run stopped are still
+        # saved, and the progress says so
+        progress = session.scalars(select(HouseProgress)).one()
+        finished_page = progress.finished_page
+        assert progress.has_more and 2 <= finished_page < 4
+        assert len(session.scalars(select(House.id)).all()) \
+            == finished_page * PAGE_SIZE
+
+    monkeypatch.setattr(spider, 'save_house_page', save_house_page)
+    spider.interrupted = False
+    served.requested.clear()
+    with spider:
+        spider.init_house_progress()
+        spider.crawl_house_list()
+    assert sorted(served.requested) == list(range(finished_page + 1, 5))
+    with Session() as session:
+        progress = session.scalars(select(HouseProgress)).one()
+        assert (progress.finished_page, progress.has_more) == (4, False)
+        assert session.scalars(select(House.id).order_by(House.id)).all() \
+            == [10, 11, 20, 21, 30, 31, 40, 41]
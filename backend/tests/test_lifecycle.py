@@ -0,0 +1,148 @@
+from sqlalchemy import select
+
+from spider.lifecycle import (
+    detect_removed, house_list_complete, list_events, track_listings
+)
+from spider.models import (
+    Community, CommunityProgress, HouseProgress, ListingEvent, ListingState
+)
+from spider.writer import BatchWriter
+
+
+def house(price='500万', title='t') -> dict:
+    return {
+        'priceStr': price, 'unitPriceStr': '5万', 'tags': '', 'title': title
+    }
+
+
+def track(session, ds, houses) -> None:
+    with BatchWriter(session) as writer:
+        track_listings(writer, '310000', ds, 1, houses)
+
+
+def kinds(session, ds) -> dict[int, str]:
+    return {
+        event['house_id']: event['kind']
+        for event in list_events(session, '310000', ds)
+    }
+
+
+def test_listing_lifecycle(session):
+    track(session, '20240101', {1: house(), 2: house(), 3: house()})
+    assert kinds(session, '20240101') == {1: 'new', 2: 'new', 3: 'new'}
+
+    track(session, '20240102', {1: house(), 2: house('450万')})
+    assert detect_removed(session, '310000', '20240102') == 1
+    assert kinds(session, '20240102') == {2: 'changed', 3: 'removed'}
+    changed = list_events(session, '310000', '20240102', kind='changed')[0]
+    assert (changed['price_before'], changed['price_after']) \
+        == ('500万', '450万')
+
+    track(session, '20240103', {1: house(), 2: house('450万'), 3: house()})
+    assert detect_removed(session, '310000', '20240103') == 0
+    assert kinds(session, '20240103') == {3: 'relisted'}
+    states = session.scalars(select(ListingState)).all()
+    assert {(s.house_id, s.first_ds, s.last_ds, s.is_active) for s in states} \
+        == {
+            (1, '20240101', '20240103', True),
+            (2, '20240101', '20240103', True),
+            (3, '20240101', '20240103', True),
+        }
+
+
+def test_listing_seen_twice_in_one_ds_is_tracked_once(session):
+    track(session, '20240101', {1: house()})
+    track(session, '20240101', {1: house()})
+    assert session.query(ListingEvent).count() == 1
+
+
+def add_progress(session, tiles, communities) -> None:
+    """`tiles` are the is_finished flags of the community list progress,
+    `communities` map ids to the has_more flag of their house list, or to
+    None when they have no house list progress yet."""
+    ds = '20240102'
+    session.add_all([
+        CommunityProgress(ds=ds, city_code='310000', is_finished=finished)
+        for finished in tiles
+    ])
+    for community_id, has_more in communities.items():
+        session.add(Community(id=community_id, ds=ds, city_code='310000'))
+        if has_more is not None:
+            session.add(HouseProgress(
+                ds=ds, city_code='310000', community_id=str(community_id),
+                has_more=has_more
+            ))
+    session.commit()
+
+
+def test_house_list_complete(session):
+    assert not house_list_complete(session, '310000', '20240102')
+    add_progress(session, [True, True], {1: False, 2: False})
+    assert house_list_complete(session, '310000', '20240102')
+
+
+def test_house_list_with_pages_left_is_incomplete(session):
+    add_progress(session, [True], {1: False, 2: True})
+    assert not house_list_complete(session, '310000', '20240102')
+
+
+def test_house_list_over_a_partial_community_list_is_incomplete(session):
+    add_progress(session, [True, False], {1: False})
+    assert not house_list_complete(session, '310000', '20240102')
+
+
+def test_communities_without_house_progress_are_incomplete(session):
+    add_progress(session, [True], {1: False, 2: None})
+    assert not house_list_complete(session, '310000', '20240102')
+
+
+def test_partial_community_list_reports_no_removals(
+    monkeypatch, spider, Session
+):
+    class ListResponse:
+        status_code = 200
+
+        def raise_for_status(self):
+            pass
+
+        def json(self):
+            return {'data': {'hasMore': False, 'list': [{
+                **house(), 'tags': [],
+                'actionUrl': 'https://sh.ke.com/ershoufang/10.html',
+            }]}}
+
+    monkeypatch.setattr(
+        spider, 'get', lambda url, key=None, headers=None: ListResponse()
+    )
+    with Session() as session:
+        # listing 20 of community 2 was seen yesterday, and community 2 is
+        # in a tile the interrupted community list has not reached today
+        session.add(ListingState(
+            city_code='310000', house_id=20, community_id=2,
+            fingerprint='f', first_ds='20000101', last_ds='20000101',
+            is_active=True
+        ))
+        session.add_all([
+            CommunityProgress(ds=spider.ds, city_code='310000', is_finished=f)
+            for f in (True, False)
+        ])
+        session.add(Community(id=1, ds=spider.ds, city_code='310000'))
+        session.commit()
+    with spider:
+        spider.init_house_progress()
+        spider.crawl_house_list()
+    with Session() as session:
+        assert kinds(session, spider.ds) == {10: 'new'}
+        assert session.get(ListingState, ('310000', 20)).is_active
+    with Session() as session:
+        # the community list resumes and finds community 2, whose house
+        # list no longer has listing 20
+        session.query(CommunityProgress).update({'is_finished': True})
+        session.add(Community(id=2, ds=spider.ds, city_code='310000'))
+        session.commit()
+    with spider:
+        spider.init_house_progress()
+        spider.crawl_house_list()
+    with Session() as session:
+        assert session.query(HouseProgress).count() == 2
+        assert kinds(session, spider.ds) == {10: 'new', 20: 'removed'}
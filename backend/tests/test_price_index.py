@@ -0,0 +1,74 @@
+from spider.models import House
+from spider.price_index import build_price_index, price_trend
+
+
+def add_houses(session, ds, houses):
+    session.add_all([
+        House(
+            id=id, ds=ds, community_id=1, city_code='310000',
+            district_name=district, block_name=f'{district}一',
+            unitPriceStr=f'{price}元/平'
+        )
+        for id, (district, price) in houses.items()
+    ])
+    session.commit()
+
+
+def build(session):
+    add_houses(session, '20240101', {
+        1: ('浦东', 50000), 2: ('浦东', 60000), 3: ('徐汇', 80000),
+    })
+    add_houses(session, '20240102', {
+        1: ('浦东', 52000), 4: ('浦东', 70000),
+        3: ('徐汇', 80000), 5: ('徐汇', 90000),
+    })
+    return [
+        build_price_index(session, '310000', ds)
+        for ds in ('20240101', '20240102')
+    ]
+
+
+def test_first_ds_has_no_turnover(session):
+    build(session)
+    trend = price_trend(session, '310000', end_ds='20240101')
+    assert trend['median'] == [60000.0]
+    assert trend['listing_count'] == [3]
+    assert trend['new_count'] == [None]
+    assert trend['removed_count'] == [None]
+
+
+def test_city_index(session):
+    # one city row, two districts and two blocks per ds
+    assert build(session) == [5, 5]
+    trend = price_trend(session, '310000')
+    assert trend['ds'] == ['20240101', '20240102']
+    assert trend['median'] == [60000.0, 75000.0]
+    assert trend['p25'][1] == 65500.0
+    assert trend['p75'][1] == 82500.0
+    assert trend['listing_count'] == [3, 4]
+    # 4 and 5 are new, 2 is gone
+    assert trend['new_count'][1] == 2
+    assert trend['removed_count'][1] == 1
+
+
+def test_district_index(session):
+    build(session)
+    pudong = price_trend(session, '310000', 'district', '浦东')
+    assert pudong['median'] == [55000.0, 61000.0]
+    assert (pudong['new_count'][1], pudong['removed_count'][1]) == (1, 1)
+    xuhui = price_trend(session, '310000', 'district', '徐汇')
+    assert xuhui['median'] == [80000.0, 85000.0]
+    assert (xuhui['new_count'][1], xuhui['removed_count'][1]) == (1, 0)
+    block = price_trend(session, '310000', 'block', '徐汇一')
+    assert block['median'] == xuhui['median']
+
+
+def test_rebuild_replaces_rows(session):
+    build(session)
+    assert build_price_index(session, '310000', '20240102') == 5
+    assert len(price_trend(session, '310000')['ds']) == 2
+    assert build_price_index(session, '310000', '20240103') == 0
+    assert price_trend(session, '310000', 'district', '静安') == {
+        'ds': [], 'p25': [], 'median': [], 'p75': [], 'listing_count': [],
+        'new_count': [], 'removed_count': [],
+    }
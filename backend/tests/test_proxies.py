@@ -0,0 +1,139 @@
+import threading
+import time
+
+import pytest
+import requests
+
+from spider.proxies import ProxyPool, parse_proxies
+
+
+A, B = 'http://10.0.0.1:3128', 'http://10.0.0.2:3128'
+
+
+class FakeResponse:
+    def __init__(self, status_code=200):
+        self.status_code = status_code
+
+    def close(self):
+        pass
+
+
+def test_parse_proxies():
+    assert parse_proxies(f' {A}, ,{B},') == [A, B]
+    assert parse_proxies(None) == []
+
+
+def test_empty_pool_goes_direct():
+    assert ProxyPool([]).acquire('key') is None
+
+
+def test_keys_stick_to_their_proxy():
+    pool = ProxyPool([A, B], min_interval=0)
+    proxy = pool.acquire('community')
+    pool.release(proxy, 200, 0.1)
+    for _ in range(3):
+        again = pool.acquire('community')
+        assert again is proxy
+        pool.release(again, 200, 0.1)
+
+
+def test_exclude_moves_the_key_to_another_proxy():
+    pool = ProxyPool([A, B], min_interval=0)
+    first = pool.acquire('community')
+    pool.release(first, None, 5.0)
+    second = pool.acquire('community', exclude=[first.url])
+    assert second is not first
+    pool.release(second, 200, 0.1)
+    assert pool.acquire('community') is second
+
+
+def test_exclude_falls_back_to_all_proxies():
+    pool = ProxyPool([A], min_interval=0)
+    assert pool.acquire(exclude=[A]).url == A
+
+
+def test_ban_evicts_at_once_and_failures_after_max():
+    pool = ProxyPool([A, B], min_interval=0, max_failures=2)
+    proxy_a = next(p for p in pool.proxies if p.url == A)
+    proxy_b = next(p for p in pool.proxies if p.url == B)
+    proxy_a.in_flight += 1
+    pool.release(proxy_a, 429, 0.1)
+    assert pool.stats()[0]['evicted']
+    for _ in range(2):
+        proxy_b.in_flight += 1
+        pool.release(proxy_b, None, 0.1)
+    assert pool.stats()[1]['evicted']
+
+
+def test_get_retries_failed_requests_on_another_proxy(monkeypatch, spider):
+    spider.proxy_pool = ProxyPool([A, B], min_interval=0)
+    used = []
+
+    def get(url, proxies=None, **kwargs):
+        used.append(proxies['http'])
+        if proxies['http'] == A:
+            raise requests.exceptions.ProxyError('dead proxy')
+        return FakeResponse()
+
+    monkeypatch.setattr(spider.http, 'get', get)
+    for i in range(4):
+        assert spider.get(f'https://sh.ke.com/{i}', key='k').status_code == 200
+    assert used.count(A) <= 1
+    assert used[-1] == B
+
+
+def test_get_raises_after_retries(monkeypatch, spider):
+    spider.proxy_pool = ProxyPool([A, B], min_interval=0)
+    calls = []
+
+    def get(url, proxies=None, **kwargs):
+        calls.append(proxies['http'])
+        raise requests.exceptions.ConnectTimeout('slow proxy')
+
+    monkeypatch.setattr(spider.http, 'get', get)
+    with pytest.raises(requests.RequestException):
+        spider.get('https://sh.ke.com/x')
+    assert len(calls) == spider.retries + 1
+    assert set(calls[:2]) == {A, B}
+
+
+def test_banned_proxy_is_retried_on_another(monkeypatch, spider):
+    spider.proxy_pool = ProxyPool([A, B], min_interval=0)
+    used = []
+
+    def get(url, proxies=None, **kwargs):
+        used.append(proxies['http'])
+        return FakeResponse(429 if proxies['http'] == A else 200)
+
+    monkeypatch.setattr(spider.http, 'get', get)
+    for i in range(3):
+        assert spider.get(f'https://sh.ke.com/{i}', key='k').status_code == 200
+    assert used.count(A) == 1
+    assert spider.proxy_pool.stats()[0]['ban_count'] == 1
+
+
+def test_last_ban_response_is_returned(monkeypatch, spider):
+    spider.proxy_pool = ProxyPool([A, B], min_interval=0, backoff=0)
+    monkeypatch.setattr(
+        spider.http, 'get', lambda url, **kwargs: FakeResponse(403)
+    )
+    assert spider.get('https://sh.ke.com/x').status_code == 403
+
+
+def test_acquire_lets_go_once_stopped():
+    pool = ProxyPool([A], max_concurrency=1)
+    pool.acquire()
+    stopped = threading.Event()
+    threading.Timer(0.1, stopped.set).start()
+    start = time.monotonic()
+    # the only proxy is taken, so this would wait for a release forever
+    assert pool.acquire(stopped=stopped.is_set) is None
+    assert time.monotonic() - start < 1
+
+
+def test_stop_while_waiting_for_a_proxy_sends_nothing(monkeypatch, spider):
+    spider.proxy_pool = ProxyPool([A], backoff=3600)
+    spider.proxy_pool.evict(spider.proxy_pool.proxies[0])
+    monkeypatch.setattr(spider.http, 'get', pytest.fail)
+    threading.Timer(0.1, spider.stop).start()
+    assert spider.get('https://sh.ke.com/x') is None
@@ -0,0 +1,99 @@
+import base64
+
+import pytest
+from sqlalchemy import select
+
+from spider.models import House
+from spider.query import (
+    QueryError, backfill_numeric_columns, build_query, decode_cursor,
+    encode_cursor, fetch_page
+)
+
+
+def b64(content: str) -> str:
+    return base64.urlsafe_b64encode(content.encode()).decode()
+
+
+def test_cursor_round_trip():
+    assert decode_cursor(
+        encode_cursor('total_price', 'desc', 512.5, 7), 'total_price', 'desc'
+    ) == (512.5, 7)
+    assert decode_cursor(
+        encode_cursor('id', 'asc', None, 7), 'id', 'asc'
+    ) == (None, 7)
+
+
+@pytest.mark.parametrize('cursor', [
+    'not base64!', 'NQ==', b64('[1, 2, 3]'), b64('{"a": 1}'),
+    b64('["id", "asc", [1], 2]'), b64('["id", "asc", 1, "2"]'),
+    b64('[1, 2, 3, 4]'), b64('["id", "asc", 1, 2, 3]'), b64('null'),
+    'w6k=',
+])
+def test_invalid_cursors(cursor):
+    with pytest.raises(QueryError):
+        decode_cursor(cursor, 'id', 'asc')
+
+
+@pytest.mark.parametrize('sort, order', [
+    ('unit_price', 'desc'), ('total_price', 'asc'),
+])
+def test_cursor_of_another_sort_or_order(sort, order):
+    cursor = encode_cursor('total_price', 'desc', 300, 3)
+    with pytest.raises(QueryError):
+        decode_cursor(cursor, sort, order)
+    with pytest.raises(QueryError):
+        build_query(
+            House, '310000', '20240101', sort=sort, order=order,
+            cursor=cursor
+        )
+
+
+def test_pages_continue_after_the_cursor(session):
+    session.add_all([
+        House(
+            id=id, ds='20240101', community_id=1, city_code='310000',
+            total_price_value=price
+        )
+        for id, price in [(1, 300), (2, 100), (3, 300), (4, None), (5, 200)]
+    ])
+    session.commit()
+    ids, cursor = [], None
+    while True:
+        stmt, sort_column = build_query(
+            House, '310000', '20240101', sort='total_price', order='desc',
+            cursor=cursor
+        )
+        page = fetch_page(
+            session, stmt, sort_column, 2, sort='total_price', order='desc'
+        )
+        ids += [item['id'] for item in page['items']]
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+    # rows without a price can not be ordered and are left out
+    assert ids == [3, 1, 5, 2]
+
+
+def test_unknown_sort():
+    with pytest.raises(QueryError):
+        build_query(House, '310000', '20240101', sort='name')
+
+
+def test_backfill_keeps_a_parsed_zero(session):
+    session.add_all([
+        House(
+            id=1, ds='20240101', community_id=1, city_code='310000',
+            total_price_num='0', priceStr='350万', unit_price='0元/平',
+            unitPriceStr='38000元/平'
+        ),
+        House(
+            id=2, ds='20240101', community_id=1, city_code='310000',
+            priceStr='350万', unitPriceStr='38,000元/平'
+        ),
+    ])
+    session.commit()
+    assert backfill_numeric_columns(session) == 2
+    assert session.execute(
+        select(House.id, House.total_price_value, House.unit_price_value)
+        .order_by(House.id)
+    ).all() == [(1, 0.0, 0.0), (2, 350.0, 38000.0)]
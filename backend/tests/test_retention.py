@@ -0,0 +1,102 @@
+from datetime import date
+
+import pyarrow.parquet as pq
+from sqlalchemy import create_engine, func, select, text
+
+from spider.__main__ import STAGE_GROUPS, parse_stages
+from spider.models import (
+    Community, CommunityProgress, ComparablesTree, House
+)
+from spider.retention import (
+    RetentionPolicy, apply_retention, cutoff_ds, maintain_database,
+    partition_path, read_archive
+)
+from spider.spider import BeikeMapSpider
+
+
+TODAY = date(2026, 3, 31)
+
+
+def add_partition(session, ds: str) -> None:
+    session.add(CommunityProgress(ds=ds, city_code='310000'))
+    session.add(Community(id=1, ds=ds, city_code='310000', name='Garden'))
+    session.add(House(id=7, ds=ds, community_id=1, city_code='310000'))
+    session.add(
+        ComparablesTree(ds=ds, city_code='310000', etag=ds, data=b'')
+    )
+    session.commit()
+
+
+def count(session, model) -> int:
+    return session.scalar(select(func.count()).select_from(model))
+
+
+def test_cutoff_ds():
+    assert cutoff_ds(1, TODAY) == '20260331'
+    assert cutoff_ds(30, TODAY) == '20260302'
+
+
+def test_retention_is_not_a_default_stage():
+    assert 'retention' not in BeikeMapSpider.STAGES
+    assert 'retention' not in STAGE_GROUPS['all']
+    assert parse_stages('all,retention')[-1] == 'retention'
+
+
+def test_apply_retention_without_archive(session):
+    for ds in ('20260101', '20260330', '20260331'):
+        add_partition(session, ds)
+    policy = RetentionPolicy(progress_days=1, online_days=2, archive=False)
+    summary = apply_retention(session, policy, today=TODAY)
+    assert summary['progress_rows'] == 2
+    assert summary['partitions'] == 1
+    assert summary['archived_rows'] == 0
+    assert count(session, CommunityProgress) == 1
+    assert session.scalars(select(Community.ds).order_by(Community.ds)).all() \
+        == ['20260330', '20260331']
+    assert session.scalars(
+        select(ComparablesTree.ds).order_by(ComparablesTree.ds)
+    ).all() == ['20260330', '20260331']
+
+
+def test_apply_retention_archives_before_deleting(session, tmp_path):
+    add_partition(session, '20260101')
+    add_partition(session, '20260331')
+    policy = RetentionPolicy(online_days=2, archive_dir=str(tmp_path))
+    summary = apply_retention(session, policy, today=TODAY)
+    assert summary['archived_rows'] == summary['deleted_rows'] == 2
+    assert count(session, House) == 1
+    archived = read_archive(str(tmp_path), 'houses', '310000', '20260101')
+    assert archived[['id', 'community_id', 'ds']].values.tolist() == [
+        [7, 1, '20260101']
+    ]
+    assert read_archive(str(tmp_path), 'houses', '310000', '20260331') \
+        is None
+
+
+def test_archive_is_parquet_by_default(session, tmp_path):
+    assert RetentionPolicy().archive
+    add_partition(session, '20260101')
+    policy = RetentionPolicy(online_days=2, archive_dir=str(tmp_path))
+    apply_retention(session, policy, today=TODAY)
+    for table, model in [('houses', House), ('communities', Community)]:
+        path = partition_path(str(tmp_path), table, '310000', '20260101')
+        assert path.read_bytes()[:4] == b'PAR1'
+        written = pq.read_table(path)
+        assert written.num_rows == 1
+        assert set(written.column_names) >= {
+            column.name for column in model.__table__.columns
+        } - {'city_code', 'ds'}
+
+
+def test_maintain_database_converts_only_when_asked(tmp_path):
+    engine = create_engine(f'sqlite:///{tmp_path / "old.db"}')
+    with engine.begin() as conn:
+        conn.execute(text('CREATE TABLE t (x)'))
+    assert maintain_database(engine)['mode'] == 'not_incremental'
+    assert maintain_database(engine, convert=True)['mode'] == 'vacuum'
+    assert maintain_database(engine)['mode'] == 'incremental_vacuum'
+
+
+def test_new_databases_start_incremental(engine):
+    with engine.connect() as conn:
+        assert conn.execute(text('PRAGMA auto_vacuum')).scalar() == 2
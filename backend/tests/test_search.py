@@ -0,0 +1,54 @@
+from spider.models import Community
+from spider.search import index_listings, match_query, search, segment
+
+
+def test_segment():
+    assert list(segment('浦东 Garden 3室')) == [
+        '浦东', '东', 'garden', '3', '室',
+    ]
+    assert list(segment('世纪公园')) == ['世纪', '纪公', '公园', '园']
+    assert list(segment(None)) == []
+
+
+def test_match_query():
+    assert match_query('世纪公园 A') == '"世纪 纪公 公园" AND "a"*'
+    assert match_query('园') == '"园"*'
+    assert match_query('!?') is None
+
+
+def add_communities(session, names, city_code='310000'):
+    session.add_all([
+        Community(id=id, ds='20240101', city_code=city_code, name=name)
+        for id, name in names.items()
+    ])
+    session.commit()
+    index_listings(session, city_code, '20240101')
+
+
+def test_search_matches_bigrams_and_prefixes(session):
+    add_communities(session, {1: '世纪公园', 2: '公园里', 3: '世纪苑'})
+    def names(keyword):
+        hits = search(session, 'community', keyword)
+        return {hit['name'] for hit in hits}
+
+    assert names('世纪公园') == {'世纪公园'}
+    assert names('公园') == {'世纪公园', '公园里'}
+    assert names('苑') == {'世纪苑'}
+    assert names('湖') == set()
+
+
+def test_search_ranks_every_match(session):
+    # the best match is the oldest of many, beyond any window of newest ids
+    names = {1: '公园 公园 公园'}
+    names.update({id: f'公园里{id}号' for id in range(2, 3000)})
+    add_communities(session, names)
+    hits = search(session, 'community', '公园', limit=3)
+    assert hits[0]['id'] == 1
+    assert [hit['rank'] for hit in hits] == sorted(hit['rank'] for hit in hits)
+
+
+def test_search_by_city(session):
+    add_communities(session, {1: '世纪公园'})
+    add_communities(session, {2: '世纪公园'}, city_code='110000')
+    hits = search(session, 'community', '公园', city_code='110000')
+    assert [hit['id'] for hit in hits] == [2]
@@ -0,0 +1,109 @@
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from spider.models import CrawlSession
+from spider.sessions import SessionPool
+
+
+@pytest.fixture
+def add_sessions(Session):
+    def add_sessions(*cookies, **values):
+        with Session() as session:
+            session.add_all([
+                CrawlSession(
+                    cookie=cookie, created_at=datetime.now(), **values
+                )
+                for cookie in cookies
+            ])
+            session.commit()
+    return add_sessions
+
+
+def test_empty_pool(Session):
+    pool = SessionPool(Session)
+    assert len(pool) == 0
+    assert pool.acquire() is None
+
+
+def test_least_used_first(Session, add_sessions):
+    add_sessions('a', 'b')
+    pool = SessionPool(Session, min_interval=0)
+    cookies = [pool.acquire().cookie for _ in range(4)]
+    assert sorted(cookies) == ['a', 'a', 'b', 'b']
+    assert cookies[0] != cookies[1]
+
+
+def test_failures_cool_down_and_disable(Session, add_sessions):
+    add_sessions('a')
+    pool = SessionPool(
+        Session, min_interval=0, cooldown=0.05, max_failures=2
+    )
+    pooled = pool.acquire()
+    pool.release(pooled, 429)
+    assert pooled.cooldown_until > 0
+    # the only session is cooling down, so acquire waits for it
+    assert pool.acquire() is pooled
+    pool.release(pooled, 200)
+    assert pooled.consecutive_failures == 0
+    pool.release(pool.acquire(), None)
+    pool.release(pool.acquire(), 403)
+    assert pooled.is_disabled
+    assert pool.acquire() is None
+    assert pooled.failure_count == 3
+
+
+def test_proxy_failures_do_not_blame_the_session(Session, add_sessions):
+    add_sessions('a')
+    pool = SessionPool(Session, min_interval=0)
+    pooled = pool.acquire()
+    pool.release(pooled, None, blame=False)
+    assert pooled.failure_count == 0
+    assert pooled.cooldown_until == 0
+
+
+def test_counters_are_flushed_and_reloaded(Session, add_sessions):
+    add_sessions('a')
+    pool = SessionPool(Session, min_interval=0, flush_every=2)
+    pool.release(pool.acquire(), 200)
+    pool.release(pool.acquire(), 401)
+    with Session() as session:
+        row = session.query(CrawlSession).one()
+        assert (row.request_count, row.failure_count) == (2, 1)
+        assert row.cooldown_until > datetime.now()
+    reloaded = SessionPool(Session).sessions[0]
+    assert reloaded.consecutive_failures == 1
+    assert reloaded.cooldown_until > 0
+
+
+def test_disabled_sessions_are_not_loaded(Session, add_sessions):
+    add_sessions('a', is_disabled=True)
+    add_sessions(
+        'b', cooldown_until=datetime.now() - timedelta(minutes=1)
+    )
+    pool = SessionPool(Session)
+    assert [s.cookie for s in pool.sessions] == ['b']
+    assert pool.sessions[0].cooldown_until == 0
+
+
+def test_acquire_lets_go_once_stopped(Session, add_sessions):
+    add_sessions('a', cooldown_until=datetime.now() + timedelta(hours=1))
+    pool = SessionPool(Session)
+    stopped = threading.Event()
+    threading.Timer(0.1, stopped.set).start()
+    start = time.monotonic()
+    assert pool.acquire(stopped.is_set) is None
+    assert time.monotonic() - start < 1
+
+
+def test_spider_session_interval(monkeypatch, spider, Session):
+    assert spider.session_pool.min_interval == 1.0
+    monkeypatch.setenv('SPIDER_SESSION_INTERVAL', '0.25')
+    other = type(spider)(spider.city_code, Session)
+    assert other.session_pool.min_interval == 0.25
+    pool = SessionPool(Session, min_interval=0)
+    assert type(spider)(
+        spider.city_code, Session, session_pool=pool
+    ).session_pool is pool
@@ -0,0 +1,125 @@
+import numpy as np
+import pytest
+
+from spider.geometry import BorderStore
+from spider.models import Community
+from spider.spatial import CELL_SIZE, CommunityGrid, SpatialIndex
+
+
+def make_grid(lon: np.ndarray, lat: np.ndarray) -> CommunityGrid:
+    n = len(lon)
+    return CommunityGrid(
+        ids=np.arange(n, dtype=np.int64),
+        city_codes=np.full(n, '310000', dtype=object),
+        names=np.array([f'c{i}' for i in range(n)], dtype=object),
+        lon=lon,
+        lat=lat,
+        counts=np.ones(n, dtype=np.int64),
+        prices=np.full(n, None, dtype=object),
+        border_hashes=np.full(n, None, dtype=object),
+    )
+
+
+@pytest.fixture(scope='module')
+def points():
+    rng = np.random.default_rng(7)
+    lon = rng.uniform(121.0, 121.6, 3000)
+    lat = rng.uniform(30.9, 31.4, 3000)
+    # points exactly on cell edges and on the bbox edges below
+    lon[:3] = [121.0, 121.2, 121.25]
+    lat[:3] = [31.0, 31.1, 31.15]
+    return lon, lat
+
+
+def brute_force(lon, lat, min_lon, min_lat, max_lon, max_lat) -> set[int]:
+    inside = (
+        (lon >= min_lon) & (lon <= max_lon)
+        & (lat >= min_lat) & (lat <= max_lat)
+    )
+    return set(np.flatnonzero(inside).tolist())
+
+
+@pytest.mark.parametrize('bbox', [
+    # cell aligned
+    (121.0, 31.0, 121.2, 31.1),
+    # crossing cell edges on every side
+    (121.013, 30.987, 121.377, 31.222),
+    # inside a single cell
+    (121.21, 31.11, 121.24, 31.14),
+    # a bbox edge on the points placed on cell edges
+    (121.25, 31.15, 121.3, 31.2),
+    # larger than the data
+    (120.0, 30.0, 122.0, 32.0),
+    # the whole world
+    (-180.0, -90.0, 180.0, 90.0),
+])
+def test_query_matches_brute_force(points, bbox):
+    lon, lat = points
+    grid = make_grid(lon, lat)
+    positions = grid.query(*bbox)
+    assert set(grid.ids[positions].tolist()) == brute_force(lon, lat, *bbox)
+    assert len(set(positions.tolist())) == len(positions)
+
+
+@pytest.mark.parametrize('bbox', [
+    # min above max
+    (121.3, 31.2, 121.1, 31.0),
+    # no points in it
+    (0.0, 0.0, 1.0, 1.0),
+    # zero area between points
+    (121.3 + CELL_SIZE / 7, 31.1, 121.3 + CELL_SIZE / 7, 31.1),
+])
+def test_empty_bbox(points, bbox):
+    assert len(make_grid(*points).query(*bbox)) == 0
+
+
+def test_empty_grid():
+    grid = make_grid(np.array([]), np.array([]))
+    assert len(grid.query(121.0, 31.0, 122.0, 32.0)) == 0
+
+
+def test_points_are_paged_by_id(points):
+    grid = make_grid(*points)
+    bbox = (121.1, 31.0, 121.3, 31.2)
+    expected = sorted(brute_force(*points, *bbox))
+    ids, cursor = [], None
+    while True:
+        page = grid.points(grid.query(*bbox), 100, cursor)
+        ids += [item['id'] for item in page['items']]
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+    assert ids == expected
+
+
+def test_index_search_and_locate(Session):
+    border = '121.0,31.0;121.01,31.0;121.01,31.01;121.0,31.01'
+    with Session() as session:
+        key = BorderStore(session).put(border)
+        session.add_all([
+            Community(
+                id=1, ds='20240101', city_code='310000', name='Garden',
+                longitude=121.005, latitude=31.005, count=3,
+                border_hash=key
+            ),
+            Community(
+                id=2, ds='20240101', city_code='310000', name='Court',
+                longitude=121.3, latitude=31.3
+            ),
+            # no coordinates, so not in the grid
+            Community(id=3, ds='20240101', city_code='310000'),
+            Community(
+                id=4, ds='20240102', city_code='310000',
+                longitude=121.005, latitude=31.005
+            ),
+        ])
+        session.commit()
+    index = SpatialIndex(Session)
+    assert index.latest_ds() == '20240102'
+    result = index.search('20240101', (121.0, 31.0, 121.5, 31.5))
+    assert result['total'] == 2
+    assert [item['name'] for item in result['items']] == ['Garden', 'Court']
+    clusters = index.search('20240101', (121.0, 31.0, 121.5, 31.5), zoom=8)
+    assert sum(item['count'] for item in clusters['items']) == 3
+    assert index.locate('20240101', 121.004, 31.006) == 1
+    assert index.locate('20240101', 121.2, 31.2) is None
@@ -0,0 +1,107 @@
+import math
+
+import numpy as np
+import pytest
+
+from spider.cache import DsCache
+from spider.models import Community, PriceTile
+from spider.tiles import (
+    MAX_ZOOM, MIN_ZOOM, TILE_BINS, build_price_tiles, group_median, mercator,
+    pack_tile, unpack_tile
+)
+
+
+def slippy_tile(lon: float, lat: float, zoom: int) -> tuple[int, int]:
+    """The tile of a point by the usual web-mercator tile formula."""
+    n = 2 ** zoom
+    lat = math.radians(lat)
+    return (
+        int((lon + 180) / 360 * n),
+        int((1 - math.asinh(math.tan(lat)) / math.pi) / 2 * n),
+    )
+
+
+@pytest.mark.parametrize('lon, lat', [
+    (121.4737, 31.2304), (116.4074, 39.9042), (-74.006, 40.7128),
+])
+def test_mercator_bins_fall_in_their_tile(lon, lat):
+    for zoom in (MIN_ZOOM, MAX_ZOOM):
+        x, y = mercator(np.array([lon]), np.array([lat]), zoom)
+        assert (x[0] // TILE_BINS, y[0] // TILE_BINS) \
+            == slippy_tile(lon, lat, zoom)
+
+
+def test_mercator_edges():
+    n = 2 ** 8 * TILE_BINS
+    x, y = mercator(np.array([-180, 0, 180]), np.array([89.9, 0, -89.9]), 8)
+    assert x.tolist() == [0, n // 2, n - 1]
+    assert y.tolist() == [0, n // 2, n - 1]
+
+
+def test_group_median():
+    keys, median, totals = group_median(
+        np.array([2, 1, 2, 1, 2, 3]),
+        np.array([30.0, 10.0, 10.0, 20.0, 20.0, 5.0]),
+        np.array([1, 2, 3, 4, 5, 6]),
+    )
+    assert keys.tolist() == [1, 2, 3]
+    assert median.tolist() == [15.0, 20.0, 5.0]
+    assert totals.tolist() == [6, 9, 6]
+
+
+def test_group_median_of_nothing():
+    keys, median, totals = group_median(
+        np.array([], np.int64), np.array([]), np.array([], np.int64)
+    )
+    assert len(keys) == len(median) == len(totals) == 0
+
+
+def test_pack_round_trip():
+    median = np.full((TILE_BINS, TILE_BINS), np.nan, np.float32)
+    median[3, 4] = 65432.5
+    count = np.zeros((TILE_BINS, TILE_BINS), np.uint32)
+    count[3, 4] = 7
+    tile = unpack_tile(pack_tile(median, count, median / 2))
+    np.testing.assert_array_equal(tile['median'], median)
+    np.testing.assert_array_equal(tile['count'], count)
+    assert tile['change'].dtype == np.float32
+    assert tile['change'][3, 4] == np.float32(65432.5 / 2)
+
+
+def add_communities(session, ds, prices):
+    session.add_all([
+        Community(
+            id=id, ds=ds, city_code='310000', longitude=121.4737,
+            latitude=31.2304, unit_price=price, count=2
+        )
+        for id, price in enumerate(prices)
+    ])
+    session.commit()
+
+
+def test_build_price_tiles(session):
+    add_communities(session, '20240101', ['50,000元/平', '70,000元/平'])
+    add_communities(
+        session, '20240102', ['60,000元/平', '80,000元/平', None]
+    )
+    built = build_price_tiles(session, '310000', '20240102')
+    # every community is in one bin, so one tile per zoom
+    assert built == MAX_ZOOM - MIN_ZOOM + 1
+    tile_x, tile_y = slippy_tile(121.4737, 31.2304, 10)
+    row = session.query(PriceTile).filter_by(
+        ds='20240102', z=10, x=tile_x, y=tile_y
+    ).one()
+    tile = unpack_tile(row.data)
+    assert np.nansum(tile['count']) == 4
+    assert np.nanmax(tile['median']) == 70000
+    assert np.nanmax(tile['change']) == pytest.approx(70000 / 60000 - 1)
+    # a rebuild replaces the tiles
+    assert build_price_tiles(session, '310000', '20240102') == built
+    assert session.query(PriceTile).count() == built
+
+
+def test_missing_values_are_not_cached():
+    cache = DsCache()
+    values = iter([None, 'tile'])
+    assert cache.get(('tile',), lambda: next(values)) is None
+    assert cache.get(('tile',), lambda: next(values)) == 'tile'
@@ -0,0 +1,120 @@
+from sqlalchemy import event, select
+
+from spider.models import Community, PageValidator
+from spider.validators import (
+    Validator, body_hash, conditional_headers, is_unchanged,
+    load_validators, save_validator
+)
+from spider.writer import BatchWriter
+
+
+PAGE = (
+    '<div class="title"><h1 class="main">Garden</h1></div>'
+    '<span class="xiaoquUnitPrice">65000</span>'
+).encode()
+
+
+class FakeResponse:
+    def __init__(self, status_code=200, content=PAGE, headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+
+
+def validator(etag=None, last_modified=None, content=PAGE) -> Validator:
+    return Validator('u', etag, last_modified, body_hash(content), '20260101')
+
+
+def test_conditional_headers():
+    assert conditional_headers(None) == {}
+    assert conditional_headers(
+        validator(etag='"v1"', last_modified='Thu, 01 Jan 2026')
+    ) == {
+        'if-none-match': '"v1"',
+        'if-modified-since': 'Thu, 01 Jan 2026',
+    }
+
+
+def test_is_unchanged():
+    assert is_unchanged(validator(), FakeResponse(304, b''))
+    assert is_unchanged(validator(), FakeResponse(200))
+    assert not is_unchanged(validator(), FakeResponse(200, b'new'))
+    assert not is_unchanged(None, FakeResponse(200))
+
+
+def test_error_pages_are_never_unchanged():
+    banned = validator(content=b'blocked')
+    assert not is_unchanged(banned, FakeResponse(429, b'blocked'))
+
+
+def test_save_validator_skips_error_pages(session):
+    with BatchWriter(session) as writer:
+        save_validator(writer, None, 'u', FakeResponse(403, b'no'), 'd1')
+        save_validator(writer, None, 'v', FakeResponse(503, b''), 'd1')
+    assert load_validators(session, ['u', 'v']) == {}
+
+
+def test_save_validator_insert_then_304_moves_ds(session):
+    with BatchWriter(session) as writer:
+        save_validator(
+            writer, None, 'u', FakeResponse(headers={'etag': '"v1"'}), 'd1'
+        )
+    saved = load_validators(session, ['u'])['u']
+    assert (saved.etag, saved.body_hash, saved.ds) == (
+        '"v1"', body_hash(PAGE), 'd1'
+    )
+    with BatchWriter(session) as writer:
+        save_validator(writer, saved, 'u', FakeResponse(304, b''), 'd2')
+    saved = load_validators(session, ['u'])['u']
+    assert (saved.etag, saved.ds) == ('"v1"', 'd2')
+
+
+def test_loaded_validators_survive_commits(engine, session):
+    with BatchWriter(session) as writer:
+        for url in ('u', 'v'):
+            save_validator(
+                writer, None, url, FakeResponse(headers={'etag': url}), 'd1'
+            )
+    validators = load_validators(session, ['u', 'v'])
+    statements = []
+    event.listen(
+        engine, 'before_cursor_execute',
+        lambda *args: statements.append(args[2])
+    )
+    # a group commit of the writer must not reload them one by one
+    session.commit()
+    assert [validators[url].etag for url in ('u', 'v')] == ['u', 'v']
+    assert conditional_headers(validators['u']) == {'if-none-match': 'u'}
+    assert statements == []
+
+
+def test_detail_stage_leaves_error_pages_uncrawled(
+    monkeypatch, spider, Session
+):
+    with Session() as session:
+        for community_id in (1, 2):
+            session.add(Community(
+                id=community_id, ds=spider.ds, city_code=spider.city_code,
+                is_detail_crawled=False,
+            ))
+        session.commit()
+    responses = {
+        spider.get_community_detail_url(1): FakeResponse(200),
+        spider.get_community_detail_url(2): FakeResponse(429, b'blocked'),
+    }
+    monkeypatch.setattr(
+        spider, 'get', lambda url, key=None, headers=None: responses[url]
+    )
+    with spider:
+        spider.crawl_community_detail()
+    with Session() as session:
+        rows = {
+            row.id: row for row in session.scalars(select(Community))
+        }
+        assert rows[1].is_detail_crawled
+        assert rows[1].main_title == 'Garden'
+        assert rows[1].unit_price_value == 65000
+        assert not rows[2].is_detail_crawled
+        assert rows[2].main_title is None
+        urls = [v.url for v in session.scalars(select(PageValidator))]
+        assert urls == [spider.get_community_detail_url(1)]
@@ -0,0 +1,48 @@
+import logging
+
+import pandas as pd
+import pytest
+
+from spider.warehouse import Warehouse, WarehouseError
+
+
+@pytest.fixture
+def archive_dir(tmp_path):
+    pytest.importorskip('pyarrow')
+    partition = tmp_path / 'archive/houses/city_code=310000/ds=20240101'
+    partition.mkdir(parents=True)
+    pd.DataFrame({
+        'id': [1, 2, 3],
+        'district_name': ['浦东', '浦东', '徐汇'],
+        'unit_price_value': [50000.0, 60000.0, 80000.0],
+        'total_price_value': [500.0, 600.0, 800.0],
+        'area_value': [100.0, 100.0, 100.0],
+    }).to_parquet(partition / 'part-0.parquet')
+    return tmp_path / 'archive'
+
+
+def test_unattached_store_is_logged(engine, archive_dir, caplog):
+    with caplog.at_level(logging.ERROR, logger='spider.warehouse'):
+        warehouse = Warehouse(str(engine.url), str(archive_dir))
+    assert warehouse.available
+    # offline hosts without the installed extension fail fast and say so
+    assert warehouse.attached or 'not attached' in caplog.text
+
+
+def test_report_over_the_archive(archive_dir, tmp_path):
+    warehouse = Warehouse(f'sqlite:///{tmp_path / "none.db"}', archive_dir)
+    result = warehouse.report(
+        'district_prices', {'city_code': '310000', 'ds': '20240101'}
+    )
+    assert result['rows'][0][:3] == ('浦东', 2, 52500.0)
+
+
+def test_only_single_selects(archive_dir):
+    warehouse = Warehouse('sqlite://', archive_dir, max_rows=2)
+    with pytest.raises(WarehouseError):
+        warehouse.query('DROP VIEW houses')
+    with pytest.raises(WarehouseError):
+        warehouse.query('SELECT 1; SELECT 2')
+    assert warehouse.query('SELECT id FROM houses ORDER BY id') == {
+        'columns': ['id'], 'rows': [(1,), (2,)], 'truncated': True,
+    }
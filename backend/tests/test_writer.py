@@ -0,0 +1,241 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+from sqlalchemy import func, select
+
+from spider.attributes import save_attributes
+from spider.lifecycle import track_listings
+from spider.models import (
+    Border, Community, CommunityAttribute, CommunityProgress, House,
+    HouseProgress, ListingEvent, ListingState
+)
+from spider.writer import BatchWriter
+
+
+HOUSE = {
+    'priceStr': '500万', 'unitPriceStr': '5万', 'tags': '', 'title': 't'
+}
+
+
+def count(session, model, *where) -> int:
+    return session.scalar(
+        select(func.count()).select_from(model).where(*where)
+    )
+
+
+def community(community_id: int, **values) -> dict:
+    return {'id': community_id, 'ds': 'd', 'city_code': 'c', **values}
+
+
+def test_items_are_committed_in_groups(session):
+    writer = BatchWriter(session, max_items=2)
+    with writer:
+        for i in range(5):
+            writer.insert(Community, community(i, name=f'n{i}'))
+            writer.update(Community, community(i, is_detail_crawled=True))
+            writer.done()
+    assert count(session, Community, Community.is_detail_crawled) == 5
+    stats = writer.stats()
+    assert stats['commits'] == 3
+    assert stats['items'] == 5
+
+
+def test_a_raising_stage_rolls_back_its_group(session):
+    writer = BatchWriter(session)
+    with pytest.raises(RuntimeError):
+        with writer:
+            writer.insert(Community, community(1))
+            writer.done()
+            raise RuntimeError
+    assert count(session, Community) == 0
+    assert writer.time_left() is None
+
+
+def test_rows_handed_over_twice_are_written_once(session):
+    with BatchWriter(session) as writer:
+        writer.insert(Community, community(1, name='first'))
+        writer.insert(Community, community(1, name='second'))
+        assert writer.is_pending(Community, community(1))
+    assert session.scalars(select(Community.name)).all() == ['first']
+
+
+def test_delete_and_insert_replace_rows(session):
+    infos = (
+        '{"建筑年代": "1998年", "开发商": "A"}',
+        '{"建筑年代": "2001"}',
+    )
+    for info in infos:
+        with BatchWriter(session) as writer:
+            save_attributes(writer, 1, 'd', 'c', info)
+    rows = session.execute(
+        select(CommunityAttribute.key, CommunityAttribute.value_num)
+    ).all()
+    assert rows == [('build_year', 2001.0)]
+
+
+def test_marks_are_written_with_their_data(session):
+    session.add(HouseProgress(ds='d', city_code='c', community_id=1))
+    session.commit()
+    progress_id = session.scalar(select(HouseProgress.id))
+    with BatchWriter(session) as writer:
+        writer.insert(House, {
+            'id': 7, 'ds': 'd', 'city_code': 'c', 'community_id': 1
+        })
+        writer.mark(HouseProgress, {
+            'id': progress_id, 'finished_page': 1, 'has_more': False
+        })
+        writer.done()
+    progress = session.get(HouseProgress, progress_id)
+    assert (progress.finished_page, progress.has_more) == (1, False)
+    assert count(session, House) == 1
+
+
+def test_time_left():
+    writer = BatchWriter(None, max_delay=2.0)
+    assert writer.time_left() is None
+    writer.insert(Community, community(1))
+    writer.done()
+    assert 0 < writer.time_left() <= 2.0
+
+
+def test_queued_writes_hold_no_lock(session, engine):
+    writer = BatchWriter(session)
+    track_listings(writer, 'c', 'd', 1, {7: HOUSE})
+    save_attributes(writer, 1, 'd', 'c', '{"开发商": "A"}')
+    writer.done()
+    # another writer gets the database at once
+    conn = sqlite3.connect(engine.url.database, timeout=0)
+    conn.execute('BEGIN IMMEDIATE')
+    conn.rollback()
+    conn.close()
+    writer.flush()
+    assert count(session, ListingState) == 1
+
+
+def test_listings_seen_on_an_earlier_page_are_tracked_once(session):
+    with BatchWriter(session) as writer:
+        track_listings(writer, 'c', 'd', 1, {7: HOUSE, 8: HOUSE})
+        track_listings(writer, 'c', 'd', 1, {8: HOUSE})
+    assert count(session, ListingEvent) == 2
+    changed = {**HOUSE, 'priceStr': '480万'}
+    with BatchWriter(session) as writer:
+        track_listings(writer, 'c', 'd2', 1, {7: changed, 8: HOUSE})
+    kinds = session.scalars(
+        select(ListingEvent.kind).where(ListingEvent.ds == 'd2')
+    ).all()
+    assert kinds == ['changed']
+
+
+def test_pause_commits_the_pending_group(spider, Session):
+    with spider:
+        spider.writer.insert(CommunityProgress, {
+            'id': 1, 'ds': spider.ds, 'city_code': spider.city_code
+        })
+        spider.writer.done()
+        spider.pause()
+        waiter = threading.Thread(target=spider.should_stop)
+        waiter.start()
+        time.sleep(0.2)
+        with Session() as session:
+            assert count(session, CommunityProgress) == 1
+        spider.resume()
+        waiter.join(timeout=5)
+
+
+def test_a_group_due_while_waiting_for_a_response_is_committed(
+    monkeypatch, spider, Session
+):
+    class SlowResponse:
+        status_code = 200
+
+    def get(url, key=None, headers=None):
+        time.sleep(0.5)
+        return SlowResponse()
+
+    monkeypatch.setattr(spider, 'get', get)
+    with spider:
+        spider.writer.max_delay = 0.1
+        spider.writer.insert(CommunityProgress, {
+            'id': 1, 'ds': spider.ds, 'city_code': spider.city_code
+        })
+        spider.writer.done()
+        responses = spider.fetch_all(['u'])
+        next(responses)
+        assert spider.writer.stats()['commits'] == 1
+        with Session() as session:
+            assert count(session, CommunityProgress) == 1
+
+
+def test_house_list_stage_writes_through_the_writer(
+    monkeypatch, spider, Session
+):
+    class ListResponse:
+        status_code = 200
+
+        def __init__(self, page: int) -> None:
+            self.page = page
+
+        def raise_for_status(self):
+            pass
+
+        def json(self):
+            return {'data': {
+                'hasMore': self.page < 2,
+                'list': [{
+                    **HOUSE,
+                    'actionUrl': f'https://sh.ke.com/ershoufang/{house}.html',
+                    'tags': [{'desc': 'near metro'}],
+                } for house in (self.page * 10, self.page * 10 + 1)],
+            }}
+
+    def get(url, key=None, headers=None):
+        return ListResponse(int(url.split('curPage=')[1].split('&')[0]))
+
+    monkeypatch.setattr(spider, 'get', get)
+    with Session() as session:
+        session.add(Community(id=1, ds=spider.ds, city_code='310000'))
+        session.commit()
+    with spider:
+        spider.init_house_progress()
+        spider.crawl_house_list()
+    with Session() as session:
+        assert session.scalars(select(House.id).order_by(House.id)).all() \
+            == [10, 11, 20, 21]
+        assert count(session, ListingEvent, ListingEvent.kind == 'new') == 4
+        progress = session.scalars(select(HouseProgress)).one()
+        assert (progress.finished_page, progress.has_more) == (2, False)
+
+
+def test_community_list_stage_writes_through_the_writer(
+    monkeypatch, spider, Session
+):
+    border = '121.01,31.01;121.02,31.01;121.02,31.02'
+
+    class BubbleResponse:
+        status_code = 200
+
+        def raise_for_status(self):
+            pass
+
+        def json(self):
+            # neighbouring tiles overlap, so every tile lists both
+            return {'data': {'bubbleList': [
+                {'id': 1, 'name': 'Garden', 'border': border},
+                {'id': 2, 'name': 'Court', 'border': border},
+            ]}}
+
+    monkeypatch.setattr(
+        spider, 'get', lambda url, key=None, headers=None: BubbleResponse()
+    )
+    with spider:
+        spider.init_community_progress()
+        spider.crawl_community_list()
+    with Session() as session:
+        assert session.scalars(select(Community.name).order_by(Community.id)) \
+            .all() == ['Garden', 'Court']
+        assert count(session, Border) == 1
+        assert count(session, CommunityProgress) == count(
+            session, CommunityProgress, CommunityProgress.is_finished
+        ) > 0
@@ -0,0 +1,69 @@
+"""Backend client shared by all pages.
+
+Requests go through one pooled `requests.Session` per server process, so
+reruns reuse open connections. Read endpoints are wrapped in
+`st.cache_data`, keyed by the endpoint function and its (city, ds)
+arguments and shared by all viewers: the city list hardly ever changes,
+analytics of a crawled ds change at most once a day, and the monitoring
+dashboard is polled by every open page but fetched once per TTL.
+"""
+import os
+
+import requests
+import streamlit as st
+from requests.adapters import HTTPAdapter
+
+
+base_url = os.getenv('BACKEND_URL') or 'http://localhost:8000'
+TIMEOUT = 30
+
+
+@st.cache_resource
+def http_session() -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def get(path: str, **params) -> dict:
+    res = http_session().get(
+        f'{base_url}{path}', params=params, timeout=TIMEOUT
+    )
+    res.raise_for_status()
+    return res.json()
+
+
+def post(path: str, **params) -> dict:
+    res = http_session().post(
+        f'{base_url}{path}', params=params, timeout=TIMEOUT
+    )
+    res.raise_for_status()
+    return res.json()
+
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def city_list() -> dict[str, str]:
+    return get('/city_list')
+
+
+@st.cache_data(ttl=300, show_spinner=False)
+def ds_list(city_code: str) -> list[str]:
+    return get('/analytics/ds_list', city_code=city_code)['ds_list']
+
+
+@st.cache_data(ttl=300, show_spinner=False)
+def analytics_dashboard(city_code: str, ds: str) -> dict:
+    return get('/analytics/dashboard', city_code=city_code, ds=ds)
+
+
+@st.cache_data(ttl=2, show_spinner=False)
+def dashboard(city_code: str) -> dict:
+    return get('/dashboard', city_code=city_code)
+
+
+@st.cache_data(ttl=2, show_spinner=False)
+def spider_log(city_code: str, ds: str, offset: int) -> dict:
+    """The log text after `offset`; `ds` only keys the cache."""
+    return get('/spider_log', city_code=city_code, offset=offset)
@@ -1,4 +1,74 @@
+import pandas as pd
 import streamlit as st
 
+import client
 
-st.title('Data Analysis')
+
+def page_header():
+    city_list = client.city_list()
+    with st.container(horizontal=True, vertical_alignment='bottom'):
+        st.title('Data Analysis')
+        st.selectbox(
+            'Choose city:',
+            options=city_list.keys(),
+            key='analysis_city'
+        )
+    city_code = city_list[st.session_state.analysis_city]
+    ds_list = client.ds_list(city_code)
+    if not ds_list:
+        st.info(f'No data crawled for {st.session_state.analysis_city} yet')
+        return None, None
+    st.selectbox('Choose date:', options=ds_list, key='analysis_ds')
+    return city_code, st.session_state.analysis_ds
+
+
+def dashboard(city_code: str, ds: str):
+    result = client.analytics_dashboard(city_code, ds)
+
+    summary = result['summary']
+    col1, col2, col3 = st.columns(3)
+    col1.metric('Listings', summary['listing_count'], border=True)
+    col2.metric('Communities', summary['community_count'], border=True)
+    col3.metric(
+        'Median Unit Price',
+        f"{summary['median_unit_price'] or 0:,.0f}",
+        border=True
+    )
+
+    day_over_day = result['day_over_day']
+    if day_over_day is not None:
+        st.subheader(f"Changes since {day_over_day['prev_ds']}")
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric('New', day_over_day['new_count'], border=True)
+        col2.metric('Removed', day_over_day['removed_count'], border=True)
+        col3.metric('Price Up', day_over_day['price_up_count'], border=True)
+        col4.metric(
+            'Price Down', day_over_day['price_down_count'], border=True
+        )
+
+    st.subheader('Unit Price Distribution')
+    histogram = result['unit_price_histogram']
+    if histogram['counts']:
+        st.bar_chart(
+            pd.DataFrame(
+                {'count': histogram['counts']},
+                index=[f'{edge:,.0f}' for edge in histogram['edges'][:-1]]
+            )
+        )
+
+    st.subheader('Unit Price by District')
+    districts = pd.DataFrame(result['districts']).set_index('district_name')
+    st.bar_chart(districts['median'])
+    st.dataframe(districts)
+
+    st.subheader('Unit Price by Block')
+    st.dataframe(pd.DataFrame(result['blocks']).set_index('block_name'))
+
+
+def main():
+    city_code, ds = page_header()
+    if city_code is not None:
+        dashboard(city_code, ds)
+
+
+main()
@@ -1,68 +1,59 @@
-import os
-import sqlite3
 import time
 
 import streamlit as st
-import requests
 
-
-base_url = os.getenv('BACKEND_URL') or 'http://localhost:8000'
+import client
 
 
 def page_header():
-    st.session_state.city_list = requests.get(f'{base_url}/spider_log').json()
+    city_list = client.city_list()
     with st.container(horizontal=True, vertical_alignment='bottom'):
         st.title('Spider Monitoring')
         st.selectbox(
-            'Choose city:', 
-            options=st.session_state.city_list.keys(),
+            'Choose city:',
+            options=city_list.keys(),
             key='selected_city'
         )
+    return city_list[st.session_state.selected_city]
 
 
-@st.fragment(run_every=5)
-def spider_control():
-    res = requests.get(f'{base_url}/is_spider_running')
-    res.raise_for_status()
-    if res.json()['is_spider_running']:
-        st.info('Spider is running')
+def spider_control(city_code: str, dashboard: dict):
+    if dashboard['is_spider_running']:
+        st.info(f"Spider is running for {dashboard['status']['city_code']}")
         st.button(
-            'Stop Spider', 
-            icon=':material/stop:', 
+            'Stop Spider',
+            icon=':material/stop:',
             key='stop_spider',
             # type='secondary'
         )
     else:
         st.info('Spider is not running')
         st.button(
-            'Start Spider', 
-            icon=':material/play_arrow:', 
+            'Start Spider',
+            icon=':material/play_arrow:',
             key='start_spider',
             # type='primary'
         )
     if st.session_state.get('stop_spider'):
-        res = requests.post(f'{base_url}/stop_spider')
-        res.raise_for_status()
+        client.post('/stop_spider')
         time.sleep(2)  # wait for the spider to stop
+        client.dashboard.clear()
         st.rerun()
 
     if st.session_state.get('start_spider'):
-        res = requests.post(f'{base_url}/run_spider')
-        res.raise_for_status()
+        client.post('/run_spider', city_code=city_code)
         time.sleep(2)  # wait for the spider to start
+        client.dashboard.clear()
         st.rerun()
 
 
-@st.fragment(run_every=5)
-def spider_progress():
+def spider_progress(dashboard: dict):
     st.subheader('Spider Progress')
-    res = requests.get(f'{base_url}/spider_progress')
-    res.raise_for_status()
-    progress = res.json()
-    st.text(f"Data Date: {progress['ds']}")
+    progress = dashboard['progress']
+    st.text(f"Data Date: {dashboard['ds']}")
     col1, col2 = st.columns(2)
     col1.metric(
-        label="Community List", 
+        label="Community List",
         value=(
             f"{progress['community_list']['finished']}/"
             f"{progress['community_list']['total']}"
@@ -70,7 +61,7 @@ def spider_progress():
         border=True
     )
     col2.metric(
-        label="House List", 
+        label="House List",
         value=(
             f"{progress['house_list']['finished']}/"
             f"{progress['house_list']['total']}"
@@ -79,7 +70,7 @@ def spider_progress():
     )
     col1, col2 = st.columns(2)
     col1.metric(
-        label="Community Detail", 
+        label="Community Detail",
         value=(
             f"{progress['community_detail']['finished']}/"
             f"{progress['community_detail']['total']}"
@@ -87,7 +78,7 @@ def spider_progress():
         border=True
     )
     col2.metric(
-        label="House Detail", 
+        label="House Detail",
         value=(
             f"{progress['house_detail']['finished']}/"
             f"{progress['house_detail']['total']}"
@@ -96,30 +87,43 @@ def spider_progress():
     )
 
 
-@st.fragment(run_every=5)
-def spider_log():
+def spider_log(city_code: str, dashboard: dict):
     st.subheader('Spider Log')
-    result = requests.get(f'{base_url}/spider_log').json()
-    spider_log = result['spider_log']
-    ds = result['ds']
+    ds = dashboard['ds']
     st.text(f"Data Date: {ds}")
-    if not spider_log:
+    # the log seen so far, extended with only the bytes written since
+    key = f'spider_log_{city_code}_{ds}'
+    offset, text = st.session_state.get(key, (0, ''))
+    if dashboard['log_size'] < offset:
+        offset, text = 0, ''
+    if dashboard['log_size'] > offset:
+        result = client.spider_log(city_code, ds, offset)
+        offset, text = result['next_offset'], text + result['spider_log']
+        st.session_state[key] = (offset, text)
+    if not text:
         st.text(f'Spider for date {ds} has not started')
     else:
         st.download_button(
             label=f"Download spider log",
-            data=spider_log,
-            file_name=f"spider_{ds}.txt",
+            data=text,
+            file_name=f"spider_{city_code}_{ds}.txt",
             on_click="ignore",
             icon=":material/download:",
         )
 
 
+@st.fragment(run_every=5)
+def spider_dashboard(city_code: str):
+    # one cached round trip for everything the page polls
+    dashboard = client.dashboard(city_code)
+    spider_control(city_code, dashboard)
+    spider_progress(dashboard)
+    spider_log(city_code, dashboard)
+
+
 def main():
-    
-    spider_control()
-    spider_progress()
-    spider_log()
-    
+    city_code = page_header()
+    spider_dashboard(city_code)
+
 
 main()